@@ -0,0 +1,272 @@
+import argparse
+import http.client
+import itertools
+import json
+import math
+import os
+import sys
+import threading
+from time import perf_counter, sleep, time
+from urllib.parse import urlsplit
+
+METHODS = {
+    "direct": 0,
+    "random": 1,
+    "custom": 2,
+    "least_loaded": 3
+}
+
+# Upper bounds, in ms, of the latency histogram buckets
+HISTOGRAM_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float("inf")]
+
+
+def get_absolute_path(relative_path: str):
+    return os.path.join(sys.path[0], relative_path)
+
+def load_workload(path: str):
+    """
+    Read a workload file. Each line is a JSON object with a query, a type, "read" or "write", and
+    optionally the list of params of the query.
+
+    @param path: str                        Path of the JSONL workload file
+
+    @return: list[dict]                     Statements of the workload
+    """
+    statements = []
+    with open(path, 'r') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if line == '':
+                continue
+            statement = json.loads(line)
+            if (
+                not isinstance(statement.get('query'), str)
+                or statement.get('type', 'read') not in ('read', 'write')
+                or not isinstance(statement.get('params', []), list)
+            ):
+                raise ValueError(f"Invalid statement at line {line_number} of {path}")
+            statements.append(statement)
+
+    if len(statements) == 0:
+        raise ValueError(f"Workload {path} is empty")
+    return statements
+
+def percentile(sorted_values: "list[float]", p: float):
+    """
+    @return: float                          Nearest-rank percentile p (0-100) of sorted_values
+    """
+    if len(sorted_values) == 0:
+        return None
+    rank = max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+def summarize(latencies: "list[float]", errors: int, elapsed: float, reads: int = 0, cached: int = 0):
+    """
+    Compute the statistics of a run.
+
+    @param latencies: list[float]           Latency of every request, in ms
+    @param errors: int                      Number of failed requests
+    @param elapsed: float                   Duration of the run, in seconds
+    @param reads: int                       Number of successful reads
+    @param cached: int                      Number of reads answered from the result cache of the proxy
+
+    @return: dict                           Throughput, latency percentiles, histogram and cache hit ratio
+    """
+    latencies = sorted(latencies)
+    histogram = [0] * len(HISTOGRAM_BUCKETS)
+    bucket = 0
+    for latency in latencies:
+        while latency > HISTOGRAM_BUCKETS[bucket]:
+            bucket += 1
+        histogram[bucket] += 1
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "reads": reads,
+        "cached": cached,
+        # Reads answered by the cache never reached the routing method
+        "cache_hit_ratio": cached / reads if reads > 0 else None,
+        "latency_ms": {
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else None
+        },
+        "histogram_ms": {
+            (f"<={bound:g}" if bound != float("inf") else f">{HISTOGRAM_BUCKETS[-2]:g}"): count
+            for bound, count in zip(HISTOGRAM_BUCKETS, histogram)
+        }
+    }
+
+def run_method(
+    gatekeeper_url: str,
+    statements: "list[dict]",
+    method_id: int,
+    concurrency: int,
+    requests: int,
+    duration: float,
+    rate: float,
+    classify: bool = False,
+    hedge: bool = False
+):
+    """
+    Replay the workload against the gatekeeper with one method.
+
+    With a rate, request i is scheduled at start + i / rate and its latency is measured from that
+    time, so that a slow server isn't hidden by requests being sent late.
+
+    @param gatekeeper_url: str              Base URL of the gatekeeper, ex. http://127.0.0.1:5000
+    @param statements: list[dict]           Workload, replayed in a loop
+    @param method_id: int                   Routing method of the reads
+    @param concurrency: int                 Number of requests in flight at the same time
+    @param requests: int                    Number of requests to send, None to run for duration
+    @param duration: float                  Seconds to run for when requests is None
+    @param rate: float                      Requests per second to send, None for as fast as possible
+    @param classify: bool                   Send every statement to /query and let the gatekeeper route it
+    @param hedge: bool                      Ask the proxy to hedge the reads
+
+    @return: dict                           Statistics of the run
+    """
+    url = urlsplit(gatekeeper_url)
+    counter = itertools.count()
+    latencies = []
+    errors = []
+    reads = []
+    cached = []
+    lock = threading.Lock()
+
+    start = perf_counter()
+    end = start + duration if requests is None else None
+
+    def worker():
+        connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=60)
+        worker_latencies = []
+        worker_errors = 0
+        worker_reads = 0
+        worker_cached = 0
+        while True:
+            i = next(counter)
+            if requests is not None and i >= requests:
+                break
+
+            scheduled = perf_counter()
+            if rate is not None:
+                scheduled = start + i / rate
+                delay = scheduled - perf_counter()
+                if delay > 0:
+                    sleep(delay)
+            if end is not None and perf_counter() >= end:
+                break
+
+            statement = statements[i % len(statements)]
+            if classify:
+                path = f'/query?method_id={method_id}'
+            elif statement.get('type', 'read') == 'write':
+                path = '/write-query'
+            else:
+                path = f'/read-query?method_id={method_id}'
+            if hedge and path != '/write-query':
+                path += '&hedge=1'
+            body = {"query": statement["query"]}
+            if "params" in statement:
+                body["params"] = statement["params"]
+            body = json.dumps(body).encode("utf-8")
+
+            try:
+                connection.request('POST', url.path.rstrip('/') + path, body=body, headers={'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                payload = response.read()
+                content = json.loads(payload) if response.status == 200 else {}
+                failed = response.status != 200 or content.get("error", False)
+                if not failed and statement.get('type', 'read') != 'write':
+                    worker_reads += 1
+                    worker_cached += 1 if content.get("cached", False) else 0
+            except (OSError, http.client.HTTPException, ValueError):
+                connection.close()
+                failed = True
+
+            worker_latencies.append((perf_counter() - scheduled) * 1000)
+            if failed:
+                worker_errors += 1
+
+        connection.close()
+        with lock:
+            latencies.extend(worker_latencies)
+            errors.append(worker_errors)
+            reads.append(worker_reads)
+            cached.append(worker_cached)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return summarize(latencies, sum(errors), perf_counter() - start, sum(reads), sum(cached))
+
+def print_table(results: "dict[str, dict]"):
+    """
+    Print the statistics of every method as a table.
+    """
+    columns = ["method", "requests", "errors", "rps", "cached", "mean", "p50", "p95", "p99", "max"]
+    print(("{:<10}" + "{:>10}" * (len(columns) - 1)).format(*columns))
+    for method, result in results.items():
+        latency = result["latency_ms"]
+        values = [latency[key] for key in ("mean", "p50", "p95", "p99", "max")]
+        hit_ratio = result["cache_hit_ratio"]
+        print(("{:<10}{:>10}{:>10}{:>10.1f}{:>9.1f}%" + "{:>10.2f}" * len(values)).format(
+            method, result["requests"], result["errors"], result["throughput_rps"],
+            hit_ratio * 100 if hit_ratio is not None else float("nan"),
+            *[value if value is not None else float("nan") for value in values]
+        ))
+    print("(latencies in ms, cached: share of the reads answered by the result cache of the proxy)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay a workload against the gatekeeper and measure latency per routing method.")
+    parser.add_argument("--gatekeeper", default="http://127.0.0.1:5000", help="Base URL of the gatekeeper")
+    parser.add_argument("--workload", default=get_absolute_path('workload.jsonl'), help="JSONL file of statements")
+    parser.add_argument("--methods", default=",".join(METHODS.keys()), help="Comma separated routing methods among " + ", ".join(METHODS.keys()))
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at the same time")
+    parser.add_argument("--requests", type=int, default=None, help="Requests per method, defaults to running for --duration")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run each method for")
+    parser.add_argument("--rate", type=float, default=None, help="Requests per second, defaults to as fast as possible")
+    parser.add_argument("--classify", action="store_true", help="Send every statement to /query instead of /read-query or /write-query")
+    parser.add_argument("--hedge", action="store_true", help="Hedge the reads, see HEDGE_PERCENTILE on the proxy")
+    parser.add_argument("--output", default=get_absolute_path('benchmark_result.json'), help="File receiving the JSON report")
+    args = parser.parse_args()
+
+    statements = load_workload(args.workload)
+    methods = [method.strip() for method in args.methods.split(",") if method.strip() != ""]
+    for method in methods:
+        if method not in METHODS:
+            parser.error(f"Unknown method {method}")
+
+    results = {}
+    for method in methods:
+        print(f"Benchmarking method {method}")
+        results[method] = run_method(
+            args.gatekeeper, statements, METHODS[method], args.concurrency, args.requests, args.duration, args.rate,
+            args.classify, args.hedge
+        )
+        print("done\n")
+
+    print_table(results)
+
+    report = {
+        "timestamp": time(),
+        "gatekeeper": args.gatekeeper,
+        "workload": args.workload,
+        "concurrency": args.concurrency,
+        "rate": args.rate,
+        "classify": args.classify,
+        "hedge": args.hedge,
+        "results": results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
@@ -0,0 +1,49 @@
+#!/bin/bash
+
+# Run the gatekeeper and the proxy locally, in front of a MySQL server standing in for the NDB cluster,
+# then benchmark the routing methods. Arguments are passed to run_benchmark.py.
+#
+# The MySQL server must have the sakila database and listen on all loopback addresses, for example:
+#   docker run -d --name sakila-mysql -p 3306:3306 -e MYSQL_ROOT_PASSWORD=root mysql:8
+# then load sakila-schema.sql and sakila-data.sql into it.
+#
+# The manager and each data node get a different loopback address so they have their own connection pool
+# and latency measure, even though they reach the same server.
+
+# Exit immediately if a command exits with a non-zero status.
+set -e
+
+cd "$(dirname "$0")/.."
+
+export USER=${MYSQL_USER:-root}
+export PASSWORD=${MYSQL_PASSWORD:-root}
+export DATABASE=sakila
+export MYSQL_PORT=${MYSQL_PORT:-3306}
+export MANAGER_HOST=127.0.0.1
+export DATA_NODES_HOST=127.0.0.2,127.0.0.3,127.0.0.4
+# The workload repeats the same reads, with the result cache on they would barely reach the routing methods
+export CACHE_ENABLED=${CACHE_ENABLED:-0}
+
+GATEKEEPER_PORT=${GATEKEEPER_PORT:-5000}
+PROXY_PORT=${PROXY_PORT:-5001}
+
+PORT=$PROXY_PORT python3 patterns_app/remote_proxy_app.py > benchmark/proxy_log.txt 2>&1 &
+proxy_pid=$!
+PORT=$GATEKEEPER_PORT PROXY_HOST=127.0.0.1 PROXY_PORT=$PROXY_PORT python3 patterns_app/gatekeeper_app.py > benchmark/gatekeeper_log.txt 2>&1 &
+gatekeeper_pid=$!
+trap 'kill $proxy_pid $gatekeeper_pid' EXIT
+
+# Wait for both applications to answer
+for port in $PROXY_PORT $GATEKEEPER_PORT
+do
+    for attempt in $(seq 1 50)
+    do
+        if curl -sf "http://127.0.0.1:$port/" > /dev/null
+        then
+            break
+        fi
+        sleep 0.2
+    done
+done
+
+python3 benchmark/run_benchmark.py --gatekeeper "http://127.0.0.1:$GATEKEEPER_PORT" "$@"
@@ -1,13 +1,35 @@
 import boto3
 import pickle
+import threading
 import http.client
-from time import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from time import sleep, time
 from dataclasses import dataclass
 from ipaddress import IPv4Network
 
 
-ec2_client = boto3.client('ec2')
-ec2 = boto3.resource('ec2')
+# boto3 clients can be shared between threads, resources can't
+_ec2_client = None
+_ec2_client_lock = threading.Lock()
+_thread_resources = threading.local()
+
+def get_ec2_client():
+    """
+    Returns the EC2 client, created on first use so that importing the module doesn't need AWS credentials.
+    """
+    global _ec2_client
+    with _ec2_client_lock:
+        if _ec2_client is None:
+            _ec2_client = boto3.client('ec2')
+    return _ec2_client
+
+def get_ec2_resource():
+    """
+    Returns an EC2 resource owned by the calling thread.
+    """
+    if not hasattr(_thread_resources, 'ec2'):
+        _thread_resources.ec2 = boto3.session.Session().resource('ec2')
+    return _thread_resources.ec2
 
 @dataclass
 class InfraInfo:
@@ -21,14 +43,14 @@ def get_key_pair_name():
     """
     Returns a key pair name.
     """
-    key_pairs = ec2_client.describe_key_pairs()['KeyPairs']
+    key_pairs = get_ec2_client().describe_key_pairs()['KeyPairs']
     selected_key_pair_name = ''
 
     if len(key_pairs) > 0:
         selected_key_pair_name = key_pairs[0]['KeyName']
     else:
         # Create a key pair if we don't already have one
-        selected_key_pair_name = ec2_client.create_key_pair(KeyName='log8415_key')['KeyName']
+        selected_key_pair_name = get_ec2_client().create_key_pair(KeyName='log8415_key')['KeyName']
 
     return selected_key_pair_name
 
@@ -36,7 +58,7 @@ def get_vpc_id():
     """
     Returns the default Virtual Private Cloud ID.
     """
-    vpcs = ec2_client.describe_vpcs()['Vpcs']
+    vpcs = get_ec2_client().describe_vpcs()['Vpcs']
     selected_vpc = ''
 
     if len(vpcs) > 0:
@@ -46,7 +68,7 @@ def get_vpc_id():
                 return selected_vpc
     else:
         # Create a vpc if we don't already have one
-        selected_vpc = ec2_client.create_vpc(CidrBlock='172.31.0.0/16')['Vpc']['VpcId']
+        selected_vpc = get_ec2_client().create_vpc(CidrBlock='172.31.0.0/16')['Vpc']['VpcId']
 
     return selected_vpc
 
@@ -58,27 +80,27 @@ def get_subnets(vpc_id:str):
 
     @return             list of dict representing subnets
     """
-    subnets = ec2_client.describe_subnets(
+    subnets = get_ec2_client().describe_subnets(
         Filters=[{'Name': 'vpc-id', 'Values': [vpc_id]}]
     )['Subnets']
 
     if len(subnets) == 0:
         # Create two subnets in vpc if none
 
-        vpc_cidr = ec2_client.describe_vpcs(Filters=[{'Name': 'vpc-id', 'Values': [vpc_id]}])['Vpcs'][0]['CidrBlock']
+        vpc_cidr = get_ec2_client().describe_vpcs(Filters=[{'Name': 'vpc-id', 'Values': [vpc_id]}])['Vpcs'][0]['CidrBlock']
         vpc_net = IPv4Network(vpc_cidr)
         vpc_subnets = list(vpc_net.subnets())
         assert len(vpc_subnets) >= 2
 
-        subnets.append(ec2_client.create_subnet(CidrBlock=str(vpc_subnets[0]), VpcId=vpc_id)['Subnet'])
-        subnets.append(ec2_client.create_subnet(CidrBlock=str(vpc_subnets[1]), VpcId=vpc_id)['Subnet'])
+        subnets.append(get_ec2_client().create_subnet(CidrBlock=str(vpc_subnets[0]), VpcId=vpc_id)['Subnet'])
+        subnets.append(get_ec2_client().create_subnet(CidrBlock=str(vpc_subnets[1]), VpcId=vpc_id)['Subnet'])
     elif len(subnets) == 1:
         # Create a 2nd subnet in vpc if only one 
 
         sn_cidr = subnets[0]['CidrBlock']
         sn_mask = sn_cidr.split("/", 1)[1]
         
-        vpc_cidr = ec2_client.describe_vpcs(Filters=[{'Name': 'vpc-id', 'Values': [vpc_id]}])['Vpcs'][0]['CidrBlock']
+        vpc_cidr = get_ec2_client().describe_vpcs(Filters=[{'Name': 'vpc-id', 'Values': [vpc_id]}])['Vpcs'][0]['CidrBlock']
         vpc_net = IPv4Network(vpc_cidr)
         # Get subnets in vpc network based on first subnet mask
         vpc_subnets = list(vpc_net.subnets( new_prefix=int(sn_mask) ))
@@ -86,7 +108,7 @@ def get_subnets(vpc_id:str):
 
         # Find a cidr different from the first subnet one
         cidr = str(vpc_subnets[0]) if str(vpc_subnets[0]) != sn_cidr else str(vpc_subnets[1])
-        subnets.append(ec2_client.create_subnet(CidrBlock=cidr, VpcId=vpc_id)['Subnet'])
+        subnets.append(get_ec2_client().create_subnet(CidrBlock=cidr, VpcId=vpc_id)['Subnet'])
 
     return subnets
 
@@ -125,7 +147,7 @@ def create_security_group(group_name:str, description:str, vpc_id:str, tags:"dic
     """
     print("Creating security group: ", group_name)
 
-    security_group = ec2.create_security_group(
+    security_group = get_ec2_resource().create_security_group(
         GroupName=group_name, 
         Description=description, 
         VpcId=vpc_id,
@@ -146,7 +168,7 @@ def create_security_group(group_name:str, description:str, vpc_id:str, tags:"dic
     print("done\n")
     return security_group
 
-def authorize_ingress(security_group:ec2.SecurityGroup, rules: list[dict]):
+def authorize_ingress(security_group:"ec2.SecurityGroup", rules: list[dict]):
     if len(rules) > 0:
         ingress_IpPermissions=[]
         for rule in rules:
@@ -158,7 +180,7 @@ def authorize_ingress(security_group:ec2.SecurityGroup, rules: list[dict]):
             IpPermissions=ingress_IpPermissions
         )
 
-def authorize_egress(security_group:ec2.SecurityGroup, rules: list[dict]):
+def authorize_egress(security_group:"ec2.SecurityGroup", rules: list[dict]):
     if len(rules) > 0:
         egress_IpPermissions=[]
         for rule in rules:
@@ -179,11 +201,11 @@ def get_security_groups_ids(filters:"list[dict]"):
     sec_group_ids = []
 
     if len(filters) > 0:
-        security_groups = ec2_client.describe_security_groups(
+        security_groups = get_ec2_client().describe_security_groups(
             Filters=filters
         )['SecurityGroups']
     else:
-        security_groups = ec2_client.describe_instances()['SecurityGroups']
+        security_groups = get_ec2_client().describe_instances()['SecurityGroups']
 
     if len(security_groups) > 0:
         for sec_group in security_groups:
@@ -199,7 +221,7 @@ def delete_security_group(group_id:str):
     @return                 True if successful.
     """
     print("Deleting security group: ", group_id)
-    return ec2_client.delete_security_group(GroupId=group_id)
+    return get_ec2_client().delete_security_group(GroupId=group_id)
 
 def save_infra_info(infra_info:InfraInfo, path:str):
     """
@@ -243,4 +265,89 @@ def filters_from_tags(tags: "dict[str, str]"):
             }
         )
     
-    return filters
\ No newline at end of file
+    return filters
+
+def poll_until(check, error_message: str, deadline: float, initial_delay: float = 1.0, max_delay: float = 15.0):
+    """
+    Call check until it returns True, waiting exponentially longer between two attempts.
+    An exception raised by check counts as a failed attempt.
+
+    @param check: callable                  Function returning True once the awaited condition is met
+    @param error_message: str               Message of the exception raised if deadline is reached
+    @param deadline: float                  Time (as returned by time.time) after which to give up
+    @param initial_delay: float             Seconds to wait after the first failed attempt
+    @param max_delay: float                 Maximum number of seconds between two attempts
+
+    @return: float                          Seconds elapsed until check succeeded
+    """
+    start = time()
+    delay = initial_delay
+    while True:
+        try:
+            if check():
+                return time() - start
+        except Exception:
+            pass
+
+        remaining = deadline - time()
+        if remaining <= 0:
+            raise Exception(error_message)
+        sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+def http_endpoint_ready(host: str, port: int, path: str = '/', timeout: float = 5.0):
+    """
+    @return: bool                           Whether GET path on host:port answers with status 200
+    """
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request('GET', path)
+        return connection.getresponse().status == 200
+    finally:
+        connection.close()
+
+def run_dag(tasks: "dict[str, tuple]", max_workers: int):
+    """
+    Run tasks concurrently, each one as soon as all the tasks it depends on succeeded.
+    Once a task failed, no new task is started but the running ones are waited for.
+
+    @param tasks: dict[str, tuple]          Task name -> (function, list of names of the tasks it depends on).
+                                            The function is called with a dict holding the results of its dependencies.
+    @param max_workers: int                 Maximum number of tasks running at the same time
+
+    @return: dict[str, object], dict[str, Exception]    Results of the tasks that succeeded, errors of the ones that failed
+    """
+    for name, (_, dependencies) in tasks.items():
+        for dependency in dependencies:
+            if dependency not in tasks:
+                raise ValueError(f"Task {name} depends on unknown task {dependency}")
+
+    pending = dict(tasks)
+    results = {}
+    errors = {}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            if not errors:
+                for name, (function, dependencies) in list(pending.items()):
+                    if all(dependency in results for dependency in dependencies):
+                        del pending[name]
+                        inputs = { dependency: results[dependency] for dependency in dependencies }
+                        running[executor.submit(function, inputs)] = name
+
+            if not running:
+                break
+
+            done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    errors[name] = e
+
+    if pending and not errors:
+        raise ValueError(f"Tasks {', '.join(pending.keys())} have circular dependencies")
+
+    return results, errors
@@ -1,9 +1,5 @@
 import base64
-import boto3
-
-ec2_client = boto3.client('ec2') 
-ec2 = boto3.resource('ec2')
-elb = boto3.client("elbv2")
+from infra_utils import get_ec2_client, get_ec2_resource
 
 
 def create_ubuntu_instances(
@@ -36,7 +32,7 @@ def create_ubuntu_instances(
     @return                             response containing the instance IDs and other data 
     """
     print("Creating instances of type: ", instance_type)
-    instances = ec2.create_instances(
+    instances = get_ec2_resource().create_instances(
         ImageId='ami-08c40ec9ead489470',
         MinCount=min_count,
         MaxCount=max_count,
@@ -78,7 +74,7 @@ def stopped_instances_ids(instances_ids:"list[str]"):
     @return                            Found ids
     """
     stopped_instances_ids = []
-    instances_to_remove = ec2_client.describe_instances(
+    instances_to_remove = get_ec2_client().describe_instances(
         Filters=[
             {
                 'Name': 'instance-state-name',
@@ -105,11 +101,11 @@ def get_instances_ids(filters:"list[dict]"):
     instances_ids = []
 
     if len(filters) > 0:
-        instances = ec2_client.describe_instances(
+        instances = get_ec2_client().describe_instances(
             Filters=filters
         )['Reservations']
     else:
-        instances = ec2_client.describe_instances()['Reservations']
+        instances = get_ec2_client().describe_instances()['Reservations']
 
     if len(instances) > 0:
         for instances_block in instances:
@@ -126,10 +122,10 @@ def terminate_instances(instance_ids:"list[str]"):
     @return: dict
     """
     print("Terminating instances")
-    response = ec2_client.terminate_instances(InstanceIds=instance_ids)
+    response = get_ec2_client().terminate_instances(InstanceIds=instance_ids)
     
     # Wait for instances to terminate
-    waiter = ec2_client.get_waiter('instance_terminated')
+    waiter = get_ec2_client().get_waiter('instance_terminated')
     waiter.wait(InstanceIds=instance_ids)
 
     return response
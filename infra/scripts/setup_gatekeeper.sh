@@ -11,4 +11,17 @@ cd LOG8415E-Project
 pip install -r gatekeeper_requirements.txt
 
 export PROXY_HOST=$proxy_host
-nohup python3 patterns_app/gatekeeper_app.py > flask_log.txt 2>&1 &
+export PROXY_POOL_SIZE=20
+export SERVING_MODE=$serving_mode
+if [ "$serving_mode" == "async" ]
+then
+    nohup python3 -m uvicorn async_gatekeeper_app:app --app-dir patterns_app --host 0.0.0.0 --port 5000 > flask_log.txt 2>&1 &
+elif [ "$serving_mode" == "production" ]
+then
+    nohup python3 -m gunicorn -c patterns_app/gunicorn_conf.py --chdir patterns_app gatekeeper_app:app > flask_log.txt 2>&1 &
+elif [ "$serving_mode" == "async-production" ]
+then
+    nohup python3 -m gunicorn -c patterns_app/gunicorn_conf.py --chdir patterns_app async_gatekeeper_app:app > flask_log.txt 2>&1 &
+else
+    nohup python3 patterns_app/gatekeeper_app.py > flask_log.txt 2>&1 &
+fi
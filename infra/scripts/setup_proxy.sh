@@ -15,4 +15,21 @@ export PASSWORD=$user_password
 export MANAGER_HOST=$manager_host
 export DATA_NODES_HOST=$data_nodes_host
 export DATABASE=sakila
-nohup python3 patterns_app/remote_proxy_app.py > flask_log.txt 2>&1 &
+export POOL_MIN_SIZE=2
+export POOL_MAX_SIZE=20
+export SERVING_MODE=$serving_mode
+# Sessions and cache invalidations live in the memory of one process, the proxy runs a single worker
+export WEB_WORKERS=1
+export WEB_THREADS=32
+if [ "$serving_mode" == "async" ]
+then
+    nohup python3 -m uvicorn async_remote_proxy_app:app --app-dir patterns_app --host 0.0.0.0 --port 5000 > flask_log.txt 2>&1 &
+elif [ "$serving_mode" == "production" ]
+then
+    nohup python3 -m gunicorn -c patterns_app/gunicorn_conf.py --chdir patterns_app remote_proxy_app:app > flask_log.txt 2>&1 &
+elif [ "$serving_mode" == "async-production" ]
+then
+    nohup python3 -m gunicorn -c patterns_app/gunicorn_conf.py --chdir patterns_app async_remote_proxy_app:app > flask_log.txt 2>&1 &
+else
+    nohup python3 patterns_app/remote_proxy_app.py > flask_log.txt 2>&1 &
+fi
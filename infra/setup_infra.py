@@ -1,14 +1,11 @@
 import json
 import os
 import sys
-from time import sleep, time
-import boto3
+from time import time
 import paramiko
-from infra_utils import InfraInfo, create_security_group, authorize_ingress, filters_from_tags, get_key_pair_name, get_subnets, get_vpc_id, save_infra_info
-from instance import create_ubuntu_instances, get_instances_ids, stopped_instances_ids
-
-ec2_client = boto3.client('ec2')
-ec2 = boto3.resource('ec2')
+from concurrent.futures import ThreadPoolExecutor
+from infra_utils import InfraInfo, create_security_group, authorize_ingress, get_ec2_client, get_key_pair_name, get_subnets, get_vpc_id, http_endpoint_ready, poll_until, run_dag, save_infra_info
+from instance import create_ubuntu_instances
 
 SSH_PORT = 22
 MYSQL_PORT = 3306
@@ -17,35 +14,122 @@ NDB_DATA_NODE_PORT = 2202
 FLASK_PORT = 5000
 TINYPROXY_PORT = 8888
 
+CREATION_CONCURRENCY = int(os.getenv('CREATION_CONCURRENCY', '8'))
+SETUP_CONCURRENCY = int(os.getenv('SETUP_CONCURRENCY', '8'))
+# Maximum time given to instances to be ready, once running
+READINESS_TIMEOUT = float(os.getenv('READINESS_TIMEOUT', '900'))
+
 
 def get_absolute_path(relative_path: str):
     return os.path.join(sys.path[0], relative_path)
 
-def ssh_connect_with_retries(client: paramiko.SSHClient, hostname: str, key_filename: str, wait_time: int):
+def ssh_connect_with_retries(client: paramiko.SSHClient, hostname: str, key_filename: str, wait_time: int, jumpbox: paramiko.SSHClient = None):
     """
-    Retry an SSH connection till connected or wait_time is elapsed.
+    Retry an SSH connection till connected or wait_time is elapsed, waiting exponentially longer between two attempts.
 
     @param client: paramiko.SSHClient       Paramiko SSHClient to use for connection
     @param hostname: str                    Hostname to connect to
     @param key_filename: str                The name of the file holding the private key
     @param wait_time: int                   Time interval during which it's possible to retry
+    @param jumpbox: paramiko.SSHClient      Connected client to tunnel the connection through, if hostname isn't reachable directly
+    """
+
+    def connect():
+        sock = None
+        if jumpbox is not None:
+            sock = jumpbox.get_transport().open_channel("direct-tcpip", (hostname, SSH_PORT), ("", 0))
+        client.connect(hostname=hostname, port=SSH_PORT, username='ubuntu', key_filename=key_filename,
+                       sock=sock, timeout=10, banner_timeout=10, auth_timeout=10)
+        return True
+
+    elapsed = poll_until(connect, f"Couldn't establish an SSH connection to host {hostname}", time() + wait_time)
+    print("connected", elapsed)
+
+def wait_for_host_ready(jumpbox: paramiko.SSHClient, hostname: str, key_filename: str, deadline: float):
     """
+    Wait until a host accepts SSH connections and cloud-init ran its user data.
 
-    connected = False
+    @param jumpbox: paramiko.SSHClient      Client connected to the jumpbox
+    @param hostname: str                    Private IP of the host
+    @param key_filename: str                The name of the file holding the private key
+    @param deadline: float                  Time (as returned by time.time) after which to give up
+
+    @return: float                          Seconds elapsed until the host was ready
+    """
     start = time()
-    while not connected and (time() - start < wait_time):
-        try:
-            client.connect(hostname=hostname, port=22,
-                        username='ubuntu', key_filename=key_filename)
-        except:
-            pass
-        else:
-            connected = True
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy)
+
+    try:
+        ssh_connect_with_retries(client, hostname, key_filename, deadline - time(), jumpbox)
+
+        # Blocks until cloud-init is done, 2 means done with recoverable errors
+        _, stdout, _ = client.exec_command(command="cloud-init status --wait", timeout=max(deadline - time(), 1))
+        exit_status = stdout.channel.recv_exit_status()
+        if exit_status not in (0, 2):
+            raise Exception(f"cloud-init failed on host {hostname}")
+    finally:
+        client.close()
+
+    return time() - start
+
+def wait_for_instances_ready(jumpbox_dns_name: str, hostnames: "list[str]", deadline: float):
+    """
+    Wait, concurrently, until every host is ready. Hosts are reached through the jumpbox.
+
+    @param jumpbox_dns_name: str            Jumpbox public dns name
+    @param hostnames: list[str]             Private IPs of the hosts
+    @param deadline: float                  Time (as returned by time.time) after which to give up
+    """
+    pKey_filename = get_absolute_path('../pkey.pem')
+
+    jumpbox = paramiko.SSHClient()
+    jumpbox.set_missing_host_key_policy(paramiko.AutoAddPolicy)
+    ssh_connect_with_retries(jumpbox, jumpbox_dns_name, pKey_filename, deadline - time())
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(hostnames)) as executor:
+            futures = {
+                hostname: executor.submit(wait_for_host_ready, jumpbox, hostname, pKey_filename, deadline)
+                for hostname in hostnames
+            }
+            for hostname, future in futures.items():
+                print(f"Host {hostname} ready after {future.result():.0f}s")
+    finally:
+        jumpbox.close()
+
+def wait_for_apps_ready(instances_hostnames: dict, deadline: float):
+    """
+    Wait until the gatekeeper and the proxy flask applications answer on their health endpoint.
+    The proxy only accepts connections from the gatekeeper, so it's checked from there.
+
+    @param instances_hostnames: dict        Instances IP and dns, as returned by create_instances
+    @param deadline: float                  Time (as returned by time.time) after which to give up
+    """
+    gatekeeper_dns = instances_hostnames["gatekeeper"]["dns"]
+    gatekeeper_host = instances_hostnames["gatekeeper"]["host"]
+    proxy_host = instances_hostnames["proxy"]["host"]
+
+    elapsed = poll_until(
+        lambda: http_endpoint_ready(gatekeeper_dns, FLASK_PORT),
+        "Gatekeeper health endpoint didn't answer", deadline
+    )
+    print(f"Gatekeeper ready after {elapsed:.0f}s")
 
-            print("connected", time() - start)
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy)
+    ssh_connect_with_retries(client, instances_hostnames["jumpbox"]["dns"], get_absolute_path('../pkey.pem'), deadline - time())
 
-    if not connected:
-        raise Exception(f"Couldn't establish an SSH connection to host {hostname}")
+    def proxy_ready():
+        command = f"ssh ubuntu@{gatekeeper_host} -o StrictHostKeyChecking=no curl -sf http://{proxy_host}:{FLASK_PORT}/"
+        _, stdout, _ = client.exec_command(command=command, timeout=30)
+        return stdout.channel.recv_exit_status() == 0
+
+    try:
+        elapsed = poll_until(proxy_ready, "Proxy health endpoint didn't answer", deadline)
+        print(f"Proxy ready after {elapsed:.0f}s")
+    finally:
+        client.close()
 
 def get_jumpbox_ssh_public_key(jumpbox_dns_name: str):
     """
@@ -82,11 +166,11 @@ def get_jumpbox_ssh_public_key(jumpbox_dns_name: str):
     return jumpbox_pub_key
 
 
-def create_jumpbox(vpc_id: str, subnet_id: str, key_name: str, tags: dict[str, str]):
+def create_jumpbox(sec_group: "ec2.SecurityGroup", subnet_id: str, key_name: str, tags: dict[str, str]):
     """
-    Create jumpbox instance with its security group and SSH key pair.
+    Create jumpbox instance, opening the required ports of its security group, and its SSH key pair.
 
-    @param vpc_id: str                      Virtual Private Cloud ID where to get/create subnets
+    @param sec_group: ec2.SecurityGroup     Security group of the instance
     @param subnet_id: str                   Subnet where the machines will be located
     @param key_name: str                    The name of the key pair used to connect to the instances
     @param tags: dict[str, str]             Tags to put on instances
@@ -96,20 +180,17 @@ def create_jumpbox(vpc_id: str, subnet_id: str, key_name: str, tags: dict[str, s
 
     print("Jumpbox creation")
 
-    sec_group_jumpbox = create_security_group(
-        "sec_group_jumpbox", "Security group for Jumpbox", vpc_id, tags)
-    authorize_ingress(sec_group_jumpbox, [
+    authorize_ingress(sec_group, [
         {"protocol": "tcp", "port": SSH_PORT, "ip_range": "0.0.0.0/0"}
     ])
 
     jumpbox_instance = create_ubuntu_instances("t2.micro", 1, 1, key_name, True, subnet_id,
-                                               [sec_group_jumpbox.id], tags | {"Name": "Jumpbox"}, '')[0]
+                                               [sec_group.id], tags | {"Name": "Jumpbox"}, '')[0]
 
     print("Waiting for jumpbox to be running")
-    waiter = ec2_client.get_waiter('instance_running')
+    waiter = get_ec2_client().get_waiter('instance_running')
     waiter.wait(InstanceIds=[jumpbox_instance.id])
     jumpbox_instance.reload()
-    sleep(30)
     print("done\n")
 
     jumpbox_pub_key = get_jumpbox_ssh_public_key(
@@ -119,11 +200,11 @@ def create_jumpbox(vpc_id: str, subnet_id: str, key_name: str, tags: dict[str, s
 
     return jumpbox_instance, jumpbox_pub_key
 
-def create_standalone_mysql(vpc_id: str, subnet_id: str, key_name: str, user_data: str, jumpbox_private_ip: str, tags: dict[str, str]):
+def create_standalone_mysql(sec_group: "ec2.SecurityGroup", subnet_id: str, key_name: str, user_data: str, jumpbox_private_ip: str, tags: dict[str, str]):
     """
-    Create standalone mysql server instance with its security group.
+    Create standalone mysql server instance, opening the required ports of its security group.
 
-    @param vpc_id: str                      Virtual Private Cloud ID where to get/create subnets
+    @param sec_group: ec2.SecurityGroup     Security group of the instance
     @param subnet_id: str                   Subnet where the machines will be located
     @param key_name: str                    The name of the key pair used to connect to the instances
     @param user_data: str                   Script to be executed on startup
@@ -135,25 +216,23 @@ def create_standalone_mysql(vpc_id: str, subnet_id: str, key_name: str, user_dat
 
     print("Standalone mysql creation")
 
-    sec_group_standalone_mysql = create_security_group(
-        "sec_group_standalone_mysql", "Security group for Standalone MySQL", vpc_id, tags)
-    authorize_ingress(sec_group_standalone_mysql, [
+    authorize_ingress(sec_group, [
         {"protocol": "tcp", "port": MYSQL_PORT, "ip_range": "0.0.0.0/0"},
         {"protocol": "tcp", "port": SSH_PORT,
             "ip_range": jumpbox_private_ip + "/32"}
     ])
 
     standalone_mysql_instance = create_ubuntu_instances(
-        "t2.micro", 1, 1, key_name, True, subnet_id, [sec_group_standalone_mysql.id], tags | {"Name": "Standalone"}, user_data)[0]
+        "t2.micro", 1, 1, key_name, True, subnet_id, [sec_group.id], tags | {"Name": "Standalone"}, user_data)[0]
 
     print("done\n")
     return standalone_mysql_instance
 
-def create_gatekeeper(vpc_id: str, subnet_id: str, key_name: str, user_data: str, jumpbox_private_ip: str, tags: dict[str, str]):
+def create_gatekeeper(sec_group: "ec2.SecurityGroup", subnet_id: str, key_name: str, user_data: str, jumpbox_private_ip: str, tags: dict[str, str]):
     """
-    Create Gatekeeper instance with its security group.
+    Create Gatekeeper instance, opening the required ports of its security group.
 
-    @param vpc_id: str                      Virtual Private Cloud ID where to get/create subnets
+    @param sec_group: ec2.SecurityGroup     Security group of the instance
     @param subnet_id: str                   Subnet where the machines will be located
     @param key_name: str                    The name of the key pair used to connect to the instances
     @param user_data: str                   Script to be executed on startup
@@ -165,26 +244,24 @@ def create_gatekeeper(vpc_id: str, subnet_id: str, key_name: str, user_data: str
 
     print("Gatekeeper creation")
 
-    sec_group_gatekeeper = create_security_group(
-        "sec_group_gatekeeper", "Security group for Gatekeeper node", vpc_id, tags)
-    authorize_ingress(sec_group_gatekeeper, [
+    authorize_ingress(sec_group, [
         {"protocol": "tcp", "port": FLASK_PORT, "ip_range": "0.0.0.0/0"},
         {"protocol": "tcp", "port": SSH_PORT,
             "ip_range": jumpbox_private_ip + "/32"}
     ])
 
     gatekeeper_instance = create_ubuntu_instances(
-        "t2.large", 1, 1, key_name, True, subnet_id, [sec_group_gatekeeper.id], tags | {"Name": "Gatekeeper"}, user_data)[0]
+        "t2.large", 1, 1, key_name, True, subnet_id, [sec_group.id], tags | {"Name": "Gatekeeper"}, user_data)[0]
 
     print("done\n")
     return gatekeeper_instance
 
-def create_proxy(vpc_id: str, subnet_id: str, key_name: str, user_data: str, jumpbox_private_ip: str, gatekeeper_private_ip: str, tags: dict[str, str]):
+def create_proxy(sec_group: "ec2.SecurityGroup", subnet_id: str, key_name: str, user_data: str, jumpbox_private_ip: str, gatekeeper_private_ip: str, tags: dict[str, str]):
     """
-    Create Proxy instance (for proxy pattern) with its security group. This instance also plays 
+    Create Proxy instance (for proxy pattern), opening the required ports of its security group. This instance also plays 
     the role of the trusted host in the gatekeeper pattern.
 
-    @param vpc_id: str                      Virtual Private Cloud ID where to get/create subnets
+    @param sec_group: ec2.SecurityGroup     Security group of the instance
     @param subnet_id: str                   Subnet where the machines will be located
     @param key_name: str                    The name of the key pair used to connect to the instances
     @param user_data: str                   Script to be executed on startup
@@ -197,9 +274,7 @@ def create_proxy(vpc_id: str, subnet_id: str, key_name: str, user_data: str, jum
 
     print("Proxy creation")
 
-    sec_group_proxy = create_security_group(
-        "sec_group_proxy", "Security group for Proxy node", vpc_id, tags)
-    authorize_ingress(sec_group_proxy, [
+    authorize_ingress(sec_group, [
         {"protocol": "tcp", "port": FLASK_PORT,
             "ip_range": gatekeeper_private_ip + "/32"},
         {"protocol": "tcp", "port": SSH_PORT,
@@ -207,16 +282,16 @@ def create_proxy(vpc_id: str, subnet_id: str, key_name: str, user_data: str, jum
     ])
 
     proxy_instance = create_ubuntu_instances("t2.large", 1, 1, key_name, False, subnet_id,
-                                             [sec_group_proxy.id], tags | {"Name": "Proxy"}, user_data)[0]
+                                             [sec_group.id], tags | {"Name": "Proxy"}, user_data)[0]
 
     print("done\n")
     return proxy_instance
 
-def create_manager(vpc_id: str, subnet_id: str, subnet_cidr: str, key_name: str, user_data: str, jumpbox_private_ip: str, proxy_private_ip: str, tags: dict[str, str]):
+def create_manager(sec_group: "ec2.SecurityGroup", subnet_id: str, subnet_cidr: str, key_name: str, user_data: str, jumpbox_private_ip: str, proxy_private_ip: str, tags: dict[str, str]):
     """
-    Create NDB cluster Management server instance with its security group. 
+    Create NDB cluster Management server instance, opening the required ports of its security group. 
 
-    @param vpc_id: str                      Virtual Private Cloud ID where to get/create subnets
+    @param sec_group: ec2.SecurityGroup     Security group of the instance
     @param subnet_id: str                   Subnet where the machines will be located
     @param subnet_cidr: str                 Subnet IP range to restrict cluster connection
     @param key_name: str                    The name of the key pair used to connect to the instances
@@ -230,9 +305,7 @@ def create_manager(vpc_id: str, subnet_id: str, subnet_cidr: str, key_name: str,
 
     print("Manager creation")
 
-    sec_group_manager = create_security_group(
-        "sec_group_manager", "Security group for Manager node", vpc_id, tags)
-    authorize_ingress(sec_group_manager, [
+    authorize_ingress(sec_group, [
         {"protocol": "tcp", "port": MYSQL_PORT,
             "ip_range": proxy_private_ip + "/32"},
         {"protocol": "tcp", "port": NDB_MANAGER_PORT, "ip_range": subnet_cidr},
@@ -241,16 +314,16 @@ def create_manager(vpc_id: str, subnet_id: str, subnet_cidr: str, key_name: str,
     ])
 
     manager_instance = create_ubuntu_instances(
-        "t2.small", 1, 1, key_name, False, subnet_id, [sec_group_manager.id], tags | {"Name": "Manager"}, user_data)[0]
+        "t2.small", 1, 1, key_name, False, subnet_id, [sec_group.id], tags | {"Name": "Manager"}, user_data)[0]
 
     print("done\n")
     return manager_instance
 
-def create_data_nodes(vpc_id: str, subnet_id: str, subnet_cidr: str, key_name: str, user_data: str, jumpbox_private_ip: str, proxy_private_ip: str, tags: dict[str, str]):
+def create_data_nodes(sec_group: "ec2.SecurityGroup", subnet_id: str, subnet_cidr: str, key_name: str, user_data: str, jumpbox_private_ip: str, proxy_private_ip: str, tags: dict[str, str]):
     """
-    Create NDB cluster data nodes instances with their security group. 
+    Create NDB cluster data nodes instances, opening the required ports of their security group. 
 
-    @param vpc_id: str                      Virtual Private Cloud ID where to get/create subnets
+    @param sec_group: ec2.SecurityGroup     Security group of the instances
     @param subnet_id: str                   Subnet where the machines will be located
     @param subnet_cidr: str                 Subnet IP range to restrict cluster connection
     @param key_name: str                    The name of the key pair used to connect to the instances
@@ -264,9 +337,7 @@ def create_data_nodes(vpc_id: str, subnet_id: str, subnet_cidr: str, key_name: s
 
     print("Data nodes creation")
 
-    sec_group_data_node = create_security_group(
-        "sec_group_data_node", "Security group for Data nodes", vpc_id, tags)
-    authorize_ingress(sec_group_data_node, [
+    authorize_ingress(sec_group, [
         {"protocol": "tcp", "port": MYSQL_PORT,
             "ip_range": proxy_private_ip + "/32"},
         {"protocol": "tcp", "port": NDB_DATA_NODE_PORT, "ip_range": subnet_cidr},
@@ -275,16 +346,16 @@ def create_data_nodes(vpc_id: str, subnet_id: str, subnet_cidr: str, key_name: s
     ])
 
     data_nodes_instances = create_ubuntu_instances(
-        "t2.small", 3, 3, key_name, False, subnet_id, [sec_group_data_node.id], tags | {"Name": "Data Node"}, user_data)
+        "t2.small", 3, 3, key_name, False, subnet_id, [sec_group.id], tags | {"Name": "Data Node"}, user_data)
 
     print("done\n")
     return data_nodes_instances
 
-def create_tinyproxy(vpc_id: str, subnet_id: str, subnet_cidr: str, key_name: str, user_data: str, jumpbox_private_ip: str, tags: dict[str, str]):
+def create_tinyproxy(sec_group: "ec2.SecurityGroup", subnet_id: str, subnet_cidr: str, key_name: str, user_data: str, jumpbox_private_ip: str, tags: dict[str, str]):
     """
-    Create Tinyproxy instance with its security group. 
+    Create Tinyproxy instance, opening the required ports of its security group. 
 
-    @param vpc_id: str                      Virtual Private Cloud ID where to get/create subnets
+    @param sec_group: ec2.SecurityGroup     Security group of the instance
     @param subnet_id: str                   Subnet where the machines will be located
     @param subnet_cidr: str                 Subnet IP range to restrict access
     @param key_name: str                    The name of the key pair used to connect to the instances
@@ -296,9 +367,7 @@ def create_tinyproxy(vpc_id: str, subnet_id: str, subnet_cidr: str, key_name: st
     """
     print("Tinyproxy creation")
 
-    sec_group_tinyproxy = create_security_group(
-        "sec_group_tinyproxy", "Security group for Tinyproxy node", vpc_id, tags)
-    authorize_ingress(sec_group_tinyproxy, [
+    authorize_ingress(sec_group, [
         {"protocol": "tcp", "port": TINYPROXY_PORT, "ip_range": subnet_cidr},
         {"protocol": "tcp", "port": SSH_PORT, "ip_range": jumpbox_private_ip + "/32"}
     ])
@@ -311,16 +380,29 @@ def create_tinyproxy(vpc_id: str, subnet_id: str, subnet_cidr: str, key_name: st
     tinyproxy_user_data = tinyproxy_user_data + '\n' + user_data
 
     tinyproxy_instance = create_ubuntu_instances(
-        "t2.micro", 1, 1, key_name, True, subnet_id, [sec_group_tinyproxy.id], tags | {"Name": "Tinyproxy"}, tinyproxy_user_data)[0]
+        "t2.micro", 1, 1, key_name, True, subnet_id, [sec_group.id], tags | {"Name": "Tinyproxy"}, tinyproxy_user_data)[0]
 
     print("done\n")
     return tinyproxy_instance
 
-def create_instances(infra_info: InfraInfo):
+# Security groups of the infrastructure, role -> (name, description)
+SECURITY_GROUPS = {
+    "jumpbox": ("sec_group_jumpbox", "Security group for Jumpbox"),
+    "tinyproxy": ("sec_group_tinyproxy", "Security group for Tinyproxy node"),
+    "standalone_mysql": ("sec_group_standalone_mysql", "Security group for Standalone MySQL"),
+    "gatekeeper": ("sec_group_gatekeeper", "Security group for Gatekeeper node"),
+    "proxy": ("sec_group_proxy", "Security group for Proxy node"),
+    "manager": ("sec_group_manager", "Security group for Manager node"),
+    "data_nodes": ("sec_group_data_node", "Security group for Data nodes")
+}
+
+def create_instances(infra_info: InfraInfo, max_workers: int = CREATION_CONCURRENCY):
     """
-    Create instances composing the infrastructure.
+    Create instances composing the infrastructure. Security groups are created upfront and each instance
+    is created as soon as the instances it needs the IP of exist, independent creations running concurrently.
 
     @param infra_info: InfraInfo                Object that will hold infrastructure information
+    @param max_workers: int                     Maximum number of creations running at the same time
 
     @return InfraInfo, dict[str, str]           Object containing infrastructure information, dict of instances IP and dns
     """
@@ -333,132 +415,272 @@ def create_instances(infra_info: InfraInfo):
     key_name = get_key_pair_name()
 
     infra_info.tags = {"Purpose": "LOG8415E-Project"}
+    tags = infra_info.tags
 
-    jumpbox_instance, jumpbox_pub_key = create_jumpbox(vpc_id, subnet_id, key_name, infra_info.tags)
-    jumpbox_private_ip = jumpbox_instance.private_ip_address
-
-    tinyproxy_instance = create_tinyproxy(vpc_id, subnet_id, subnet_cidr, key_name, 
-        f'echo "{jumpbox_pub_key}" >> /home/ubuntu/.ssh/authorized_keys', 
-        jumpbox_private_ip, infra_info.tags
-    )
-    tinyproxy_private_ip = tinyproxy_instance.private_ip_address
-
-    user_data = f'''#!/bin/bash\necho "http_proxy=http://{tinyproxy_private_ip}:{TINYPROXY_PORT}/" >> /etc/environment\necho "https_proxy=http://{tinyproxy_private_ip}:{TINYPROXY_PORT}/" >> /etc/environment\necho "{jumpbox_pub_key}" >> /home/ubuntu/.ssh/authorized_keys'''
+    def user_data(inputs: dict):
+        tinyproxy_private_ip = inputs["tinyproxy"].private_ip_address
+        jumpbox_pub_key = inputs["jumpbox"][1]
+        return f'''#!/bin/bash\necho "http_proxy=http://{tinyproxy_private_ip}:{TINYPROXY_PORT}/" >> /etc/environment\necho "https_proxy=http://{tinyproxy_private_ip}:{TINYPROXY_PORT}/" >> /etc/environment\necho "{jumpbox_pub_key}" >> /home/ubuntu/.ssh/authorized_keys'''
 
-    standalone_mysql_instance  = create_standalone_mysql(vpc_id, subnet_id, key_name, user_data, jumpbox_private_ip, infra_info.tags)
+    def jumpbox_private_ip(inputs: dict):
+        return inputs["jumpbox"][0].private_ip_address
 
-    gatekeeper_instance = create_gatekeeper(vpc_id, subnet_id, key_name, user_data, jumpbox_private_ip, infra_info.tags)
-    gatekeeper_private_ip = gatekeeper_instance.private_ip_address
+    # name -> (function called with the results of its dependencies, dependencies)
+    tasks = {
+        f"sec_group_{role}": (lambda _, name=name, description=description: create_security_group(name, description, vpc_id, tags), [])
+        for role, (name, description) in SECURITY_GROUPS.items()
+    }
+    tasks |= {
+        "jumpbox": (
+            lambda inputs: create_jumpbox(inputs["sec_group_jumpbox"], subnet_id, key_name, tags),
+            ["sec_group_jumpbox"]
+        ),
+        "tinyproxy": (
+            lambda inputs: create_tinyproxy(
+                inputs["sec_group_tinyproxy"], subnet_id, subnet_cidr, key_name,
+                f'echo "{inputs["jumpbox"][1]}" >> /home/ubuntu/.ssh/authorized_keys',
+                jumpbox_private_ip(inputs), tags
+            ),
+            ["sec_group_tinyproxy", "jumpbox"]
+        ),
+        "standalone_mysql": (
+            lambda inputs: create_standalone_mysql(
+                inputs["sec_group_standalone_mysql"], subnet_id, key_name, user_data(inputs), jumpbox_private_ip(inputs), tags
+            ),
+            ["sec_group_standalone_mysql", "jumpbox", "tinyproxy"]
+        ),
+        "gatekeeper": (
+            lambda inputs: create_gatekeeper(
+                inputs["sec_group_gatekeeper"], subnet_id, key_name, user_data(inputs), jumpbox_private_ip(inputs), tags
+            ),
+            ["sec_group_gatekeeper", "jumpbox", "tinyproxy"]
+        ),
+        "proxy": (
+            lambda inputs: create_proxy(
+                inputs["sec_group_proxy"], subnet_id, key_name, user_data(inputs), jumpbox_private_ip(inputs),
+                inputs["gatekeeper"].private_ip_address, tags
+            ),
+            ["sec_group_proxy", "jumpbox", "tinyproxy", "gatekeeper"]
+        ),
+        "manager": (
+            lambda inputs: create_manager(
+                inputs["sec_group_manager"], subnet_id, subnet_cidr, key_name, user_data(inputs), jumpbox_private_ip(inputs),
+                inputs["proxy"].private_ip_address, tags
+            ),
+            ["sec_group_manager", "jumpbox", "tinyproxy", "proxy"]
+        ),
+        "data_nodes": (
+            lambda inputs: create_data_nodes(
+                inputs["sec_group_data_nodes"], subnet_id, subnet_cidr, key_name, user_data(inputs), jumpbox_private_ip(inputs),
+                inputs["proxy"].private_ip_address, tags
+            ),
+            ["sec_group_data_nodes", "jumpbox", "tinyproxy", "proxy"]
+        )
+    }
 
-    proxy_instance = create_proxy(vpc_id, subnet_id, key_name, user_data, jumpbox_private_ip, gatekeeper_private_ip, infra_info.tags)
-    proxy_private_ip = proxy_instance.private_ip_address
+    results, errors = run_dag(tasks, max_workers)
+    if errors:
+        for name, error in errors.items():
+            print(f"Creation of {name} failed: {error}")
+        raise Exception(f"Failed to create {', '.join(errors.keys())}")
 
-    manager_instance = create_manager(vpc_id, subnet_id, subnet_cidr, key_name, user_data, jumpbox_private_ip, proxy_private_ip, infra_info.tags)
-    data_nodes_instances = create_data_nodes(vpc_id, subnet_id, subnet_cidr, key_name, user_data, jumpbox_private_ip, proxy_private_ip, infra_info.tags)
+    jumpbox_instance = results["jumpbox"][0]
+    data_nodes_instances = results["data_nodes"]
+    instances = [results[name] for name in ("tinyproxy", "standalone_mysql", "gatekeeper", "proxy", "manager")] + data_nodes_instances
 
     print("Waiting for instances to be in a running state")
 
-    filters = filters_from_tags(infra_info.tags)
-    instances_ids = get_instances_ids(filters)
-    instances_ids_to_wait = [id for id in instances_ids if id not in stopped_instances_ids(instances_ids)]
+    # A single wait for all the instances
+    waiter = get_ec2_client().get_waiter('instance_running')
+    waiter.wait(InstanceIds=[instance.id for instance in instances])
+    # Public dns names are only known once instances are running
+    for instance in instances:
+        instance.reload()
 
-    waiter = ec2_client.get_waiter('instance_running')
-    waiter.wait(InstanceIds=instances_ids_to_wait)
-    # For SSH
-    sleep(60)
+    print("done\n")
 
+    print("Waiting for instances to be ready")
+    wait_for_instances_ready(
+        jumpbox_instance.public_dns_name,
+        [instance.private_ip_address for instance in instances],
+        time() + READINESS_TIMEOUT
+    )
     print("done\n")
 
     instances_hostnames = {
-        "jumpbox": {"host": jumpbox_private_ip, "dns": jumpbox_instance.public_dns_name},
-        "tinyproxy": {"host": tinyproxy_private_ip},
-        "standalone_mysql": {"host": standalone_mysql_instance.private_ip_address, "dns": standalone_mysql_instance.public_dns_name},
-        "gatekeeper": {"host": gatekeeper_private_ip, "dns": gatekeeper_instance.public_dns_name},
-        "proxy":  {"host": proxy_private_ip},
-        "manager":  {"host": manager_instance.private_ip_address},
+        "jumpbox": {"host": jumpbox_instance.private_ip_address, "dns": jumpbox_instance.public_dns_name},
+        "tinyproxy": {"host": results["tinyproxy"].private_ip_address},
+        "standalone_mysql": {"host": results["standalone_mysql"].private_ip_address, "dns": results["standalone_mysql"].public_dns_name},
+        "gatekeeper": {"host": results["gatekeeper"].private_ip_address, "dns": results["gatekeeper"].public_dns_name},
+        "proxy":  {"host": results["proxy"].private_ip_address},
+        "manager":  {"host": results["manager"].private_ip_address},
         "data_nodes": [{"host": instance.private_ip_address} for instance in data_nodes_instances]
     }
 
     return infra_info, instances_hostnames
 
 
-def setup_instances(instances_hostnames: dict):
-    print("Setup of instances will start")
+def render_setup_script(path: str, hosts: dict):
+    """
+    Read a setup script and fill in its placeholders.
 
-    standalone_mysql_host = instances_hostnames["standalone_mysql"]["host"]
-    gatekeeper_host = instances_hostnames["gatekeeper"]["host"]
-    proxy_host = instances_hostnames["proxy"]["host"]
-    manager_host = instances_hostnames["manager"]["host"]
-    data_nodes_host = [instances_hostnames["data_nodes"][i]["host"]
-                       for i in range(len(instances_hostnames["data_nodes"]))]
-
-    scripts_path = [
-        (standalone_mysql_host, get_absolute_path(
-            'scripts/setup_standalone_mysql.sh')),
-        (gatekeeper_host, get_absolute_path('scripts/setup_gatekeeper.sh')),
-        (proxy_host, get_absolute_path('scripts/setup_proxy.sh')),
-        (manager_host, get_absolute_path('scripts/setup_ndb_cluster_manager.sh'))
-    ]
-    scripts_path.extend([
-        (data_nodes_host[i], get_absolute_path(
-            'scripts/setup_ndb_cluster_data_node.sh'))
-        for i in range(len(data_nodes_host))
-    ])
+    @param path: str                        Path of the setup script
+    @param hosts: dict                      Hosts of the infrastructure, as computed in setup_instances
 
-    pKey_filename = get_absolute_path('../pkey.pem')
+    @return: str                            Script ready to be executed
+    """
+    with open(path, 'r') as f:
+        script = f.read()
+
+    script = script.replace(
+        "$root_password", os.getenv("ROOT_PASSWORD"))
+    script = script.replace("$username", os.getenv("USER"))
+    script = script.replace("$user_password", os.getenv("PASSWORD"))
+    script = script.replace("$serving_mode", os.getenv("SERVING_MODE", "flask"))
+
+    script = script.replace(
+        "$standalone_mysql_host", hosts["standalone_mysql"])
+    script = script.replace("$gatekeeper_host", hosts["gatekeeper"])
+    script = script.replace("$proxy_host", hosts["proxy"])
+    script = script.replace("$manager_host", hosts["manager"])
+    script = script.replace(
+        "$data_nodes_host", ','.join(hosts["data_nodes"]))
+    for i in range(len(hosts["data_nodes"])):
+        script = script.replace(f"$data_node{i+1}_host", hosts["data_nodes"][i])
+
+    return script
+
+def run_setup_script(jumpbox_dns: str, key_filename: str, host: str, script: str, log_path: str):
+    """
+    Execute a setup script on host through the jumpbox, writing its output to log_path.
+    Each call uses its own SSH connection so that scripts can run concurrently.
 
+    @param jumpbox_dns: str                 Jumpbox public dns name
+    @param key_filename: str                The name of the file holding the private key
+    @param host: str                        Private IP of the host to setup
+    @param script: str                      Script to execute
+    @param log_path: str                    File receiving the output of the script
+
+    @return: int, list[str]                 Exit status of the script, stderr lines
+    """
     client = paramiko.SSHClient()
     client.set_missing_host_key_policy(paramiko.AutoAddPolicy)
 
-    print("SSH connection to jumpbox")
-    client.connect(hostname=instances_hostnames["jumpbox"]["dns"],
-                   port=22, username='ubuntu', key_filename=pKey_filename)
+    try:
+        client.connect(hostname=jumpbox_dns, port=22, username='ubuntu', key_filename=key_filename)
 
-    all_stderr = []
+        with open(get_absolute_path('scripts/jumpbox_ssh_helper.sh'), 'r') as f:
+            jumpbox_script = f.read()
+        script = jumpbox_script.replace('$host', host).replace('$script', script)
+
+        _, stdout, stderr = client.exec_command(command=script, get_pty=True)
+        with open(log_path, 'w') as log:
+            for line in stdout:
+                log.write(line)
+        exit_status = stdout.channel.recv_exit_status()
 
-    jumpbox_script = ''
-    with open(get_absolute_path('scripts/jumpbox_ssh_helper.sh'), 'r') as f:
-        jumpbox_script = f.read()
+        return exit_status, stderr.readlines()
+    finally:
+        client.close()
 
-    for host, path in scripts_path:
+def setup_instances(instances_hostnames: dict, max_workers: int = SETUP_CONCURRENCY):
+    """
+    Execute the setup script of every host. Scripts run concurrently, at most max_workers at a time,
+    a script starting only once the scripts of the hosts it depends on succeeded. The output of each
+    script is written in logs/setup_<name>.log.
 
-        with open(path, 'r') as f:
-            script = f.read()
+    @param instances_hostnames: dict        Instances IP and dns, as returned by create_instances
+    @param max_workers: int                 Maximum number of scripts running at the same time
 
-            script = script.replace(
-                "$root_password", os.getenv("ROOT_PASSWORD"))
-            script = script.replace("$username", os.getenv("USER"))
-            script = script.replace("$user_password", os.getenv("PASSWORD"))
+    @return: list[str]                      stderr lines of all scripts
+    """
+    print("Setup of instances will start")
 
-            script = script.replace(
-                "$standalone_mysql_host", standalone_mysql_host)
-            script = script.replace("$gatekeeper_host", gatekeeper_host)
-            script = script.replace("$proxy_host", proxy_host)
-            script = script.replace("$manager_host", manager_host)
-            script = script.replace(
-                "$data_nodes_host", ','.join(data_nodes_host))
-            for i in range(len(data_nodes_host)):
-                script = script.replace(f"$data_node{i+1}_host", data_nodes_host[i])
+    hosts = {
+        "standalone_mysql": instances_hostnames["standalone_mysql"]["host"],
+        "gatekeeper": instances_hostnames["gatekeeper"]["host"],
+        "proxy": instances_hostnames["proxy"]["host"],
+        "manager": instances_hostnames["manager"]["host"],
+        "data_nodes": [data_node["host"] for data_node in instances_hostnames["data_nodes"]]
+    }
 
+    # name -> (host, script path, names of the setups it depends on)
+    setups = {
+        "standalone_mysql": (hosts["standalone_mysql"], get_absolute_path('scripts/setup_standalone_mysql.sh'), []),
+        "gatekeeper": (hosts["gatekeeper"], get_absolute_path('scripts/setup_gatekeeper.sh'), []),
+        "proxy": (hosts["proxy"], get_absolute_path('scripts/setup_proxy.sh'), []),
+        "manager": (hosts["manager"], get_absolute_path('scripts/setup_ndb_cluster_manager.sh'), [])
+    }
+    # Data nodes register to the cluster manager
+    for i, data_node_host in enumerate(hosts["data_nodes"]):
+        setups[f"data_node_{i+1}"] = (
+            data_node_host, get_absolute_path('scripts/setup_ndb_cluster_data_node.sh'), ["manager"]
+        )
 
-        script = jumpbox_script.replace('$host', host).replace('$script', script)
+    pKey_filename = get_absolute_path('../pkey.pem')
+    jumpbox_dns = instances_hostnames["jumpbox"]["dns"]
 
-        print(f"Executing setup script of host {host}. It may take some time.")
-        _, stdout, stderr = client.exec_command(command=script, get_pty=True)
-        exit_status = stdout.channel.recv_exit_status()
-        if exit_status == 0:
-            all_stderr.append(stderr)
-            print("done\n")
-        else:
-            for line in stderr.readlines():
-                print(line)
-            raise Exception(f"Failed to setup host {host}")
+    logs_dir = get_absolute_path('logs')
+    os.makedirs(logs_dir, exist_ok=True)
+
+    timings = {}
+    all_stderr = []
+
+    def setup_task(name: str, host: str, path: str):
+        def run(_):
+            log_path = os.path.join(logs_dir, f"setup_{name}.log")
+            print(f"Executing setup script of {name} ({host}). Output in {log_path}")
+            script = render_setup_script(path, hosts)
+
+            start = time()
+            try:
+                exit_status, stderr_lines = run_setup_script(jumpbox_dns, pKey_filename, host, script, log_path)
+            finally:
+                timings[name] = time() - start
+
+            all_stderr.extend(stderr_lines)
+            if exit_status != 0:
+                for line in stderr_lines:
+                    print(line)
+                raise Exception(f"Setup of {name} failed with status {exit_status}, see logs/setup_{name}.log")
+
+            print(f"Setup of {name} done in {timings[name]:.0f}s")
+
+        return run
+
+    results, errors = run_dag(
+        {
+            name: (setup_task(name, host, path), dependencies)
+            for name, (host, path, dependencies) in setups.items()
+        },
+        max_workers
+    )
 
-    stderr_lines = []
-    for stderr in all_stderr:
-        stderr_lines.extend(stderr.readlines())
+    print_setup_report(setups, timings, results.keys(), errors)
 
-    return stderr_lines
+    if errors:
+        for error in errors.values():
+            print(error)
+        raise Exception(f"Failed to setup {', '.join(errors.keys())}")
+
+    return all_stderr
+
+def print_setup_report(setups: dict, timings: "dict[str, float]", succeeded, failed):
+    """
+    Print the duration and outcome of the setup of every host.
+    """
+    print("\nSetup report")
+    print(f"{'name':<20}{'host':<18}{'status':<12}{'duration':>10}")
+    for name, (host, _, _) in setups.items():
+        if name in succeeded:
+            status = "done"
+        elif name in failed:
+            status = "failed"
+        else:
+            status = "skipped"
+        duration = f"{timings[name]:.0f}s" if name in timings else "-"
+        print(f"{name:<20}{host:<18}{status:<12}{duration:>10}")
+    print()
 
 
 if __name__ == '__main__':
@@ -475,6 +697,9 @@ if __name__ == '__main__':
         with open(get_absolute_path('instances_hostnames.json'), 'w') as f:
             json.dump(instances_hostnames, f)
         stderr = setup_instances(instances_hostnames)
+        print("Waiting for applications to be ready")
+        wait_for_apps_ready(instances_hostnames, time() + READINESS_TIMEOUT)
+        print("done\n")
         print("Error output:\n")
         for line in stderr:
             print(line)
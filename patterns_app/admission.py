@@ -0,0 +1,317 @@
+import asyncio
+import threading
+from time import monotonic, perf_counter
+from metrics import Registry, endpoint_matcher
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request isn't admitted. The client should retry after retry_after seconds.
+    """
+
+    def __init__(self, status: int, retry_after: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AdaptiveLimit:
+    """
+    Concurrency limit adjusted to the latency of the proxy, additive increase and multiplicative
+    decrease: the limit grows by one every limit fast responses, and shrinks by decrease when a
+    response is slower than target_latency or failed, at most once per target_latency so that the
+    responses of a single slow period only count once.
+    """
+
+    def __init__(self, min_limit: int, max_limit: int, target_latency: float, decrease: float = 0.9):
+        """
+        @param min_limit: int               Lowest limit
+        @param max_limit: int               Highest limit, and initial limit
+        @param target_latency: float        Seconds above which a response is considered slow
+        @param decrease: float              Factor applied to the limit on a slow response
+        """
+        self.min_limit = max(min_limit, 1)
+        self.max_limit = max(max_limit, self.min_limit)
+        self.target_latency = target_latency
+        self.decrease = decrease
+        self.value = float(self.max_limit)
+        self._last_decrease = 0.0
+
+    def update(self, latency: float, failed: bool):
+        if failed or latency > self.target_latency:
+            now = monotonic()
+            if now - self._last_decrease >= self.target_latency:
+                self.value = max(self.min_limit, self.value * self.decrease)
+                self._last_decrease = now
+        else:
+            self.value = min(self.max_limit, self.value + 1 / self.value)
+
+    def __int__(self):
+        return int(self.value)
+
+
+class AdmissionController:
+    """
+    Bounds the requests forwarded to the proxy at the same time, overall, per endpoint and per
+    client. A request over the limit of its client is rejected right away with a 429, a request
+    over the overall or endpoint limit waits in a bounded queue and is rejected with a 503 when the
+    queue is full or it waited for queue_timeout.
+
+    This class holds the state, ThreadedAdmissionController and AsyncAdmissionController add the
+    waiting.
+    """
+
+    def __init__(
+        self,
+        limit: AdaptiveLimit,
+        endpoint_limits: "dict[str, int]" = None,
+        client_limit: int = 16,
+        queue_size: int = 64,
+        queue_timeout: float = 1.0
+    ):
+        """
+        @param limit: AdaptiveLimit             Limit of the requests in flight overall
+        @param endpoint_limits: dict[str, int]  Endpoint -> limit of its requests in flight
+        @param client_limit: int                Limit of the requests in flight of one client
+        @param queue_size: int                  Maximum number of requests waiting to be admitted
+        @param queue_timeout: float             Seconds a request waits before being rejected
+        """
+        self.limit = limit
+        self.endpoint_limits = endpoint_limits or {}
+        self.client_limit = client_limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+
+        self.in_flight = 0
+        self.queued = 0
+        self._by_endpoint = {}
+        self._by_client = {}
+
+    def _check_client(self, client: str):
+        if self._by_client.get(client, 0) >= self.client_limit:
+            raise AdmissionRejected(429, 1, f"More than {self.client_limit} requests in flight from {client}")
+
+    def _has_room(self, endpoint: str):
+        if self.in_flight >= int(self.limit):
+            return False
+        endpoint_limit = self.endpoint_limits.get(endpoint)
+        return endpoint_limit is None or self._by_endpoint.get(endpoint, 0) < endpoint_limit
+
+    def _check_queue(self):
+        if self.queued >= self.queue_size:
+            raise AdmissionRejected(503, max(round(self.queue_timeout), 1), "Too many requests waiting, try again later")
+
+    def _queue_timed_out(self):
+        return AdmissionRejected(503, max(round(self.queue_timeout), 1), f"Not admitted after {self.queue_timeout}s, try again later")
+
+    def _take(self, endpoint: str, client: str):
+        self.in_flight += 1
+        self._by_endpoint[endpoint] = self._by_endpoint.get(endpoint, 0) + 1
+        self._by_client[client] = self._by_client.get(client, 0) + 1
+
+    def _give_back(self, endpoint: str, client: str, latency: float, failed: bool):
+        self.in_flight -= 1
+        self._by_endpoint[endpoint] -= 1
+        self._by_client[client] -= 1
+        if self._by_client[client] == 0:
+            del self._by_client[client]
+        self.limit.update(latency, failed)
+
+
+class ThreadedAdmissionController(AdmissionController):
+    """
+    Admission controller of the threaded gatekeeper.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cond = threading.Condition()
+
+    def admit(self, endpoint: str, client: str):
+        """
+        Wait until the request can be forwarded.
+
+        @param endpoint: str                Endpoint of the request
+        @param client: str                  Address of the client
+
+        @raise AdmissionRejected:           The request can't be admitted
+        """
+        with self._cond:
+            self._check_client(client)
+            if not self._has_room(endpoint):
+                self._check_queue()
+                deadline = monotonic() + self.queue_timeout
+                self.queued += 1
+                try:
+                    while not self._has_room(endpoint):
+                        remaining = deadline - monotonic()
+                        if remaining <= 0:
+                            raise self._queue_timed_out()
+                        self._cond.wait(remaining)
+                finally:
+                    self.queued -= 1
+            self._take(endpoint, client)
+
+    def done(self, endpoint: str, client: str, latency: float, failed: bool):
+        """
+        Account for the end of an admitted request.
+
+        @param endpoint: str                Endpoint of the request
+        @param client: str                  Address of the client
+        @param latency: float               Seconds the proxy took to answer
+        @param failed: bool                 Whether the proxy failed
+        """
+        with self._cond:
+            self._give_back(endpoint, client, latency, failed)
+            # Waiters may be queued for different endpoints
+            self._cond.notify_all()
+
+
+class AsyncAdmissionController(AdmissionController):
+    """
+    Admission controller of the asyncio gatekeeper, its state is only accessed from the event loop.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Created in the event loop of the app
+        self._cond = None
+
+    async def admit(self, endpoint: str, client: str):
+        """
+        Async version of ThreadedAdmissionController.admit.
+        """
+        self._check_client(client)
+        if not self._has_room(endpoint):
+            self._check_queue()
+            if self._cond is None:
+                self._cond = asyncio.Condition()
+            self.queued += 1
+            try:
+                async with self._cond:
+                    await asyncio.wait_for(self._cond.wait_for(lambda: self._has_room(endpoint)), self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise self._queue_timed_out()
+            finally:
+                self.queued -= 1
+        self._take(endpoint, client)
+
+    async def done(self, endpoint: str, client: str, latency: float, failed: bool):
+        """
+        Async version of ThreadedAdmissionController.done.
+        """
+        self._give_back(endpoint, client, latency, failed)
+        if self._cond is not None:
+            async with self._cond:
+                self._cond.notify_all()
+
+
+def declare_admission_metrics(registry: Registry, controller: AdmissionController):
+    registry.counter("admission_rejected_total", "Requests rejected by the admission control, by endpoint and status code", ("endpoint", "status"))
+    registry.callback("admission_limit", "Current limit of the requests forwarded at the same time", (), lambda: { (): int(controller.limit) })
+    registry.callback("admission_in_flight", "Admitted requests not finished yet", (), lambda: { (): controller.in_flight })
+    registry.callback("admission_queued", "Requests waiting to be admitted", (), lambda: { (): controller.queued })
+
+def parse_endpoint_limits(value: str):
+    """
+    @param value: str                       Comma separated endpoint=limit pairs, e.g. "/batch=4,/write-query=16"
+
+    @return: dict[str, int]                 Endpoint -> limit
+    """
+    limits = {}
+    for pair in value.split(","):
+        if pair.strip():
+            endpoint, limit = pair.split("=")
+            limits[endpoint.strip()] = int(limit)
+    return limits
+
+
+def admit_flask(app, controller: ThreadedAdmissionController, registry: Registry, endpoints: "list[str]"):
+    """
+    Apply the admission control to the requests of a Flask app. A request is accounted for until its
+    response is closed, once the proxy response was fully relayed.
+
+    @param endpoints: list[str]             Rules of the routes the admission control applies to
+    """
+    from flask import Response, g, request
+
+    declare_admission_metrics(registry, controller)
+    endpoints = set(endpoints)
+
+    @app.before_request
+    def admit():
+        endpoint = request.url_rule.rule if request.url_rule is not None else None
+        if endpoint not in endpoints:
+            return None
+        try:
+            controller.admit(endpoint, request.remote_addr)
+        except AdmissionRejected as e:
+            registry.inc("admission_rejected_total", endpoint, str(e.status))
+            return Response(str(e), status=e.status, headers={"Retry-After": str(e.retry_after)})
+        g.admission = (endpoint, request.remote_addr, perf_counter())
+        return None
+
+    @app.after_request
+    def release(response):
+        admission = g.pop("admission", None)
+        if admission is not None:
+            endpoint, client, start = admission
+            latency = perf_counter() - start
+            failed = response.status_code >= 500
+            response.call_on_close(lambda: controller.done(endpoint, client, latency, failed))
+        return response
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware applying the admission control, the async apps counterpart of admit_flask.
+    """
+
+    def __init__(self, app, controller: AsyncAdmissionController, registry: Registry, endpoints: "list[str]"):
+        """
+        @param app: ASGI app                Wrapped app
+        @param controller: AsyncAdmissionController
+                                            Admission controller of the app
+        @param registry: Registry           Registry receiving the metrics
+        @param endpoints: list[str]         Route paths the admission control applies to
+        """
+        self.app = app
+        self.controller = controller
+        self.registry = registry
+        self.endpoint = endpoint_matcher(endpoints)
+        declare_admission_metrics(registry, controller)
+
+    async def __call__(self, scope, receive, send):
+        endpoint = self.endpoint(scope["path"]) if scope["type"] == "http" else "other"
+        if endpoint == "other":
+            await self.app(scope, receive, send)
+            return
+
+        client = scope["client"][0] if scope.get("client") else ""
+        try:
+            await self.controller.admit(endpoint, client)
+        except AdmissionRejected as e:
+            self.registry.inc("admission_rejected_total", endpoint, str(e.status))
+            await send({
+                "type": "http.response.start",
+                "status": e.status,
+                "headers": [(b"content-type", b"text/plain; charset=utf-8"), (b"retry-after", str(e.retry_after).encode())]
+            })
+            await send({"type": "http.response.body", "body": str(e).encode()})
+            return
+
+        start = perf_counter()
+        # Time until the response headers, and whether the proxy failed
+        outcome = [None, True]
+
+        async def send_and_time(message):
+            if message["type"] == "http.response.start":
+                outcome[0] = perf_counter() - start
+                outcome[1] = message["status"] >= 500
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_time)
+        finally:
+            latency = outcome[0] if outcome[0] is not None else perf_counter() - start
+            await self.controller.done(endpoint, client, latency, outcome[1])
@@ -0,0 +1,311 @@
+import json
+from time import perf_counter
+import httpx
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.middleware import Middleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+from admission import AdaptiveLimit, AdmissionMiddleware, AsyncAdmissionController, parse_endpoint_limits
+from compression import CompressionMiddleware, Decompressor, accepted_encoding, async_decompress_chunks, is_supported
+from encoding import NegotiationMiddleware, accepted
+from metrics import CONTENT_TYPE, MetricsMiddleware, Registry
+from scatter_gather import parse_scatter_query
+from sql_parsing import classify_statement
+from tracing import TraceLog, TracingMiddleware, current_trace, stage
+from gatekeeper_settings import (
+    PROXY_HOST, PROXY_PORT, PROXY_POOL_SIZE, PROXY_CONNECT_TIMEOUT, PROXY_READ_TIMEOUT, PROXY_RETRIES,
+    BATCH_MAX_SIZE, SCATTER_MAX_PARTS, QUERY_READ_METHOD, TRACE_SAMPLE_RATE, TRACE_LOG_PATH,
+    ADMISSION_MAX_CONCURRENCY, ADMISSION_MIN_CONCURRENCY, ADMISSION_TARGET_LATENCY, ADMISSION_ENDPOINT_LIMITS,
+    ADMISSION_CLIENT_LIMIT, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT,
+    COMPRESSION_MIN_SIZE, COMPRESSION_GZIP_LEVEL, COMPRESSION_ZSTD_LEVEL, PROXY_COMPRESSION,
+    is_valid_params, is_valid_statement, is_valid_token
+)
+
+# Asyncio version of gatekeeper_app, run with an ASGI server:
+# uvicorn async_gatekeeper_app:app --app-dir patterns_app --host 0.0.0.0 --port 5000
+
+trace_log = TraceLog(TRACE_LOG_PATH)
+
+metrics = Registry("gatekeeper_")
+metrics.histogram("proxy_duration_seconds", "Time until the proxy response headers are received, by endpoint", ("endpoint",))
+metrics.counter("proxy_errors_total", "Requests that couldn't be sent to the proxy, by endpoint", ("endpoint",))
+metrics.counter("classified_queries_total", "Statements sent to /query, by class", ("kind",))
+admission = AsyncAdmissionController(
+    AdaptiveLimit(ADMISSION_MIN_CONCURRENCY, ADMISSION_MAX_CONCURRENCY, ADMISSION_TARGET_LATENCY),
+    parse_endpoint_limits(ADMISSION_ENDPOINT_LIMITS),
+    ADMISSION_CLIENT_LIMIT,
+    ADMISSION_QUEUE_SIZE,
+    ADMISSION_QUEUE_TIMEOUT
+)
+
+
+class AsyncLocalProxy:
+    def __init__(self, host: str, port: int = PROXY_PORT):
+        # The transport retries failed connections only
+        transport = httpx.AsyncHTTPTransport(
+            retries=PROXY_RETRIES,
+            limits=httpx.Limits(max_connections=PROXY_POOL_SIZE, max_keepalive_connections=PROXY_POOL_SIZE)
+        )
+        self.client = httpx.AsyncClient(
+            base_url=f"http://{host}:{port}",
+            transport=transport,
+            timeout=httpx.Timeout(PROXY_READ_TIMEOUT, connect=PROXY_CONNECT_TIMEOUT)
+        )
+
+    async def __send_query(self, path, payload: bytes, params=None, endpoint=None):
+        # Path reported in the metrics, without the session token
+        endpoint = endpoint or path
+        headers = {
+            'Content-Type': 'application/json',
+            # The proxy encodes the response as the client asked, it is relayed without being decoded
+            'Accept': accepted(),
+            'Accept-Encoding': accepted_encoding() or LINK_COMPRESSION
+        }
+        trace = current_trace()
+        if trace is not None:
+            headers.update(trace.headers())
+        request = self.client.build_request("POST", path, params=params, headers=headers, content=payload)
+        start = perf_counter()
+        try:
+            with stage("forward"):
+                response = await self.client.send(request, stream=True)
+        except httpx.HTTPError:
+            metrics.inc("proxy_errors_total", endpoint)
+            raise
+        metrics.observe("proxy_duration_seconds", perf_counter() - start, endpoint)
+        return response
+
+    async def write_query(self, payload: bytes):
+        return await self.__send_query("/write-query", payload)
+
+    async def read_query(self, payload: bytes, method_id=0, stream=False, hedge=None):
+        params = {"method_id": method_id}
+        if stream:
+            params["stream"] = 1
+        if hedge is not None:
+            params["hedge"] = hedge
+        return await self.__send_query("/read-query", payload, params=params)
+
+    async def batch(self, payload: bytes):
+        return await self.__send_query("/batch", payload)
+
+    async def scatter_query(self, payload: bytes):
+        return await self.__send_query("/scatter-query", payload)
+
+    async def begin_session(self, method_id=None, read_only=False):
+        params = {"method_id": method_id}
+        if read_only:
+            params["read_only"] = 1
+        return await self.__send_query("/session/begin", b"", params=params)
+
+    async def session_query(self, token: str, payload: bytes):
+        return await self.__send_query(f"/session/{token}/query", payload, endpoint="/session/{token}/query")
+
+    async def end_session(self, token: str, commit: bool):
+        action = 'commit' if commit else 'rollback'
+        return await self.__send_query(f"/session/{token}/{action}", b"", endpoint=f"/session/{{token}}/{action}")
+
+    async def close(self):
+        await self.client.aclose()
+
+local_proxy = AsyncLocalProxy(PROXY_HOST)
+
+# Encoding asked from the proxy when the client doesn't accept any
+LINK_COMPRESSION = PROXY_COMPRESSION if is_supported(PROXY_COMPRESSION) else 'identity'
+
+def relay(proxy_response: httpx.Response):
+    """
+    Async version of gatekeeper_app.relay.
+
+    @param proxy_response: httpx.Response       Response opened with stream=True
+
+    @return: StreamingResponse                  Response to return to the client
+    """
+    chunks = proxy_response.aiter_raw()
+    headers = {}
+    content_encoding = proxy_response.headers.get('Content-Encoding')
+    if content_encoding is not None and content_encoding != accepted_encoding():
+        chunks = async_decompress_chunks(chunks, Decompressor(content_encoding), metrics)
+    else:
+        if content_encoding is not None:
+            headers = {'Content-Encoding': content_encoding, 'Vary': 'Accept-Encoding'}
+        if 'Content-Length' in proxy_response.headers:
+            headers['Content-Length'] = proxy_response.headers['Content-Length']
+
+    return StreamingResponse(
+        chunks,
+        status_code=proxy_response.status_code,
+        headers=headers,
+        media_type=proxy_response.headers.get('Content-Type', 'application/json'),
+        background=BackgroundTask(proxy_response.aclose)
+    )
+
+async def proxy_error(request: Request, err: httpx.HTTPError):
+    """
+    Async version of gatekeeper_app.proxy_error.
+    """
+    status = 504 if isinstance(err, httpx.TimeoutException) else 502
+    return JSONResponse({ "node": "proxy", "result": [f"Failed reaching the proxy: {err}"], "error": True }, status_code=status)
+
+async def query_payload(request: Request):
+    """
+    Check that the request carries a query, and optionally the list of its params, and return its
+    body untouched.
+
+    @return: bytes or None                      Request body, None if it is invalid
+    """
+    payload = await request.body()
+    try:
+        body = json.loads(payload)
+    except ValueError:
+        return None
+    if not isinstance(body, dict) or not isinstance(body.get('query'), str):
+        return None
+    if not is_valid_params(body.get('params')):
+        return None
+    return payload
+
+async def batch_payload(request: Request):
+    """
+    Check that the request carries a list of valid statements and return its body untouched.
+
+    @return: bytes or None                      Request body, None if it is invalid
+    """
+    payload = await request.body()
+    try:
+        body = json.loads(payload)
+    except ValueError:
+        return None
+    statements = body.get('statements') if isinstance(body, dict) else None
+    if not isinstance(statements, list) or not 0 < len(statements) <= BATCH_MAX_SIZE:
+        return None
+    if not all(is_valid_statement(statement) for statement in statements):
+        return None
+    return payload
+
+def bad_request(message: str = "Expected a JSON body with a query string and optionally a list of params"):
+    return PlainTextResponse(message, status_code=400)
+
+
+async def health_check(request: Request):
+    return PlainTextResponse("Healthy gatekeeper!")
+
+async def export_metrics(request: Request):
+    return Response(metrics.render(), media_type=CONTENT_TYPE)
+
+async def execute_write_query(request: Request):
+    payload = await query_payload(request)
+    if payload is None:
+        return bad_request()
+    return relay(await local_proxy.write_query(payload))
+
+async def execute_read_query(request: Request):
+    payload = await query_payload(request)
+    if payload is None:
+        return bad_request()
+    method_id = request.query_params.get('method_id')
+    stream = request.query_params.get('stream') == '1'
+    hedge = request.query_params.get('hedge')
+    return relay(await local_proxy.read_query(payload, method_id, stream, hedge))
+
+async def execute_query(request: Request):
+    payload = await query_payload(request)
+    if payload is None:
+        return bad_request()
+    with stage("classify"):
+        kind = classify_statement(json.loads(payload)['query'])
+    metrics.inc("classified_queries_total", kind)
+
+    if kind == "read":
+        method_id = request.query_params.get('method_id', QUERY_READ_METHOD)
+        stream = request.query_params.get('stream') == '1'
+        hedge = request.query_params.get('hedge')
+        return relay(await local_proxy.read_query(payload, method_id, stream, hedge))
+    return relay(await local_proxy.write_query(payload))
+
+def unknown_session(token: str):
+    return PlainTextResponse(f"Unknown session {token}", status_code=404)
+
+async def execute_begin_session(request: Request):
+    method_id = request.query_params.get('method_id')
+    read_only = request.query_params.get('read_only') == '1'
+    return relay(await local_proxy.begin_session(method_id, read_only))
+
+async def execute_session_query(request: Request):
+    token = request.path_params['token']
+    if not is_valid_token(token):
+        return unknown_session(token)
+    payload = await query_payload(request)
+    if payload is None:
+        return bad_request()
+    return relay(await local_proxy.session_query(token, payload))
+
+async def execute_commit(request: Request):
+    token = request.path_params['token']
+    if not is_valid_token(token):
+        return unknown_session(token)
+    return relay(await local_proxy.end_session(token, commit=True))
+
+async def execute_rollback(request: Request):
+    token = request.path_params['token']
+    if not is_valid_token(token):
+        return unknown_session(token)
+    return relay(await local_proxy.end_session(token, commit=False))
+
+async def execute_batch(request: Request):
+    payload = await batch_payload(request)
+    if payload is None:
+        return bad_request(
+            f"Expected a JSON body with a list of at most {BATCH_MAX_SIZE} statements, "
+            'each one with a query string, a type, "read" or "write", and optionally a list of params'
+        )
+    return relay(await local_proxy.batch(payload))
+
+async def execute_scatter_query(request: Request):
+    payload = await request.body()
+    try:
+        parse_scatter_query(json.loads(payload), SCATTER_MAX_PARTS)
+    except ValueError as err:
+        return bad_request(str(err))
+    return relay(await local_proxy.scatter_query(payload))
+
+
+routes = [
+    Route('/', health_check),
+    Route('/metrics', export_metrics),
+    Route('/write-query', execute_write_query, methods=['POST']),
+    Route('/read-query', execute_read_query, methods=['POST']),
+    Route('/query', execute_query, methods=['POST']),
+    Route('/session/begin', execute_begin_session, methods=['POST']),
+    Route('/session/{token}/query', execute_session_query, methods=['POST']),
+    Route('/session/{token}/commit', execute_commit, methods=['POST']),
+    Route('/session/{token}/rollback', execute_rollback, methods=['POST']),
+    Route('/batch', execute_batch, methods=['POST']),
+    Route('/scatter-query', execute_scatter_query, methods=['POST'])
+]
+
+app = Starlette(
+    routes=routes,
+    # Handled inside the middlewares, the admission sees the 502 or 504
+    exception_handlers={ httpx.HTTPError: proxy_error },
+    middleware=[
+        Middleware(MetricsMiddleware, registry=metrics, endpoints=[route.path for route in routes]),
+        Middleware(
+            TracingMiddleware, app_name="gatekeeper", trace_log=trace_log, sample_rate=TRACE_SAMPLE_RATE,
+            endpoints=[route.path for route in routes]
+        ),
+        # Inside the metrics and tracing, rejected requests are counted and traced too
+        Middleware(
+            AdmissionMiddleware, controller=admission, registry=metrics,
+            endpoints=[route.path for route in routes if route.path not in ('/', '/metrics')]
+        ),
+        Middleware(NegotiationMiddleware),
+        Middleware(
+            CompressionMiddleware, registry=metrics, min_size=COMPRESSION_MIN_SIZE,
+            gzip_level=COMPRESSION_GZIP_LEVEL, zstd_level=COMPRESSION_ZSTD_LEVEL
+        )
+    ],
+    on_shutdown=[local_proxy.close]
+)
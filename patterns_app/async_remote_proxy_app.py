@@ -0,0 +1,827 @@
+import asyncio
+import json
+import random
+from contextlib import nullcontext
+from itertools import groupby
+from time import monotonic
+import aiomysql
+import pymysql
+from pymysql.constants import CR, ER
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+from circuit_breaker import STATE_VALUES, CircuitBreakers
+from compression import CompressionMiddleware
+from encoding import MSGPACK, MSGPACK_STREAM, NDJSON, NegotiationMiddleware, accepted, pack
+from hedging import AsyncAttempt, AttemptCancelled, async_hedged_read
+from latency_prober import LatencyProber
+from load_tracker import LoadTracker
+from metrics import CONTENT_TYPE, MetricsMiddleware, Registry, method_label
+from result_cache import ResultCache
+from scatter_gather import ScatterQuery, parse_scatter_query
+from sessions import SessionBusyError, SessionLimitError, SessionManager, SessionNotFoundError
+from sql_parsing import classify_statement, statement_params
+from tracing import TraceLog, TracingMiddleware, current_trace, stage, tag
+from proxy_settings import (
+    USER, PASSWORD, DATABASE, HOSTS, DATA_NODES,
+    POOL_MIN_SIZE, POOL_MAX_SIZE, POOL_IDLE_TIMEOUT, POOL_CHECKOUT_TIMEOUT, POOL_CONNECT_TIMEOUT,
+    MYSQL_PORT, PROBE_INTERVAL, PROBE_TIMEOUT, PROBE_ALPHA, PROBE_TTL,
+    CACHE_ENABLED, CACHE_TTL, CACHE_MAX_ENTRIES, CACHE_MAX_ROWS,
+    BATCH_MAX_SIZE, STREAM_FETCH_SIZE,
+    LOAD_ALPHA, LOAD_IN_FLIGHT_WEIGHT, LOAD_LATENCY_WEIGHT, LOAD_CHOICES, LOAD_TTL,
+    TRACE_SAMPLE_RATE, TRACE_LOG_PATH, SESSION_IDLE_TIMEOUT, SESSION_MAX,
+    BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT,
+    HEDGE_READS, HEDGE_PERCENTILE, HEDGE_MIN_DELAY, HEDGE_MAX_DELAY, SCATTER_MAX_PARTS,
+    COMPRESSION_MIN_SIZE, COMPRESSION_GZIP_LEVEL, COMPRESSION_ZSTD_LEVEL,
+    DIRECT_HIT, RANDOM_HIT, CUSTOM_HIT, LEAST_LOADED_HIT
+)
+
+# Asyncio version of remote_proxy_app, run with an ASGI server:
+# uvicorn async_remote_proxy_app:app --app-dir patterns_app --host 0.0.0.0 --port 5000
+# aiomysql has no server side prepared statements, params are escaped into the query on the client,
+# so only %s placeholders are supported here
+
+# One aiomysql pool per host, created on first use
+POOLS: "dict[str, aiomysql.Pool]" = {}
+pools_lock = asyncio.Lock()
+
+def connect_prober(host: str, timeout: float):
+    # The prober runs in its own thread, with the blocking driver aiomysql is built on
+    return pymysql.connect(
+        user=USER, password=PASSWORD, host=host, port=MYSQL_PORT,
+        connect_timeout=timeout, read_timeout=timeout, write_timeout=timeout
+    )
+
+latency_prober = LatencyProber(
+    { host_name: HOSTS[host_name] for host_name in DATA_NODES },
+    connect_prober,
+    interval=PROBE_INTERVAL,
+    timeout=PROBE_TIMEOUT,
+    alpha=PROBE_ALPHA,
+    ttl=PROBE_TTL
+)
+
+load_tracker = LoadTracker(
+    list(HOSTS.keys()),
+    alpha=LOAD_ALPHA,
+    in_flight_weight=LOAD_IN_FLIGHT_WEIGHT,
+    latency_weight=LOAD_LATENCY_WEIGHT,
+    choices=LOAD_CHOICES,
+    ttl=LOAD_TTL
+)
+
+circuit_breakers = CircuitBreakers(
+    list(HOSTS.keys()),
+    failure_threshold=BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=BREAKER_RESET_TIMEOUT
+)
+
+class PoolExhaustedError(Exception):
+    """
+    Raised when no connection of a pool is available within POOL_CHECKOUT_TIMEOUT.
+    """
+
+# Errors meaning the host couldn't be reached or dropped the connection
+CONNECTION_ERRORS = (aiomysql.InterfaceError, asyncio.TimeoutError, OSError)
+# PyMySQL also raises OperationalError for server errors such as lock wait timeouts, deadlocks and
+# killed queries, only these codes mean the connection failed
+CONNECTION_ERRNOS = {
+    CR.CR_CONNECTION_ERROR, CR.CR_CONN_HOST_ERROR, CR.CR_SERVER_GONE_ERROR, CR.CR_SERVER_LOST,
+    CR.CR_SERVER_LOST_EXTENDED, ER.CON_COUNT_ERROR, ER.SERVER_SHUTDOWN
+}
+
+def is_connection_error(err: Exception):
+    if isinstance(err, aiomysql.OperationalError):
+        return len(err.args) > 0 and err.args[0] in CONNECTION_ERRNOS
+    return isinstance(err, CONNECTION_ERRORS)
+
+# Results of reads, invalidated by the writes going through this proxy
+result_cache = ResultCache(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, max_rows=CACHE_MAX_ROWS) if CACHE_ENABLED else None
+
+
+trace_log = TraceLog(TRACE_LOG_PATH)
+
+session_manager = SessionManager(idle_timeout=SESSION_IDLE_TIMEOUT, max_sessions=SESSION_MAX)
+
+metrics = Registry("proxy_")
+metrics.counter("node_queries_total", "Statements executed, by node and outcome", ("node", "outcome"))
+metrics.histogram("node_query_duration_seconds", "Statement execution time, connection checkout included, by node", ("node",))
+metrics.counter("routed_reads_total", "Reads routed to a node, by routing method and node", ("method_id", "node"))
+metrics.counter("hedged_reads_total", "Reads sent to a second node, by attempt answering first: primary or hedge", ("winner",))
+metrics.counter("failovers_total", "Reads executed on the manager because their node was unavailable, by node", ("node",))
+metrics.callback(
+    "circuit_state", "Circuit breaker state, by node: 0 closed, 1 half open, 2 open", ("node",),
+    lambda: { (host_name,): STATE_VALUES[circuit["state"]] for host_name, circuit in circuit_breakers.table().items() }
+)
+metrics.callback(
+    "circuit_trips_total", "Times the circuit breaker opened, by node", ("node",),
+    lambda: { (host_name,): circuit["trips"] for host_name, circuit in circuit_breakers.table().items() },
+    kind="counter"
+)
+metrics.callback(
+    "pool_connections", "Open connections, by node and state", ("node", "state"),
+    lambda: {
+        (host_name, state): value
+        for host_name, pool in POOLS.items()
+        for state, value in (("idle", pool.freesize), ("in_use", pool.size - pool.freesize))
+    }
+)
+metrics.callback(
+    "sessions_open", "Open transaction sessions, by node", ("node",),
+    lambda: { (host_name,): count for host_name, count in session_manager.stats()["by_node"].items() }
+)
+metrics.callback(
+    "node_in_flight", "Statements in flight, by node", ("node",),
+    lambda: { (host_name,): load["in_flight"] for host_name, load in load_tracker.table().items() }
+)
+if result_cache is not None:
+    for counter in ("hits", "misses", "evictions", "invalidations"):
+        metrics.callback(
+            f"cache_{counter}_total", f"Result cache {counter}", (),
+            lambda counter=counter: { (): result_cache.stats()[counter] },
+            kind="counter"
+        )
+    metrics.callback("cache_hit_ratio", "Result cache hit ratio since start", (), lambda: { (): result_cache.stats()["hit_ratio"] })
+    metrics.callback("cache_entries", "Results in the cache", (), lambda: { (): result_cache.stats()["entries"] })
+
+
+def end_query(host_name: str, started: float, failed: bool, record: bool = True, unreachable: bool = False):
+    load_tracker.end(host_name, started, record)
+    circuit_breakers.record(host_name, unreachable)
+    metrics.inc("node_queries_total", host_name, "error" if failed else "ok")
+    if record:
+        metrics.observe("node_query_duration_seconds", monotonic() - started, host_name)
+
+
+def dumps(content):
+    # Dates and decimals are serialised as strings
+    return json.dumps(content, default=str, separators=(",", ":"))
+
+
+class ResultResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content).encode("utf-8")
+
+
+async def get_pool(host_name: str):
+    pool = POOLS.get(host_name)
+    if pool is not None:
+        return pool
+
+    async with pools_lock:
+        if host_name not in POOLS:
+            POOLS[host_name] = await aiomysql.create_pool(
+                host=HOSTS[host_name],
+                port=MYSQL_PORT,
+                user=USER,
+                password=PASSWORD,
+                db=DATABASE,
+                minsize=POOL_MIN_SIZE,
+                maxsize=POOL_MAX_SIZE,
+                pool_recycle=POOL_IDLE_TIMEOUT,
+                connect_timeout=POOL_CONNECT_TIMEOUT,
+                autocommit=True
+            )
+        return POOLS[host_name]
+
+async def checkout(host_name: str):
+    """
+    Check out a connection of the pool of host_name.
+
+    @return: aiomysql.Pool, aiomysql.Connection     Pool and connection to release to it, PoolExhaustedError if no
+                                                    connection is available within POOL_CHECKOUT_TIMEOUT
+    """
+    pool = await get_pool(host_name)
+    try:
+        return pool, await asyncio.wait_for(pool.acquire(), POOL_CHECKOUT_TIMEOUT)
+    except asyncio.TimeoutError:
+        # Not a connection error, a saturated pool says nothing about its host
+        raise PoolExhaustedError(f"No connection to {HOSTS[host_name]} available after {POOL_CHECKOUT_TIMEOUT}s") from None
+
+def node_unavailable(host_name: str):
+    return { "node": f"{host_name}", "result": [f"Node {host_name} is unavailable, try again later"], "error": True }
+
+def not_executed():
+    return { "node": "manager", "result": ["Not executed, an earlier write of the batch failed"], "error": True }
+
+def fail_over(host_name: str):
+    tag("failover_from", host_name)
+    metrics.inc("failovers_total", host_name)
+    return { "failover_from": host_name }
+
+async def probe_node(host_name: str):
+    # A new connection, pool.acquire waits as long as every pooled connection is in use
+    try:
+        cnx = await aiomysql.connect(
+            host=HOSTS[host_name], port=MYSQL_PORT, user=USER, password=PASSWORD, db=DATABASE,
+            connect_timeout=POOL_CONNECT_TIMEOUT
+        )
+        try:
+            await cnx.ping(reconnect=False)
+        finally:
+            cnx.close()
+        return True
+    except (aiomysql.Error, asyncio.TimeoutError, OSError):
+        return False
+
+async def probe_circuits(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        for host_name in circuit_breakers.due_for_probe():
+            circuit_breakers.probed(host_name, await probe_node(host_name))
+
+async def query_db(host_name: str, query: str, params: list = None, failover: bool = False, attempt: AsyncAttempt = None):
+    """
+    Async version of remote_proxy_app.query_db.
+    """
+    failover = failover and host_name != "manager"
+    if not circuit_breakers.allow(host_name):
+        if failover:
+            return await query_db("manager", query, params) | fail_over(host_name)
+        return node_unavailable(host_name)
+
+    started = load_tracker.begin(host_name)
+    failed = True
+    unreachable = False
+    try:
+        if attempt is not None and attempt.cancelled:
+            # No connection is checked out for an attempt that already lost
+            raise AttemptCancelled(host_name)
+        with stage("checkout"):
+            pool, cnx = await checkout(host_name)
+        try:
+            async with attempt.running(cnx.thread_id()) if attempt is not None else nullcontext():
+                async with cnx.cursor() as cursor:
+                    with stage("execute"):
+                        await cursor.execute(query, params)
+                    with stage("fetch"):
+                        result = await cursor.fetchall() if cursor.description else []
+        except aiomysql.Error as err:
+            # The statement of the losing attempt was killed
+            if attempt is not None and attempt.cancelled and err.args[0] == ER.QUERY_INTERRUPTED:
+                raise AttemptCancelled(host_name) from err
+            raise
+        finally:
+            pool.release(cnx)
+        failed = False
+        return { "node": f"{host_name}", "result": list(result) }
+    except AttemptCancelled as err:
+        return { "node": f"{host_name}", "result": [str(err)], "error": True }
+    except (aiomysql.Error, asyncio.TimeoutError, OSError, PoolExhaustedError) as err:
+        response = { "node": f"{host_name}", "result": [f"Failed executing query: {err}"], "error": True }
+        if not is_connection_error(err):
+            return response
+        # The query of a cancelled attempt was killed, that says nothing about the node
+        unreachable = attempt is None or not attempt.cancelled
+    finally:
+        end_query(host_name, started, failed, record=attempt is None or not attempt.cancelled, unreachable=unreachable)
+
+    # Reads don't change anything, the manager can execute them again
+    if failover and unreachable:
+        return await query_db("manager", query, params) | fail_over(host_name)
+    return response
+
+async def kill_query(host_name: str, connection_id: int, still_running):
+    try:
+        pool, cnx = await checkout(host_name)
+        try:
+            async with cnx.cursor() as cursor:
+                async with still_running() as running:
+                    if running:
+                        await cursor.execute(f"KILL QUERY {int(connection_id)}")
+        finally:
+            pool.release(cnx)
+    except (aiomysql.Error, asyncio.TimeoutError, OSError, PoolExhaustedError) as err:
+        print(f"Couldn't kill query of connection {connection_id} on {host_name}: {err}")
+
+def hedge_node(host_name: str):
+    candidates = [candidate for candidate in available_data_nodes() if candidate != host_name]
+    if len(candidates) == 0:
+        return None
+    return load_tracker.choose(candidates)[0]
+
+async def hedged_query_db(host_name: str, query: str, params: list = None):
+    """
+    Async version of remote_proxy_app.hedged_query_db.
+    """
+    percentile = load_tracker.percentile(host_name, HEDGE_PERCENTILE)
+    delay = HEDGE_MAX_DELAY if percentile is None else min(max(percentile / 1000, HEDGE_MIN_DELAY), HEDGE_MAX_DELAY)
+    response, hedge_host_name = await async_hedged_read(
+        lambda attempt: query_db(attempt.host_name, query, params, failover=True, attempt=attempt),
+        host_name,
+        lambda: hedge_node(host_name),
+        delay,
+        kill_query
+    )
+    if hedge_host_name is None:
+        return response
+
+    metrics.inc("hedged_reads_total", "hedge" if response["node"] == hedge_host_name else "primary")
+    tag("hedged_to", hedge_host_name)
+    return response | { "hedged_to": hedge_host_name }
+
+async def stream_query_db(host_name: str, query: str, params: list, extra: dict):
+    """
+    Async version of remote_proxy_app.stream_query_db, with a server side cursor.
+    """
+    if not circuit_breakers.allow(host_name):
+        if host_name == "manager" or not circuit_breakers.allow("manager"):
+            return respond(node_unavailable(host_name) | extra)
+        extra = extra | fail_over(host_name)
+        host_name = "manager"
+
+    started = load_tracker.begin(host_name)
+    try:
+        with stage("checkout"):
+            pool, cnx = await checkout(host_name)
+    except (aiomysql.Error, asyncio.TimeoutError, OSError, PoolExhaustedError) as err:
+        end_query(host_name, started, True, unreachable=is_connection_error(err))
+        return respond({ "node": f"{host_name}", "result": [f"Failed executing query: {err}"], "error": True } | extra)
+
+    cursor = await cnx.cursor(aiomysql.SSCursor)
+    try:
+        with stage("execute"):
+            await cursor.execute(query, params)
+    except aiomysql.Error as err:
+        await cursor.close()
+        pool.release(cnx)
+        end_query(host_name, started, True, unreachable=is_connection_error(err))
+        return respond({ "node": f"{host_name}", "result": [f"Failed executing query: {err}"], "error": True } | extra)
+
+    header = { "node": f"{host_name}" } | extra
+    trace = current_trace()
+    if trace is not None and trace.timings:
+        header |= { "trace_id": trace.trace_id, "timings": trace.stages_ms() }
+
+    if accepted() == MSGPACK:
+        encode, media_type = pack, MSGPACK_STREAM
+    else:
+        encode, media_type = (lambda content: dumps(content) + "\n"), NDJSON
+
+    async def generate():
+        consumed = False
+        failed = True
+        unreachable = False
+        try:
+            yield encode(header)
+            row_count = 0
+            while cursor.description:
+                rows = await cursor.fetchmany(STREAM_FETCH_SIZE)
+                if len(rows) == 0:
+                    break
+                row_count += len(rows)
+                yield encode({ "rows": rows })
+            consumed = True
+            failed = False
+            yield encode({ "done": True, "row_count": row_count })
+        except aiomysql.Error as err:
+            consumed = True
+            unreachable = is_connection_error(err)
+            yield encode({ "error": f"Failed executing query: {err}" })
+        finally:
+            if consumed:
+                await cursor.close()
+            else:
+                # Draining the rest of an abandoned result could take long, the connection is dropped instead
+                cnx.close()
+            pool.release(cnx)
+            end_query(host_name, started, failed, record=False, unreachable=unreachable)
+
+    return StreamingResponse(generate(), media_type=media_type)
+
+def direct_hit():
+    return "manager", {}
+
+def available_data_nodes():
+    return [host_name for host_name in DATA_NODES if circuit_breakers.is_available(host_name)]
+
+def random_hit():
+    candidates = available_data_nodes()
+    if len(candidates) == 0:
+        return direct_hit()
+    return random.choice(candidates), {}
+
+def custom_hit():
+    data_node_host_name, ping_time = latency_prober.best_node()
+    if data_node_host_name is None or not circuit_breakers.is_available(data_node_host_name):
+        candidates = available_data_nodes()
+        if len(candidates) == 0:
+            return "manager", { "ping_time": None }
+        data_node_host_name, ping_time = random.choice(candidates), None
+    return data_node_host_name, { "ping_time": ping_time }
+
+def least_loaded_hit():
+    available = available_data_nodes()
+    if len(available) == 0:
+        return "manager", { "load": None }
+    candidates = [host_name for host_name in available if not latency_prober.is_down(host_name)] or available
+    data_node_host_name, load = load_tracker.choose(candidates)
+    return data_node_host_name, { "load": load }
+
+def choose_node(method_id):
+    with stage("route"):
+        if method_id == RANDOM_HIT:
+            host_name, extra = random_hit()
+        elif method_id == CUSTOM_HIT:
+            host_name, extra = custom_hit()
+        elif method_id == LEAST_LOADED_HIT:
+            host_name, extra = least_loaded_hit()
+        else:
+            host_name, extra = direct_hit()
+    tag("node", host_name)
+    metrics.inc("routed_reads_total", method_label(None if method_id is None else str(method_id)), host_name)
+    return host_name, extra
+
+
+async def execute_read(query: str, method_id, params: list = None, hedge: bool = False):
+    ticket = None
+    if result_cache is not None:
+        with stage("cache"):
+            cached, ticket = result_cache.get(query, params)
+        if cached is not None:
+            return cached | { "cached": True }
+
+    host_name, extra = choose_node(method_id)
+    if hedge and host_name != "manager":
+        response = await hedged_query_db(host_name, query, params) | extra
+    else:
+        response = await query_db(host_name, query, params, failover=True) | extra
+
+    if ticket is not None and not response.get("error"):
+        result_cache.put(ticket, response)
+    return response
+
+def merge_scatter(scatter: ScatterQuery, sub_queries: list, responses: "list[dict]"):
+    """
+    Same as remote_proxy_app.merge_scatter.
+    """
+    parts = [
+        { "node": response["node"], "range": list(bounds), "rows": None if response.get("error") else len(response["result"]) }
+        for response, (_, bounds) in zip(responses, sub_queries)
+    ]
+    nodes = sorted(set(part["node"] for part in parts))
+    tag("node", ",".join(nodes))
+    errors = [message for response in responses if response.get("error") for message in response["result"]]
+    if len(errors) > 0:
+        return { "nodes": nodes, "result": errors, "error": True, "parts": parts }
+    try:
+        with stage("merge"):
+            result = scatter.merge([response["result"] for response in responses])
+    except (ValueError, TypeError, IndexError) as err:
+        return { "nodes": nodes, "result": [f"Failed merging results: {err}"], "error": True, "parts": parts }
+    return { "nodes": nodes, "result": result, "parts": parts }
+
+async def scatter_query_db(scatter: ScatterQuery):
+    """
+    Async version of remote_proxy_app.scatter_query_db.
+    """
+    nodes = available_data_nodes() or ["manager"]
+    offset = random.randrange(len(nodes))
+    sub_queries = scatter.sub_queries()
+    hosts = [nodes[(offset + i) % len(nodes)] for i in range(len(sub_queries))]
+    responses = await asyncio.gather(*(
+        query_db(host_name, query, scatter.params, failover=True)
+        for host_name, (query, _) in zip(hosts, sub_queries)
+    ))
+    return merge_scatter(scatter, sub_queries, responses)
+
+async def execute_write(query: str, params: list = None):
+    response = await query_db("manager", query, params)
+    if result_cache is not None:
+        result_cache.invalidate(query)
+    return response
+
+async def execute_write_transaction(queries: "list[str]", params: "list[list]" = None):
+    if params is None:
+        params = [None] * len(queries)
+    if not circuit_breakers.allow("manager"):
+        return [node_unavailable("manager") for _ in queries]
+
+    responses = []
+    started = load_tracker.begin("manager")
+    failed = True
+    unreachable = False
+    try:
+        with stage("checkout"):
+            pool, cnx = await checkout("manager")
+        try:
+            await cnx.begin()
+            async with cnx.cursor() as cursor:
+                for query, query_params in zip(queries, params):
+                    try:
+                        with stage("execute"):
+                            await cursor.execute(query, query_params)
+                        with stage("fetch"):
+                            result = await cursor.fetchall() if cursor.description else []
+                    except aiomysql.Error as err:
+                        await cnx.rollback()
+                        responses.append({ "node": "manager", "result": [f"Failed executing query: {err}"], "error": True })
+                        break
+                    responses.append({ "node": "manager", "result": list(result) })
+                else:
+                    await cnx.commit()
+                    failed = False
+        finally:
+            pool.release(cnx)
+    except (aiomysql.Error, asyncio.TimeoutError, OSError, PoolExhaustedError) as err:
+        unreachable = is_connection_error(err)
+        responses = [{ "node": "manager", "result": [f"Failed executing transaction: {err}"], "error": True }]
+    finally:
+        end_query("manager", started, failed, unreachable=unreachable)
+
+    if result_cache is not None:
+        for query in queries:
+            result_cache.invalidate(query)
+
+    # Statements after a failure weren't executed
+    failed = len(responses) < len(queries) or responses[-1].get("error", False)
+    if failed:
+        for response in responses:
+            response["error"] = True
+    responses.extend(
+        { "node": "manager", "result": ["Not executed, transaction rolled back"], "error": True }
+        for _ in range(len(queries) - len(responses))
+    )
+    return responses
+
+
+def check_out_session(token: str):
+    """
+    @return: Session or PlainTextResponse   Checked out session of token, error response if it is unknown or busy
+    """
+    try:
+        return session_manager.check_out(token)
+    except SessionNotFoundError as err:
+        return PlainTextResponse(str(err), status_code=404)
+    except SessionBusyError as err:
+        return PlainTextResponse(str(err), status_code=409)
+
+async def end_session(session, discard: bool = False):
+    session_manager.close(session)
+    pool = await get_pool(session.host_name)
+    if discard:
+        session.cnx.close()
+    elif session.cnx.get_transaction_status():
+        # aiomysql closes connections released in a transaction
+        try:
+            await session.cnx.rollback()
+        except aiomysql.Error:
+            session.cnx.close()
+    pool.release(session.cnx)
+
+async def begin_session(host_name: str, read_only: bool):
+    if not circuit_breakers.allow(host_name):
+        return node_unavailable(host_name)
+
+    try:
+        with stage("checkout"):
+            pool, cnx = await checkout(host_name)
+    except (aiomysql.Error, asyncio.TimeoutError, OSError, PoolExhaustedError) as err:
+        circuit_breakers.record(host_name, is_connection_error(err))
+        return { "node": f"{host_name}", "result": [f"Failed opening session: {err}"], "error": True }
+
+    try:
+        async with cnx.cursor() as cursor:
+            await cursor.execute("START TRANSACTION READ ONLY" if read_only else "START TRANSACTION")
+        session = session_manager.open(host_name, cnx)
+    except (aiomysql.Error, SessionLimitError) as err:
+        circuit_breakers.record(host_name, is_connection_error(err))
+        await cnx.rollback()
+        pool.release(cnx)
+        return { "node": f"{host_name}", "result": [f"Failed opening session: {err}"], "error": True }
+    circuit_breakers.record(host_name, False)
+    return { "node": f"{host_name}", "session": session.token }
+
+async def execute_in_session(session, query: str, params: list = None):
+    started = load_tracker.begin(session.host_name)
+    failed = True
+    unreachable = False
+    try:
+        async with session.cnx.cursor() as cursor:
+            with stage("execute"):
+                await cursor.execute(query, params)
+            with stage("fetch"):
+                result = await cursor.fetchall() if cursor.description else []
+        failed = False
+        if classify_statement(query) == "write":
+            session.writes.append(query)
+        response = { "node": session.host_name, "result": list(result) }
+    except (aiomysql.ProgrammingError, aiomysql.DataError, aiomysql.IntegrityError, aiomysql.NotSupportedError) as err:
+        response = { "node": session.host_name, "result": [f"Failed executing query: {err}"], "error": True }
+    except (aiomysql.Error, OSError) as err:
+        unreachable = is_connection_error(err)
+        await end_session(session, discard=True)
+        return { "node": session.host_name, "result": [f"Failed executing query: {err}"], "error": True, "session_closed": True }
+    finally:
+        end_query(session.host_name, started, failed, unreachable=unreachable)
+
+    session_manager.check_in(session)
+    return response
+
+async def finish_session(session, commit: bool):
+    try:
+        if commit:
+            await session.cnx.commit()
+        else:
+            await session.cnx.rollback()
+    except (aiomysql.Error, OSError) as err:
+        await end_session(session, discard=True)
+        action = "committing" if commit else "rolling back"
+        return { "node": session.host_name, "result": [f"Failed {action} transaction: {err}"], "error": True, "session_closed": True }
+
+    await end_session(session)
+    if commit and result_cache is not None:
+        for query in session.writes:
+            result_cache.invalidate(query)
+    return { "node": session.host_name, "result": [] }
+
+async def reap_sessions(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        for session in session_manager.expired():
+            await end_session(session)
+
+
+def respond(content: dict):
+    """
+    Async version of remote_proxy_app.respond.
+    """
+    trace = current_trace()
+    if trace is not None and trace.timings:
+        content = content | { "trace_id": trace.trace_id, "timings": trace.stages_ms() }
+    with stage("serialise"):
+        if accepted() == MSGPACK:
+            return Response(pack(content), media_type=MSGPACK)
+        return ResultResponse(content)
+
+
+async def health_check(request: Request):
+    return PlainTextResponse("Healthy proxy!")
+
+async def export_metrics(request: Request):
+    return Response(metrics.render(), media_type=CONTENT_TYPE)
+
+async def pool_stats(request: Request):
+    return JSONResponse({
+        host_name: {
+            "host": HOSTS[host_name],
+            "size": pool.size,
+            "idle": pool.freesize,
+            "in_use": pool.size - pool.freesize,
+            "min_size": pool.minsize,
+            "max_size": pool.maxsize
+        }
+        for host_name, pool in POOLS.items()
+    })
+
+async def latency(request: Request):
+    return JSONResponse(latency_prober.table())
+
+async def load(request: Request):
+    return JSONResponse(load_tracker.table())
+
+async def circuits(request: Request):
+    return JSONResponse(circuit_breakers.table())
+
+async def cache_stats(request: Request):
+    return JSONResponse(result_cache.stats() if result_cache is not None else { "enabled": False })
+
+async def execute_write_query(request: Request):
+    body = await request.json()
+    return respond(await execute_write(body['query'], statement_params(body)))
+
+async def execute_read_query(request: Request):
+    method_id = request.query_params.get('method_id')
+    if method_id != None and method_id.isdigit():
+        method_id = int(method_id)
+
+    body = await request.json()
+    query, params = body['query'], statement_params(body)
+
+    # Large results are streamed, they bypass the cache
+    if request.query_params.get('stream') == '1':
+        host_name, extra = choose_node(method_id)
+        return await stream_query_db(host_name, query, params, extra)
+
+    hedge = request.query_params.get('hedge', '1' if HEDGE_READS else '0') == '1'
+    return respond(await execute_read(query, method_id, params, hedge))
+
+async def execute_scatter_query(request: Request):
+    try:
+        scatter = parse_scatter_query(await request.json(), SCATTER_MAX_PARTS)
+    except ValueError as err:
+        return PlainTextResponse(str(err), status_code=400)
+    return respond(await scatter_query_db(scatter))
+
+async def session_stats(request: Request):
+    return JSONResponse(session_manager.stats())
+
+async def execute_begin_session(request: Request):
+    read_only = request.query_params.get('read_only') == '1'
+    host_name = "manager"
+    if read_only:
+        method_id = request.query_params.get('method_id')
+        if method_id != None and method_id.isdigit():
+            method_id = int(method_id)
+        host_name, _ = choose_node(method_id)
+    return respond(await begin_session(host_name, read_only))
+
+async def execute_session_query(request: Request):
+    body = await request.json()
+    session = check_out_session(request.path_params['token'])
+    if isinstance(session, PlainTextResponse):
+        return session
+    return respond(await execute_in_session(session, body['query'], statement_params(body)))
+
+async def execute_commit(request: Request):
+    session = check_out_session(request.path_params['token'])
+    if isinstance(session, PlainTextResponse):
+        return session
+    return respond(await finish_session(session, commit=True))
+
+async def execute_rollback(request: Request):
+    session = check_out_session(request.path_params['token'])
+    if isinstance(session, PlainTextResponse):
+        return session
+    return respond(await finish_session(session, commit=False))
+
+async def execute_batch(request: Request):
+    statements = (await request.json())['statements']
+    if len(statements) > BATCH_MAX_SIZE:
+        return PlainTextResponse(f"A batch can't contain more than {BATCH_MAX_SIZE} statements", status_code=400)
+
+    results = [None] * len(statements)
+    # As in remote_proxy_app, in order, consecutive writes in one transaction and consecutive reads concurrently
+    for is_write, group in groupby(range(len(statements)), key=lambda i: statements[i].get('type') == 'write'):
+        group = list(group)
+        if is_write:
+            writes_results = await execute_write_transaction(
+                [statements[i]['query'] for i in group], [statement_params(statements[i]) for i in group]
+            )
+            for i, result in zip(group, writes_results):
+                results[i] = result
+            if any(result.get("error") for result in writes_results):
+                break
+            continue
+
+        reads_results = await asyncio.gather(*(
+            execute_read(statements[i]['query'], statements[i].get('method_id', DIRECT_HIT), statement_params(statements[i]))
+            for i in group
+        ))
+        for i, result in zip(group, reads_results):
+            results[i] = result
+
+    results = [result if result is not None else not_executed() for result in results]
+    return respond({ "results": results })
+
+
+async def on_startup():
+    latency_prober.start()
+    # The loop only keeps a weak reference to its tasks
+    app.state.session_reaper = asyncio.get_running_loop().create_task(reap_sessions(max(SESSION_IDLE_TIMEOUT / 4, 1.0)))
+    app.state.circuit_prober = asyncio.get_running_loop().create_task(probe_circuits(max(BREAKER_RESET_TIMEOUT / 4, 0.5)))
+
+async def on_shutdown():
+    for pool in POOLS.values():
+        pool.close()
+        await pool.wait_closed()
+
+
+routes = [
+    Route('/', health_check),
+    Route('/metrics', export_metrics),
+    Route('/pool-stats', pool_stats),
+    Route('/latency', latency),
+    Route('/load', load),
+    Route('/circuits', circuits),
+    Route('/cache-stats', cache_stats),
+    Route('/session-stats', session_stats),
+    Route('/write-query', execute_write_query, methods=['POST']),
+    Route('/read-query', execute_read_query, methods=['POST']),
+    Route('/scatter-query', execute_scatter_query, methods=['POST']),
+    Route('/session/begin', execute_begin_session, methods=['POST']),
+    Route('/session/{token}/query', execute_session_query, methods=['POST']),
+    Route('/session/{token}/commit', execute_commit, methods=['POST']),
+    Route('/session/{token}/rollback', execute_rollback, methods=['POST']),
+    Route('/batch', execute_batch, methods=['POST'])
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(MetricsMiddleware, registry=metrics, endpoints=[route.path for route in routes]),
+        Middleware(
+            TracingMiddleware, app_name="proxy", trace_log=trace_log, sample_rate=TRACE_SAMPLE_RATE,
+            endpoints=[route.path for route in routes]
+        ),
+        Middleware(NegotiationMiddleware),
+        Middleware(
+            CompressionMiddleware, registry=metrics, min_size=COMPRESSION_MIN_SIZE,
+            gzip_level=COMPRESSION_GZIP_LEVEL, zstd_level=COMPRESSION_ZSTD_LEVEL
+        )
+    ],
+    on_startup=[on_startup],
+    on_shutdown=[on_shutdown]
+)
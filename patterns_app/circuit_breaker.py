@@ -0,0 +1,136 @@
+import threading
+from time import monotonic
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Value of each state in the metrics
+STATE_VALUES = { CLOSED: 0, HALF_OPEN: 1, OPEN: 2 }
+
+
+class _Circuit:
+    __slots__ = ("state", "failures", "opened_at", "trial", "trips")
+
+    def __init__(self):
+        self.state = CLOSED
+        # Consecutive failures
+        self.failures = 0
+        self.opened_at = 0.0
+        # Whether the single statement let through while half open is still running
+        self.trial = False
+        self.trips = 0
+
+
+class CircuitBreakers:
+    """
+    One circuit breaker per host, independent from the database driver.
+
+    A circuit opens after failure_threshold consecutive failures to reach its host: no statement
+    is sent to the host anymore and the app routes them elsewhere. Once it has been open for
+    reset_timeout, the app probes the host in the background. A successful probe half opens the
+    circuit, a single statement at a time is then let through, the circuit closes on its success
+    and opens again on its failure.
+    """
+
+    def __init__(self, host_names: "list[str]", failure_threshold: int = 5, reset_timeout: float = 5.0):
+        """
+        @param host_names: list[str]        Names of the hosts
+        @param failure_threshold: int       Consecutive failures opening a circuit
+        @param reset_timeout: float         Seconds a circuit stays open before its host is probed
+        """
+        self.failure_threshold = max(failure_threshold, 1)
+        self.reset_timeout = reset_timeout
+
+        self._circuits = { host_name: _Circuit() for host_name in host_names }
+        self._lock = threading.Lock()
+
+    def _open(self, circuit: _Circuit):
+        circuit.state = OPEN
+        circuit.opened_at = monotonic()
+        circuit.trial = False
+        circuit.trips += 1
+
+    def is_available(self, host_name: str):
+        """
+        @return: bool                       Whether a statement could be sent to host_name now, for routing
+        """
+        circuit = self._circuits[host_name]
+        return circuit.state == CLOSED or (circuit.state == HALF_OPEN and not circuit.trial)
+
+    def allow(self, host_name: str):
+        """
+        Ask to send a statement to host_name, its outcome must then be given to record.
+
+        @return: bool                       Whether the statement can be sent
+        """
+        with self._lock:
+            circuit = self._circuits[host_name]
+            if circuit.state == CLOSED:
+                return True
+            if circuit.state == HALF_OPEN and not circuit.trial:
+                circuit.trial = True
+                return True
+            return False
+
+    def record(self, host_name: str, failed: bool):
+        """
+        Record the outcome of a statement sent to host_name.
+
+        @param host_name: str               Host the statement was sent to
+        @param failed: bool                 Whether the host couldn't be reached, errors of the statement itself don't count
+        """
+        with self._lock:
+            circuit = self._circuits[host_name]
+            if circuit.state == OPEN:
+                # Statement sent before the circuit opened
+                return
+            if not failed:
+                circuit.state = CLOSED
+                circuit.failures = 0
+                circuit.trial = False
+                return
+            circuit.failures += 1
+            if circuit.state == HALF_OPEN or circuit.failures >= self.failure_threshold:
+                self._open(circuit)
+
+    def due_for_probe(self):
+        """
+        @return: list[str]                  Hosts whose circuit has been open for reset_timeout
+        """
+        now = monotonic()
+        with self._lock:
+            return [
+                host_name for host_name, circuit in self._circuits.items()
+                if circuit.state == OPEN and now - circuit.opened_at >= self.reset_timeout
+            ]
+
+    def probed(self, host_name: str, reachable: bool):
+        """
+        Record the outcome of the probe of a host returned by due_for_probe.
+        """
+        with self._lock:
+            circuit = self._circuits[host_name]
+            if circuit.state != OPEN:
+                return
+            if reachable:
+                circuit.state = HALF_OPEN
+                circuit.failures = 0
+            else:
+                circuit.opened_at = monotonic()
+
+    def table(self):
+        """
+        @return: dict                       Per host state, consecutive failures and times the circuit opened
+        """
+        now = monotonic()
+        with self._lock:
+            return {
+                host_name: {
+                    "state": circuit.state,
+                    "failures": circuit.failures,
+                    "open_for_s": now - circuit.opened_at if circuit.state == OPEN else None,
+                    "trips": circuit.trips
+                }
+                for host_name, circuit in self._circuits.items()
+            }
@@ -0,0 +1,297 @@
+import zlib
+from contextvars import ContextVar
+from time import thread_time
+from metrics import Registry
+
+try:
+    import zstandard
+except ImportError:
+    # zstd is only offered when zstandard is installed
+    zstandard = None
+
+GZIP = "gzip"
+ZSTD = "zstd"
+# Preferred first when the client accepts both with the same quality
+ENCODINGS = (ZSTD, GZIP) if zstandard is not None else (GZIP,)
+
+# Ratio of the size before compression to the size after, for one response
+RATIO_BUCKETS = (1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 20.0, 50.0)
+
+_accepted = ContextVar("content_encoding", default=None)
+
+
+class Compressor:
+    """
+    Streaming compressor, every chunk is flushed so that a streamed response keeps arriving as it
+    is produced.
+    """
+
+    def __init__(self, encoding: str, gzip_level: int = 6, zstd_level: int = 3):
+        """
+        @param encoding: str                GZIP or ZSTD
+        @param gzip_level: int              Level of gzip, 1 to 9
+        @param zstd_level: int              Level of zstd, 1 to 22
+        """
+        self.encoding = encoding
+        self.input_bytes = 0
+        self.output_bytes = 0
+        # CPU seconds of the current thread spent compressing
+        self.cpu_seconds = 0.0
+        if encoding == ZSTD:
+            self._compressor = zstandard.ZstdCompressor(level=zstd_level).compressobj()
+            self._flush_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._flush_mode = zlib.Z_SYNC_FLUSH
+
+    def _count(self, start: float, chunk: bytes, data: bytes):
+        self.cpu_seconds += thread_time() - start
+        self.input_bytes += len(chunk)
+        self.output_bytes += len(data)
+        return data
+
+    def compress(self, chunk: bytes):
+        start = thread_time()
+        return self._count(start, chunk, self._compressor.compress(chunk) + self._compressor.flush(self._flush_mode))
+
+    def finish(self):
+        start = thread_time()
+        return self._count(start, b"", self._compressor.flush())
+
+
+class Decompressor:
+    """
+    Streaming decompressor, for the responses compressed with an encoding the client doesn't accept.
+    """
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        self.cpu_seconds = 0.0
+        if encoding == ZSTD:
+            self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+        else:
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, chunk: bytes):
+        start = thread_time()
+        data = self._decompressor.decompress(chunk)
+        self.cpu_seconds += thread_time() - start
+        return data
+
+
+def negotiate_encoding(accept_encoding: str):
+    """
+    @param accept_encoding: str             Accept-Encoding header of the request, None if missing
+
+    @return: str or None                    Preferred encoding of ENCODINGS accepted by the client, None for no compression
+    """
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, *options = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for option in options:
+            name, _, value = option.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    best = None
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > 0 and (best is None or quality > qualities.get(best, qualities.get("*", 0.0))):
+            best = encoding
+    return best
+
+def accepted_encoding():
+    """
+    @return: str or None                    Encoding negotiated for the request being handled
+    """
+    return _accepted.get()
+
+def is_supported(encoding: str):
+    return encoding in ENCODINGS
+
+
+def declare_compression_metrics(registry: Registry):
+    registry.counter("compressed_responses_total", "Responses compressed, by encoding", ("encoding",))
+    registry.counter("compression_input_bytes_total", "Bytes of the compressed responses before compression, by encoding", ("encoding",))
+    registry.counter("compression_output_bytes_total", "Bytes of the compressed responses after compression, by encoding", ("encoding",))
+    registry.counter("compression_cpu_seconds_total", "CPU time spent compressing responses, by encoding", ("encoding",))
+    registry.histogram("compression_ratio", "Size of a response before compression over its size after, by encoding", ("encoding",), RATIO_BUCKETS)
+    registry.counter("decompression_cpu_seconds_total", "CPU time spent decompressing upstream responses for clients not accepting their encoding, by encoding", ("encoding",))
+
+def record_compression(registry: Registry, compressor: Compressor):
+    registry.inc("compressed_responses_total", compressor.encoding)
+    registry.inc("compression_input_bytes_total", compressor.encoding, amount=compressor.input_bytes)
+    registry.inc("compression_output_bytes_total", compressor.encoding, amount=compressor.output_bytes)
+    registry.inc("compression_cpu_seconds_total", compressor.encoding, amount=compressor.cpu_seconds)
+    if compressor.output_bytes > 0:
+        registry.observe("compression_ratio", compressor.input_bytes / compressor.output_bytes, compressor.encoding)
+
+def compress_chunks(chunks, compressor: Compressor, registry: Registry):
+    """
+    @param chunks: iterable[bytes or str]   Body of a response, str chunks are encoded as UTF-8
+    @param compressor: Compressor           Compressor of the response
+    @param registry: Registry               Registry receiving the metrics, once the body is compressed
+
+    @return: generator[bytes]               Compressed body
+    """
+    try:
+        for chunk in chunks:
+            # Flask streams the str a generator yields, the WSGI server would have encoded them
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+        record_compression(registry, compressor)
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+def decompress_chunks(chunks, decompressor: Decompressor, registry: Registry):
+    """
+    @return: generator[bytes]               Decompressed body
+    """
+    try:
+        for chunk in chunks:
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+    finally:
+        registry.inc("decompression_cpu_seconds_total", decompressor.encoding, amount=decompressor.cpu_seconds)
+
+async def async_decompress_chunks(chunks, decompressor: Decompressor, registry: Registry):
+    """
+    Async version of decompress_chunks.
+    """
+    try:
+        async for chunk in chunks:
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+    finally:
+        registry.inc("decompression_cpu_seconds_total", decompressor.encoding, amount=decompressor.cpu_seconds)
+
+
+def compress_flask(app, registry: Registry, min_size: int, gzip_level: int = 6, zstd_level: int = 3):
+    """
+    Compress the responses of a Flask app in the encoding negotiated with the Accept-Encoding header.
+    Responses with a known size are only compressed from min_size bytes, streamed responses of
+    unknown size always are, chunk by chunk.
+    """
+    from flask import request
+
+    declare_compression_metrics(registry)
+
+    @app.before_request
+    def negotiate():
+        _accepted.set(negotiate_encoding(request.headers.get("Accept-Encoding")))
+
+    @app.after_request
+    def compress(response):
+        # Computed again, a response returned by an earlier before_request hook skips negotiate
+        encoding = negotiate_encoding(request.headers.get("Accept-Encoding"))
+        if (
+            encoding is None
+            or request.method == "HEAD"
+            or response.status_code in (204, 304)
+            or "Content-Encoding" in response.headers
+        ):
+            return response
+        response.vary.add("Accept-Encoding")
+
+        compressor = Compressor(encoding, gzip_level, zstd_level)
+        if not response.is_streamed:
+            body = response.get_data()
+            if len(body) < min_size:
+                return response
+            response.set_data(compressor.compress(body) + compressor.finish())
+            record_compression(registry, compressor)
+        else:
+            if response.content_length is not None and response.content_length < min_size:
+                return response
+            response.response = compress_chunks(response.response, compressor, registry)
+            del response.headers["Content-Length"]
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing the responses, the async apps counterpart of compress_flask.
+    """
+
+    def __init__(self, app, registry: Registry, min_size: int, gzip_level: int = 6, zstd_level: int = 3):
+        """
+        @param app: ASGI app                Wrapped app
+        @param registry: Registry           Registry receiving the metrics
+        @param min_size: int                Bytes from which a response is compressed
+        @param gzip_level: int              Level of gzip
+        @param zstd_level: int              Level of zstd
+        """
+        self.app = app
+        self.registry = registry
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.zstd_level = zstd_level
+        declare_compression_metrics(registry)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = next((value.decode("latin-1") for name, value in scope["headers"] if name == b"accept-encoding"), None)
+        encoding = negotiate_encoding(accept_encoding)
+        _accepted.set(encoding)
+        if encoding is None or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        # The response start is held until the first body message tells whether to compress
+        start_message = None
+        compressor = None
+
+        async def send_compressed(message):
+            nonlocal start_message, compressor
+            if message["type"] == "http.response.start":
+                headers = { name.lower(): value for name, value in message.get("headers", []) }
+                length = headers.get(b"content-length")
+                if (
+                    b"content-encoding" in headers
+                    or message["status"] in (204, 304)
+                    or (length is not None and int(length) < self.min_size)
+                ):
+                    await send(message)
+                else:
+                    start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                if not more_body and len(body) < self.min_size:
+                    await send(start_message)
+                    start_message = None
+                    await send(message)
+                    return
+                compressor = Compressor(encoding, self.gzip_level, self.zstd_level)
+                headers = [(name, value) for name, value in start_message.get("headers", []) if name.lower() != b"content-length"]
+                headers += [(b"content-encoding", encoding.encode("latin-1")), (b"vary", b"Accept-Encoding")]
+                await send(start_message | { "headers": headers })
+
+            data = compressor.compress(body)
+            if not more_body:
+                data += compressor.finish()
+                record_compression(self.registry, compressor)
+            await send({ "type": "http.response.body", "body": data, "more_body": more_body })
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,321 @@
+import threading
+from collections import deque
+from time import monotonic, sleep
+import mysql.connector
+
+
+class PoolExhaustedError(Exception):
+    """
+    Raised when no connection could be checked out before the checkout timeout.
+    """
+
+
+class ConnectionPool:
+    """
+    Thread safe pool of MySQL connections to a single host.
+
+    Idle connections are reused in LIFO order so the warmest connection is handed out first,
+    connections idle for longer than idle_timeout are closed (down to min_size) and a connection
+    idle for longer than health_check_after is pinged before being handed out.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        user: str,
+        password: str,
+        database: str,
+        min_size: int = 1,
+        max_size: int = 10,
+        idle_timeout: float = 300.0,
+        checkout_timeout: float = 5.0,
+        health_check_after: float = 1.0,
+        connect_timeout: int = None
+    ):
+        """
+        @param host: str                    MySQL server host
+        @param user: str                    MySQL user
+        @param password: str                MySQL user password
+        @param database: str                Default database of the connections
+        @param min_size: int                Number of connections kept open even when idle
+        @param max_size: int                Maximum number of connections opened at the same time
+        @param idle_timeout: float          Seconds after which an idle connection above min_size is closed
+        @param checkout_timeout: float      Seconds to wait for a free connection before giving up
+        @param health_check_after: float    Idle seconds after which a connection is pinged on checkout
+        @param connect_timeout: int         Seconds to wait for a new connection, None for the driver default
+        """
+        self.host = host
+        self.user = user
+        self.password = password
+        self.database = database
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.health_check_after = health_check_after
+        self.connect_timeout = connect_timeout
+
+        # (connection, time it was released)
+        self._idle = deque()
+        # Opened connections, idle or checked out
+        self._size = 0
+        self._cond = threading.Condition()
+
+        self._created = 0
+        self._closed = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._health_check_failures = 0
+
+    def _connect(self):
+        # Statements are independent from one another, a pooled connection must not keep
+        # a transaction (and its snapshot) open between two checkouts.
+        options = {}
+        if self.connect_timeout is not None:
+            options["connection_timeout"] = self.connect_timeout
+        return mysql.connector.connect(
+            user=self.user, password=self.password, host=self.host, database=self.database, autocommit=True, **options
+        )
+
+    def _close(self, cnx):
+        try:
+            cnx.close()
+        except Exception:
+            pass
+
+    def _evict_idle(self):
+        """
+        Remove expired idle connections. Must be called with the lock held.
+
+        @return: list                       Connections to close once the lock is released
+        """
+        expired = []
+        now = monotonic()
+        # Oldest connections are on the left
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            cnx, _ = self._idle.popleft()
+            self._size -= 1
+            self._closed += 1
+            expired.append(cnx)
+        return expired
+
+    def fill(self):
+        """
+        Open connections until min_size is reached. Failures are reported but not raised so that
+        an unreachable host doesn't prevent the application from starting.
+        """
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+
+            try:
+                cnx = self._connect()
+            except mysql.connector.Error as err:
+                with self._cond:
+                    self._size -= 1
+                print(f"Couldn't open connection to {self.host}: {err}")
+                return
+
+            with self._cond:
+                self._created += 1
+                self._idle.append((cnx, monotonic()))
+                self._cond.notify()
+
+    def evict_idle(self):
+        """
+        Close connections idle for longer than idle_timeout, keeping at least min_size open.
+        """
+        with self._cond:
+            expired = self._evict_idle()
+        for cnx in expired:
+            self._close(cnx)
+
+    def acquire(self):
+        """
+        Check out a connection, opening a new one if none is idle and max_size isn't reached.
+
+        @return: MySQLConnection            Healthy connection
+        """
+        deadline = monotonic() + self.checkout_timeout
+
+        while True:
+            cnx = None
+            with self._cond:
+                expired = self._evict_idle()
+                while True:
+                    if self._idle:
+                        cnx, released_at = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolExhaustedError(
+                            f"No connection to {self.host} available after {self.checkout_timeout}s")
+                    self._waits += 1
+                    self._cond.wait(remaining)
+                self._checkouts += 1
+
+            for expired_cnx in expired:
+                self._close(expired_cnx)
+
+            if cnx is None:
+                try:
+                    cnx = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._created += 1
+                return cnx
+
+            if monotonic() - released_at < self.health_check_after or cnx.is_connected():
+                return cnx
+
+            # Broken connection, drop it and try again
+            self._close(cnx)
+            with self._cond:
+                self._size -= 1
+                self._closed += 1
+                self._health_check_failures += 1
+                self._cond.notify()
+
+    def release(self, cnx, discard: bool = False):
+        """
+        Give a connection back to the pool.
+
+        @param cnx: MySQLConnection         Connection obtained with acquire
+        @param discard: bool                Close the connection instead of reusing it
+        """
+        if not discard:
+            try:
+                if cnx.unread_result:
+                    cnx.consume_results()
+                if cnx.in_transaction:
+                    cnx.rollback()
+            except Exception:
+                discard = True
+
+        if discard:
+            self._close(cnx)
+
+        with self._cond:
+            if discard:
+                self._size -= 1
+                self._closed += 1
+            else:
+                self._idle.append((cnx, monotonic()))
+            self._cond.notify()
+
+    def ping(self):
+        """
+        Open a connection outside the pool and ping it, the host is checked even when every pooled
+        connection is in use.
+        """
+        cnx = self._connect()
+        try:
+            cnx.ping()
+        finally:
+            self._close(cnx)
+
+    def connection(self, keep_on: tuple = ()):
+        """
+        Context manager checking out a connection and releasing it on exit. The connection is
+        discarded if an error other than a query error happened while it was in use.
+
+        @param keep_on: tuple               Other exceptions leaving the connection usable
+        """
+        return _PooledConnection(self, keep_on)
+
+    def close(self):
+        """
+        Close all idle connections.
+        """
+        with self._cond:
+            idle = [cnx for cnx, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._closed += len(idle)
+        for cnx in idle:
+            self._close(cnx)
+
+    def stats(self):
+        """
+        @return: dict                       Occupancy and counters of the pool
+        """
+        with self._cond:
+            return {
+                "host": self.host,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "created": self._created,
+                "closed": self._closed,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "health_check_failures": self._health_check_failures
+            }
+
+
+# Errors caused by the statement itself, the connection is still usable after them
+QUERY_ERRORS = (
+    mysql.connector.errors.ProgrammingError,
+    mysql.connector.errors.DataError,
+    mysql.connector.errors.IntegrityError,
+    mysql.connector.errors.NotSupportedError
+)
+
+
+# Errors meaning the host couldn't be reached or dropped the connection. PoolExhaustedError isn't one
+# of them, a saturated pool says nothing about its host.
+CONNECTION_ERRORS = (
+    mysql.connector.errors.InterfaceError,
+    mysql.connector.errors.OperationalError
+)
+
+
+class _PooledConnection:
+    def __init__(self, pool: ConnectionPool, keep_on: tuple = ()):
+        self.pool = pool
+        self.keep_on = keep_on
+        self.cnx = None
+
+    def __enter__(self):
+        self.cnx = self.pool.acquire()
+        return self.cnx
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        discard = exc_type is not None and not issubclass(exc_type, QUERY_ERRORS + self.keep_on)
+        self.pool.release(self.cnx, discard=discard)
+        return False
+
+
+def start_pool_reaper(pools: "dict[str, ConnectionPool]", interval: float):
+    """
+    Start a daemon thread periodically closing expired idle connections of pools.
+
+    @param pools: dict[str, ConnectionPool]     Pools to watch
+    @param interval: float                      Seconds between two evictions
+
+    @return: threading.Thread                   Started thread
+    """
+    def reap():
+        while True:
+            sleep(interval)
+            for pool in pools.values():
+                pool.evict_idle()
+
+    thread = threading.Thread(target=reap, name="pool-reaper", daemon=True)
+    thread.start()
+    return thread
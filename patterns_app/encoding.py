@@ -0,0 +1,82 @@
+from contextvars import ContextVar
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+# Responses streamed row by row, one JSON document per line or back to back MessagePack documents
+NDJSON = "application/x-ndjson"
+MSGPACK_STREAM = "application/x-msgpack-stream"
+
+# Names other clients use for MessagePack
+_ALIASES = { "application/x-msgpack": MSGPACK, "application/vnd.msgpack": MSGPACK }
+
+_accepted = ContextVar("encoding", default=JSON)
+
+
+def negotiate(accept: str):
+    """
+    Pick the encoding of a response. JSON is the default, MessagePack is only used when the client
+    asks for it with at least the quality of JSON.
+
+    @param accept: str                      Accept header of the request, None if missing
+
+    @return: str                            JSON or MSGPACK
+    """
+    if not accept:
+        return JSON
+    qualities = {}
+    for item in accept.split(","):
+        media_type, *options = [part.strip() for part in item.split(";")]
+        media_type = _ALIASES.get(media_type.lower(), media_type.lower())
+        quality = 1.0
+        for option in options:
+            name, _, value = option.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[media_type] = max(quality, qualities.get(media_type, 0.0))
+    msgpack_quality = qualities.get(MSGPACK, 0.0)
+    return MSGPACK if msgpack_quality > 0 and msgpack_quality >= qualities.get(JSON, 0.0) else JSON
+
+def accepted():
+    """
+    @return: str                            Encoding negotiated for the request being handled
+    """
+    return _accepted.get()
+
+def pack(content):
+    """
+    @param content: dict                    Response or part of a streamed response
+
+    @return: bytes                          MessagePack document, dates and decimals are strings as in JSON
+    """
+    # Only the proxies encode MessagePack, the gatekeepers relay it untouched
+    import msgpack
+    return msgpack.packb(content, default=str, use_bin_type=True)
+
+
+def negotiate_flask(app):
+    """
+    Negotiate the encoding of the responses of a Flask app from the Accept header of the requests.
+    """
+    from flask import request
+
+    @app.before_request
+    def negotiate_encoding():
+        _accepted.set(negotiate(request.headers.get("Accept")))
+
+
+class NegotiationMiddleware:
+    """
+    ASGI middleware negotiating the encoding of the responses, the async apps counterpart of negotiate_flask.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            accept = next((value.decode("latin-1") for name, value in scope["headers"] if name == b"accept"), None)
+            _accepted.set(negotiate(accept))
+        await self.app(scope, receive, send)
@@ -1,33 +1,212 @@
-import os
-from flask import Flask, request
+from time import perf_counter
+from flask import Flask, Response, abort, jsonify, request
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from admission import AdaptiveLimit, ThreadedAdmissionController, admit_flask, parse_endpoint_limits
+from compression import Decompressor, accepted_encoding, compress_flask, decompress_chunks, is_supported
+from encoding import accepted, negotiate_flask
+from metrics import Registry, instrument_flask
+from scatter_gather import parse_scatter_query
+from sql_parsing import classify_statement
+from tracing import TraceLog, current_trace, stage, trace_flask
+from gatekeeper_settings import (
+    PORT, PROXY_HOST, PROXY_PORT, PROXY_POOL_SIZE, PROXY_CONNECT_TIMEOUT, PROXY_READ_TIMEOUT,
+    PROXY_RETRIES, PROXY_RETRY_BACKOFF, BATCH_MAX_SIZE, SCATTER_MAX_PARTS, QUERY_READ_METHOD, TRACE_SAMPLE_RATE, TRACE_LOG_PATH,
+    ADMISSION_MAX_CONCURRENCY, ADMISSION_MIN_CONCURRENCY, ADMISSION_TARGET_LATENCY, ADMISSION_ENDPOINT_LIMITS,
+    ADMISSION_CLIENT_LIMIT, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT,
+    COMPRESSION_MIN_SIZE, COMPRESSION_GZIP_LEVEL, COMPRESSION_ZSTD_LEVEL, PROXY_COMPRESSION,
+    is_valid_params, is_valid_statement, is_valid_token
+)
 
 app = Flask(__name__)
+metrics = Registry("gatekeeper_")
+instrument_flask(app, metrics)
+trace_log = TraceLog(TRACE_LOG_PATH)
+trace_flask(app, "gatekeeper", trace_log, TRACE_SAMPLE_RATE)
+negotiate_flask(app)
+compress_flask(app, metrics, COMPRESSION_MIN_SIZE, COMPRESSION_GZIP_LEVEL, COMPRESSION_ZSTD_LEVEL)
+metrics.histogram("proxy_duration_seconds", "Time until the proxy response headers are received, by endpoint", ("endpoint",))
+metrics.counter("proxy_errors_total", "Requests that couldn't be sent to the proxy, by endpoint", ("endpoint",))
+metrics.counter("classified_queries_total", "Statements sent to /query, by class", ("kind",))
+admission = ThreadedAdmissionController(
+    AdaptiveLimit(ADMISSION_MIN_CONCURRENCY, ADMISSION_MAX_CONCURRENCY, ADMISSION_TARGET_LATENCY),
+    parse_endpoint_limits(ADMISSION_ENDPOINT_LIMITS),
+    ADMISSION_CLIENT_LIMIT,
+    ADMISSION_QUEUE_SIZE,
+    ADMISSION_QUEUE_TIMEOUT
+)
+# Every endpoint forwarding to the proxy
+admit_flask(app, admission, metrics, [
+    '/write-query', '/read-query', '/query', '/batch', '/scatter-query',
+    '/session/begin', '/session/<token>/query', '/session/<token>/commit', '/session/<token>/rollback'
+])
 
-PROXY_HOST = os.getenv('PROXY_HOST')
 
 class LocalProxy:
-    def __send_query(self, url, query):
-        payload = json.dumps({
-            "query": query
-        })
+    def __init__(self, host: str, port: int = PROXY_PORT):
+        self.base_url = f"http://{host}:{port}"
+        self.timeout = (PROXY_CONNECT_TIMEOUT, PROXY_READ_TIMEOUT)
+
+        # Only failed connections are retried, the query was never sent in that case
+        retry = Retry(
+            total=PROXY_RETRIES,
+            connect=PROXY_RETRIES,
+            read=0,
+            status=0,
+            backoff_factor=PROXY_RETRY_BACKOFF
+        )
+        # Keep-alive connections to the proxy, reused between requests
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=PROXY_POOL_SIZE, max_retries=retry, pool_block=True)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+
+    def __send_query(self, path, payload: bytes, params=None, endpoint=None):
+        # Path reported in the metrics, without the session token
+        endpoint = endpoint or path
         headers = {
-            'Content-Type': 'application/json'
+            'Content-Type': 'application/json',
+            # The proxy encodes the response as the client asked, it is relayed without being decoded
+            'Accept': accepted(),
+            'Accept-Encoding': accepted_encoding() or LINK_COMPRESSION
         }
+        trace = current_trace()
+        if trace is not None:
+            headers.update(trace.headers())
+
+        start = perf_counter()
+        try:
+            with stage("forward"):
+                response = self.session.post(
+                    self.base_url + path, params=params, headers=headers, data=payload, timeout=self.timeout, stream=True
+                )
+        except requests.RequestException:
+            metrics.inc("proxy_errors_total", endpoint)
+            raise
+        metrics.observe("proxy_duration_seconds", perf_counter() - start, endpoint)
+        return response
+
+    def write_query(self, payload: bytes):
+        return self.__send_query("/write-query", payload)
+
+    def read_query(self, payload: bytes, method_id=0, stream=False, hedge=None):
+        params = {"method_id": method_id}
+        if stream:
+            params["stream"] = 1
+        if hedge is not None:
+            params["hedge"] = hedge
+        return self.__send_query("/read-query", payload, params=params)
+
+    def batch(self, payload: bytes):
+        return self.__send_query("/batch", payload)
+
+    def scatter_query(self, payload: bytes):
+        return self.__send_query("/scatter-query", payload)
+
+    def begin_session(self, method_id=None, read_only=False):
+        params = {"method_id": method_id}
+        if read_only:
+            params["read_only"] = 1
+        return self.__send_query("/session/begin", b"", params=params)
+
+    def session_query(self, token: str, payload: bytes):
+        return self.__send_query(f"/session/{token}/query", payload, endpoint="/session/{token}/query")
+
+    def end_session(self, token: str, commit: bool):
+        action = 'commit' if commit else 'rollback'
+        return self.__send_query(f"/session/{token}/{action}", b"", endpoint=f"/session/{{token}}/{action}")
+
+local_proxy = LocalProxy(PROXY_HOST)
+
+# Encoding asked from the proxy when the client doesn't accept any
+LINK_COMPRESSION = PROXY_COMPRESSION if is_supported(PROXY_COMPRESSION) else 'identity'
+
+def relay(proxy_response: requests.Response):
+    """
+    Stream the proxy response body to the client as it arrives, without decoding it. A body
+    compressed in an encoding the client doesn't accept is decompressed.
+
+    @param proxy_response: requests.Response    Response opened with stream=True
+
+    @return: flask.Response                     Response to return to the client
+    """
+    chunks = proxy_response.raw.stream(None, decode_content=False)
+    headers = {}
+    content_encoding = proxy_response.headers.get('Content-Encoding')
+    if content_encoding is not None and content_encoding != accepted_encoding():
+        chunks = decompress_chunks(chunks, Decompressor(content_encoding), metrics)
+    else:
+        if content_encoding is not None:
+            headers = {'Content-Encoding': content_encoding, 'Vary': 'Accept-Encoding'}
+        # Lets the compression skip small bodies
+        if 'Content-Length' in proxy_response.headers:
+            headers['Content-Length'] = proxy_response.headers['Content-Length']
 
-        response = requests.request("POST", url, headers=headers, data=payload)
-        return json.loads(response.text)
+    def generate():
+        try:
+            # Chunks are relayed as soon as they arrive
+            yield from chunks
+        finally:
+            proxy_response.close()
 
-    def write_query(self, query: str):
-        url = f"http://{PROXY_HOST}:5000/write-query"
-        return self.__send_query(url, query)
+    return Response(
+        generate(),
+        status=proxy_response.status_code,
+        headers=headers,
+        content_type=proxy_response.headers.get('Content-Type', 'application/json')
+    )
 
-    def read_query(self, query: str, method_id=0):
-        url = f"http://{PROXY_HOST}:5000/read-query?method_id={method_id}"
-        return self.__send_query(url, query)
+@app.errorhandler(requests.RequestException)
+def proxy_error(err: requests.RequestException):
+    """
+    Answer in the error shape of the proxy when it couldn't be reached, 504 if it didn't answer in time.
+    """
+    status = 504 if isinstance(err, requests.Timeout) else 502
+    return jsonify({ "node": "proxy", "result": [f"Failed reaching the proxy: {err}"], "error": True }), status
 
-local_proxy = LocalProxy()
+def query_payload():
+    """
+    Check that the request carries a query, and optionally the list of its params, and return its
+    body untouched so it can be forwarded without being serialised again.
+
+    @return: bytes                              Request body
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get('query'), str):
+        abort(400, "Expected a JSON body with a query string")
+    if not is_valid_params(body.get('params')):
+        abort(400, "params must be a list of strings, numbers or nulls")
+    return request.get_data()
+
+def batch_payload():
+    """
+    Check that the request carries a list of statements, each one with a query and a type, and
+    return its body untouched.
+
+    @return: bytes                              Request body
+    """
+    body = request.get_json(silent=True)
+    statements = body.get('statements') if isinstance(body, dict) else None
+    if not isinstance(statements, list) or len(statements) == 0:
+        abort(400, "Expected a JSON body with a non empty list of statements")
+    if len(statements) > BATCH_MAX_SIZE:
+        abort(400, f"A batch can't contain more than {BATCH_MAX_SIZE} statements")
+    for statement in statements:
+        if not is_valid_statement(statement):
+            abort(400, 'Each statement needs a query string, a type, "read" or "write", and optionally a list of params')
+    return request.get_data()
+
+def scatter_payload():
+    """
+    Check that the request describes a valid scatter query and return its body untouched.
+
+    @return: bytes                              Request body
+    """
+    try:
+        parse_scatter_query(request.get_json(silent=True), SCATTER_MAX_PARTS)
+    except ValueError as err:
+        abort(400, str(err))
+    return request.get_data()
 
 @app.route('/')
 def health_check():
@@ -35,16 +214,68 @@ def health_check():
 
 @app.route('/write-query', methods=['POST'])
 def execute_write_query():
-    query = request.get_json()['query']
-    return local_proxy.write_query(query)
+    return relay(local_proxy.write_query(query_payload()))
 
 @app.route('/read-query', methods=['POST'])
 def execute_read_query():
     method_id = request.args.get('method_id')
-    query = request.get_json()['query']
-    return local_proxy.read_query(query, method_id)
+    stream = request.args.get('stream') == '1'
+    hedge = request.args.get('hedge')
+    return relay(local_proxy.read_query(query_payload(), method_id, stream, hedge))
+
+@app.route('/query', methods=['POST'])
+def execute_query():
+    """
+    Execute a statement on the node its class allows: reads are routed like /read-query, with
+    QUERY_READ_METHOD if no method_id is given, everything else goes to the manager.
+    """
+    payload = query_payload()
+    with stage("classify"):
+        kind = classify_statement(request.get_json()['query'])
+    metrics.inc("classified_queries_total", kind)
+
+    if kind == "read":
+        method_id = request.args.get('method_id', QUERY_READ_METHOD)
+        stream = request.args.get('stream') == '1'
+        hedge = request.args.get('hedge')
+        return relay(local_proxy.read_query(payload, method_id, stream, hedge))
+    return relay(local_proxy.write_query(payload))
+
+def session_token(token: str):
+    if not is_valid_token(token):
+        abort(404, f"Unknown session {token}")
+    return token
+
+@app.route('/session/begin', methods=['POST'])
+def execute_begin_session():
+    method_id = request.args.get('method_id')
+    read_only = request.args.get('read_only') == '1'
+    return relay(local_proxy.begin_session(method_id, read_only))
+
+@app.route('/session/<token>/query', methods=['POST'])
+def execute_session_query(token):
+    return relay(local_proxy.session_query(session_token(token), query_payload()))
+
+@app.route('/session/<token>/commit', methods=['POST'])
+def execute_commit(token):
+    return relay(local_proxy.end_session(session_token(token), commit=True))
+
+@app.route('/session/<token>/rollback', methods=['POST'])
+def execute_rollback(token):
+    return relay(local_proxy.end_session(session_token(token), commit=False))
+
+@app.route('/batch', methods=['POST'])
+def execute_batch():
+    return relay(local_proxy.batch(batch_payload()))
+
+@app.route('/scatter-query', methods=['POST'])
+def execute_scatter_query():
+    """
+    Execute a read split into ranges of an integer column, the ranges run in parallel on the data nodes.
+    """
+    return relay(local_proxy.scatter_query(scatter_payload()))
 
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=PORT)
@@ -0,0 +1,68 @@
+import os
+
+# Port the gatekeeper listens on
+PORT = int(os.getenv('PORT', '5000'))
+PROXY_HOST = os.getenv('PROXY_HOST')
+PROXY_PORT = int(os.getenv('PROXY_PORT', '5000'))
+PROXY_POOL_SIZE = int(os.getenv('PROXY_POOL_SIZE', '20'))
+PROXY_CONNECT_TIMEOUT = float(os.getenv('PROXY_CONNECT_TIMEOUT', '2'))
+PROXY_READ_TIMEOUT = float(os.getenv('PROXY_READ_TIMEOUT', '60'))
+PROXY_RETRIES = int(os.getenv('PROXY_RETRIES', '3'))
+PROXY_RETRY_BACKOFF = float(os.getenv('PROXY_RETRY_BACKOFF', '0.1'))
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', '100'))
+SCATTER_MAX_PARTS = int(os.getenv('SCATTER_MAX_PARTS', '16'))
+# Routing method of the reads sent to /query without method_id, least loaded data node by default
+QUERY_READ_METHOD = os.getenv('QUERY_READ_METHOD', '3')
+
+# Share of the requests whose stage timings are written to TRACE_LOG_PATH, empty path to disable
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0.01'))
+TRACE_LOG_PATH = os.getenv('TRACE_LOG_PATH', 'gatekeeper_trace.jsonl') or None
+
+# Requests forwarded to the proxy at the same time, the limit moves between the min and the max,
+# shrinking when the proxy answers slower than ADMISSION_TARGET_LATENCY seconds or fails
+ADMISSION_MAX_CONCURRENCY = int(os.getenv('ADMISSION_MAX_CONCURRENCY', str(PROXY_POOL_SIZE)))
+ADMISSION_MIN_CONCURRENCY = int(os.getenv('ADMISSION_MIN_CONCURRENCY', '4'))
+ADMISSION_TARGET_LATENCY = float(os.getenv('ADMISSION_TARGET_LATENCY', '0.5'))
+# Limits of single endpoints, e.g. "/batch=4,/session/begin=8"
+ADMISSION_ENDPOINT_LIMITS = os.getenv('ADMISSION_ENDPOINT_LIMITS', '')
+# Requests of one client address in flight at the same time, over it requests get a 429
+ADMISSION_CLIENT_LIMIT = int(os.getenv('ADMISSION_CLIENT_LIMIT', '16'))
+# Requests waiting for the limit, and for how many seconds, before they get a 503
+ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', '64'))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', '1'))
+
+# Responses of COMPRESSION_MIN_SIZE bytes or more are compressed with gzip or zstd when the client accepts it,
+# streamed responses always are
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv('COMPRESSION_ZSTD_LEVEL', '3'))
+# Encoding asked from the proxy when the client doesn't accept any, the gatekeeper then decompresses the
+# response, empty to leave these responses uncompressed
+PROXY_COMPRESSION = os.getenv('PROXY_COMPRESSION', '')
+
+def is_valid_token(token: str):
+    """
+    @return: bool                               Whether token can be a session token
+    """
+    return 0 < len(token) <= 64 and all(c.isalnum() or c in "-_" for c in token)
+
+def is_valid_params(params):
+    """
+    @return: bool                               Whether params is missing or a list of scalar values
+    """
+    return params is None or (
+        isinstance(params, list)
+        and all(param is None or isinstance(param, (str, int, float)) for param in params)
+    )
+
+def is_valid_statement(statement):
+    """
+    @return: bool                               Whether statement is a valid statement of a batch
+    """
+    return (
+        isinstance(statement, dict)
+        and isinstance(statement.get('query'), str)
+        and statement.get('type') in ('read', 'write')
+        and isinstance(statement.get('method_id', 0), int)
+        and is_valid_params(statement.get('params'))
+    )
@@ -0,0 +1,31 @@
+import multiprocessing
+import os
+
+# Gunicorn settings of the production serving modes, for both apps:
+# python3 -m gunicorn -c patterns_app/gunicorn_conf.py --chdir patterns_app gatekeeper_app:app
+#
+# SERVING_MODE=production runs the Flask apps in threaded workers, SERVING_MODE=async-production runs
+# their asyncio versions in uvicorn workers. Send SIGHUP to the pid in PIDFILE to reload the workers
+# gracefully: new workers are started with the current code, old ones finish their requests first.
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_WORKERS', '0')) or multiprocessing.cpu_count()
+if os.getenv('SERVING_MODE') == 'async-production':
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    worker_class = "gthread"
+    # Requests mostly wait on the network, a worker serves several at once
+    threads = int(os.getenv('WEB_THREADS', '16'))
+
+# SO_REUSEPORT, a new master can bind the port while the previous one still drains its connections
+reuse_port = True
+# Keep the connections of the gatekeeper pool alive between requests, instead of closing them after 2s
+keepalive = int(os.getenv('WEB_KEEPALIVE', '75'))
+timeout = int(os.getenv('WEB_TIMEOUT', '90'))
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', '30'))
+pidfile = os.getenv('PIDFILE', 'gunicorn.pid')
+
+# The apps create their connection pools and background threads when they are imported. The app is
+# imported by each worker after the fork, so every worker has its own pools and threads, none of
+# them inherited half initialised from the master.
+preload_app = False
@@ -0,0 +1,195 @@
+import asyncio
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import copy_context
+
+
+class AttemptCancelled(Exception):
+    """
+    Raised when a hedged attempt is cancelled before its statement started, or when its statement
+    was killed.
+    """
+
+    def __init__(self, host_name: str):
+        super().__init__(f"Read on {host_name} cancelled, another node answered first")
+
+
+class Attempt:
+    """
+    Execution of a hedged read on one node. The statement runs inside running, with the id of its
+    connection, so that cancel can kill it on the server without killing the next statement of
+    the connection.
+    """
+
+    def __init__(self, host_name: str):
+        self.host_name = host_name
+        self.cancelled = False
+        self.connection_id = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def running(self, connection_id: int):
+        with self._lock:
+            if self.cancelled:
+                raise AttemptCancelled(self.host_name)
+            self.connection_id = connection_id
+        try:
+            yield
+        finally:
+            # Waits for a kill in progress, the connection must not be reused before
+            with self._lock:
+                self.connection_id = None
+
+    @contextmanager
+    def _still_running(self, connection_id: int):
+        # Held while the KILL statement is sent, the connection can't be given back and reused meanwhile
+        with self._lock:
+            yield self.connection_id == connection_id
+
+    def cancel(self, kill):
+        """
+        @param kill: function               kill(host_name, connection_id, still_running) kills the statement of
+                                            a connection. still_running() is a context manager telling whether
+                                            the statement still runs, the KILL statement must be sent inside it
+        """
+        with self._lock:
+            self.cancelled = True
+            connection_id = self.connection_id
+        # The kill checks out its connection without the lock, the statement can end in the meantime
+        if connection_id is not None:
+            kill(self.host_name, connection_id, lambda: self._still_running(connection_id))
+
+
+class AsyncAttempt:
+    """
+    Async version of Attempt.
+    """
+
+    def __init__(self, host_name: str):
+        self.host_name = host_name
+        self.cancelled = False
+        self.connection_id = None
+        # Done once the KILL statement in progress was sent
+        self._killing = None
+
+    @asynccontextmanager
+    async def running(self, connection_id: int):
+        if self.cancelled:
+            raise AttemptCancelled(self.host_name)
+        self.connection_id = connection_id
+        try:
+            yield
+        finally:
+            self.connection_id = None
+            if self._killing is not None:
+                await self._killing
+
+    @asynccontextmanager
+    async def _still_running(self, connection_id: int):
+        if self.connection_id != connection_id:
+            yield False
+            return
+        self._killing = asyncio.get_running_loop().create_future()
+        try:
+            yield True
+        finally:
+            self._killing.set_result(None)
+
+    def cancel(self, kill):
+        """
+        @param kill: coroutine function     Async version of the kill of Attempt.cancel, still_running() is an
+                                            async context manager
+        """
+        self.cancelled = True
+        if self.connection_id is not None:
+            connection_id = self.connection_id
+            task = asyncio.ensure_future(kill(self.host_name, connection_id, lambda: self._still_running(connection_id)))
+            _background.add(task)
+            task.add_done_callback(_background.discard)
+
+
+def _pick(responses: "list[tuple[dict, object]]"):
+    """
+    @return: dict, Attempt                  First successful response and its attempt, (None, None) if none succeeded
+    """
+    for response, attempt in responses:
+        if not response.get("error"):
+            return response, attempt
+    return None, None
+
+
+def hedged_read(executor: ThreadPoolExecutor, run, primary: str, choose_hedge, delay: float, kill):
+    """
+    Execute a read on primary, and on a second node too if primary hasn't answered within delay or
+    failed. The first successful response is returned and the other attempt is cancelled.
+
+    @param executor: ThreadPoolExecutor     Runs the attempts, and the kills
+    @param run: function                    run(attempt) executes the read on attempt.host_name and returns the response
+    @param primary: str                     Node chosen for the read
+    @param choose_hedge: function           Returns the node of the second attempt, None for no second attempt
+    @param delay: float                     Seconds to wait for primary before sending the second attempt
+    @param kill: function                   kill(host_name, connection_id) kills the statement of a connection
+
+    @return: dict, str or None              Response, node of the second attempt if there was one
+    """
+    # The attempts run in copies of the request context, so they add their stages to the trace
+    first = Attempt(primary)
+    attempts = { executor.submit(copy_context().run, run, first): first }
+
+    done, _ = wait(attempts, timeout=delay)
+    hedge_host_name = None
+    # A failed primary is hedged right away
+    if len(done) == 0 or next(iter(done)).result().get("error"):
+        hedge_host_name = choose_hedge()
+        if hedge_host_name is not None:
+            second = Attempt(hedge_host_name)
+            attempts[executor.submit(copy_context().run, run, second)] = second
+
+    finished = []
+    pending = set(attempts)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        finished.extend((future.result(), attempts[future]) for future in done)
+        response, winner = _pick(finished)
+        if winner is not None:
+            for future in pending:
+                executor.submit(attempts[future].cancel, kill)
+            return response, hedge_host_name
+
+    # Every attempt failed, the error of primary is returned
+    return next(response for response, attempt in finished if attempt is first), hedge_host_name
+
+
+async def async_hedged_read(run, primary: str, choose_hedge, delay: float, kill):
+    """
+    Async version of hedged_read, the losing attempt keeps running in the background until it is killed.
+    """
+    first = AsyncAttempt(primary)
+    attempts = { asyncio.ensure_future(run(first)): first }
+
+    done, _ = await asyncio.wait(attempts, timeout=delay)
+    hedge_host_name = None
+    if len(done) == 0 or next(iter(done)).result().get("error"):
+        hedge_host_name = choose_hedge()
+        if hedge_host_name is not None:
+            second = AsyncAttempt(hedge_host_name)
+            attempts[asyncio.ensure_future(run(second))] = second
+
+    finished = []
+    pending = set(attempts)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finished.extend((task.result(), attempts[task]) for task in done)
+        response, winner = _pick(finished)
+        if winner is not None:
+            for task in pending:
+                _background.add(task)
+                task.add_done_callback(_background.discard)
+                attempts[task].cancel(kill)
+            return response, hedge_host_name
+
+    return next(response for response, attempt in finished if attempt is first), hedge_host_name
+
+# The loop only keeps a weak reference to its tasks
+_background = set()
@@ -0,0 +1,157 @@
+import threading
+from time import monotonic, perf_counter, sleep
+
+
+class LatencyProber:
+    """
+    Background measurement of the round trip time to a set of hosts.
+
+    A daemon thread pings every host over a MySQL connection at a fixed interval and keeps an
+    exponentially weighted moving average of the ping time per host. The connections stay open
+    between rounds: a bare TCP connect closed without handshake counts as a connection error for
+    MySQL, which blocks the proxy host after max_connect_errors of them. Only the prober thread
+    writes the table, request handlers read it without locking.
+    """
+
+    def __init__(
+        self,
+        hosts: "dict[str, str]",
+        connect,
+        interval: float = 1.0,
+        timeout: float = 1.0,
+        alpha: float = 0.3,
+        ttl: float = 5.0
+    ):
+        """
+        @param hosts: dict[str, str]        Host name -> host address of the hosts to probe
+        @param connect: function            connect(host, timeout) opens a MySQL connection with a ping(reconnect)
+                                            method to host, with timeout seconds for the connection and the pings
+        @param interval: float              Seconds between two probe rounds
+        @param timeout: float               Seconds after which a probe is considered failed
+        @param alpha: float                 Weight of the newest sample in the moving average
+        @param ttl: float                   Seconds after which a measure is considered stale
+        """
+        self.hosts = hosts
+        self.connect = connect
+        self.interval = interval
+        self.timeout = timeout
+        self.alpha = alpha
+        self.ttl = ttl
+
+        # host name -> (average rtt in ms, time of last successful probe)
+        self._rtt = {}
+        self._down = set()
+        # (host name, average rtt in ms, time of the probe round)
+        self._best = (None, None, 0.0)
+        self._thread = None
+        # host name -> connection of the prober
+        self._connections = {}
+
+    def probe(self, host_name: str, host: str):
+        """
+        Measure the round trip time of a MySQL ping to host, connecting first if needed.
+
+        @param host_name: str               Host name
+        @param host: str                    Host address
+
+        @return: float or None              Ping time in ms, None if the host is unreachable
+        """
+        cnx = self._connections.get(host_name)
+        try:
+            if cnx is None:
+                cnx = self.connect(host, self.timeout)
+                self._connections[host_name] = cnx
+            start = perf_counter()
+            cnx.ping(reconnect=False)
+            return (perf_counter() - start) * 1000
+        # The errors depend on the driver of connect
+        except Exception:
+            self._connections.pop(host_name, None)
+            if cnx is not None:
+                try:
+                    cnx.close()
+                except Exception:
+                    pass
+            return None
+
+    def probe_all(self):
+        """
+        Probe every host once and update the moving averages and the best host.
+        """
+        rtt = dict(self._rtt)
+        down = set(self._down)
+
+        for host_name, host in self.hosts.items():
+            sample = self.probe(host_name, host)
+            now = monotonic()
+            if sample is None:
+                down.add(host_name)
+                rtt.pop(host_name, None)
+                continue
+
+            previous = rtt.get(host_name)
+            if previous is None or now - previous[1] > self.ttl:
+                average = sample
+            else:
+                average = self.alpha * sample + (1 - self.alpha) * previous[0]
+            rtt[host_name] = (average, now)
+            down.discard(host_name)
+
+        best = (None, None, monotonic())
+        for host_name, (average, _) in rtt.items():
+            if best[1] is None or average < best[1]:
+                best = (host_name, average, best[2])
+
+        self._rtt = rtt
+        self._down = down
+        self._best = best
+
+    def start(self):
+        """
+        Start the probing thread if it isn't running yet.
+        """
+        if self._thread is not None:
+            return
+
+        def run():
+            while True:
+                try:
+                    self.probe_all()
+                except Exception as e:
+                    print(e)
+                sleep(self.interval)
+
+        self._thread = threading.Thread(target=run, name="latency-prober", daemon=True)
+        self._thread.start()
+
+    def best_node(self):
+        """
+        @return: str or None, float or None     Name and average rtt in ms of the fastest reachable host,
+                                                (None, None) if no fresh measure is available
+        """
+        host_name, average, measured_at = self._best
+        if host_name is None or monotonic() - measured_at > self.ttl:
+            return None, None
+        return host_name, average
+
+    def is_down(self, host_name: str):
+        """
+        @return: bool                       Whether the last probe of host_name failed
+        """
+        return host_name in self._down
+
+    def table(self):
+        """
+        @return: dict                       Per host average rtt in ms, age of the measure and state
+        """
+        now = monotonic()
+        rtt = self._rtt
+        down = self._down
+        return {
+            host_name: {
+                "rtt_ms": rtt[host_name][0] if host_name in rtt else None,
+                "age_s": now - rtt[host_name][1] if host_name in rtt else None,
+                "down": host_name in down
+            }
+            for host_name in self.hosts.keys()
+        }
@@ -0,0 +1,131 @@
+import random
+import threading
+from collections import deque
+from time import monotonic
+
+
+class LoadTracker:
+    """
+    Load of a set of hosts as seen by this proxy.
+
+    Every query executed on a host is counted as in flight until it completes, and its duration
+    feeds an exponentially weighted moving average of the query latency of the host. The score of
+    a host combines both, the least loaded host is picked among a few randomly sampled ones (power
+    of two choices) so that simultaneous requests don't all rush to the same host.
+    """
+
+    def __init__(
+        self,
+        host_names: "list[str]",
+        alpha: float = 0.3,
+        in_flight_weight: float = 1.0,
+        latency_weight: float = 0.1,
+        choices: int = 2,
+        ttl: float = 5.0,
+        window: int = 200
+    ):
+        """
+        @param host_names: list[str]        Names of the hosts to track
+        @param alpha: float                 Weight of the newest sample in the moving average
+        @param in_flight_weight: float      Score of one query in flight
+        @param latency_weight: float        Score of one ms of average latency
+        @param choices: int                 Number of hosts sampled to choose one
+        @param ttl: float                   Seconds after which an average latency is ignored, so that a
+                                            host which was slow gets queries again
+        @param window: int                  Number of recent latency samples kept per host for percentile
+        """
+        self.alpha = alpha
+        self.in_flight_weight = in_flight_weight
+        self.latency_weight = latency_weight
+        self.choices = choices
+        self.ttl = ttl
+
+        self._in_flight = { host_name: 0 for host_name in host_names }
+        # host name -> (average latency in ms, time of last sample)
+        self._latency = {}
+        # host name -> recent latency samples in ms
+        self._samples = { host_name: deque(maxlen=window) for host_name in host_names }
+        self._lock = threading.Lock()
+
+    def begin(self, host_name: str):
+        """
+        Count a query as in flight on host_name.
+
+        @return: float                      Start time to pass to end
+        """
+        with self._lock:
+            self._in_flight[host_name] = self._in_flight.get(host_name, 0) + 1
+        return monotonic()
+
+    def end(self, host_name: str, started: float, record: bool = True):
+        """
+        Count a query started with begin as completed.
+
+        @param host_name: str               Host the query was executed on
+        @param started: float               Value returned by begin
+        @param record: bool                 Whether the duration of the query is a latency sample
+        """
+        now = monotonic()
+        sample = (now - started) * 1000
+        with self._lock:
+            self._in_flight[host_name] -= 1
+            if not record:
+                return
+            previous = self._latency.get(host_name)
+            if previous is None or now - previous[1] > self.ttl:
+                average = sample
+            else:
+                average = self.alpha * sample + (1 - self.alpha) * previous[0]
+            self._latency[host_name] = (average, now)
+            self._samples[host_name].append(sample)
+
+    def _score(self, host_name: str, now: float):
+        latency = self._latency.get(host_name)
+        # Unknown or stale latency counts as none, the host is tried again
+        average = latency[0] if latency is not None and now - latency[1] <= self.ttl else 0.0
+        return self.in_flight_weight * self._in_flight.get(host_name, 0) + self.latency_weight * average
+
+    def choose(self, candidates: "list[str]"):
+        """
+        Choose the least loaded of a random sample of candidates.
+
+        @param candidates: list[str]        Names of the hosts that can be chosen, not empty
+
+        @return: str, float                 Name and score of the chosen host
+        """
+        sample = random.sample(candidates, min(self.choices, len(candidates)))
+        now = monotonic()
+        with self._lock:
+            scores = [(host_name, self._score(host_name, now)) for host_name in sample]
+        # Ties go to the first sampled host, which is random
+        return min(scores, key=lambda score: score[1])
+
+    def percentile(self, host_name: str, q: float, min_samples: int = 20):
+        """
+        @param host_name: str               Host
+        @param q: float                     Percentile, between 0 and 100
+        @param min_samples: int             Samples needed for the percentile to be meaningful
+
+        @return: float or None              q-th percentile of the recent latency of host_name in ms, None
+                                            if there are fewer than min_samples samples
+        """
+        with self._lock:
+            samples = sorted(self._samples[host_name])
+        if len(samples) < min_samples:
+            return None
+        return samples[min(int(len(samples) * q / 100), len(samples) - 1)]
+
+    def table(self):
+        """
+        @return: dict                       Per host queries in flight, average latency in ms and score
+        """
+        now = monotonic()
+        with self._lock:
+            return {
+                host_name: {
+                    "in_flight": in_flight,
+                    "latency_ms": self._latency[host_name][0] if host_name in self._latency else None,
+                    "score": self._score(host_name, now)
+                }
+                for host_name, in_flight in self._in_flight.items()
+            }
@@ -0,0 +1,274 @@
+import re
+import threading
+import weakref
+from bisect import bisect_left
+from time import perf_counter
+from urllib.parse import parse_qs
+
+# Upper bounds, in seconds, of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# method_id values reported as is, any other is reported as "other" to bound the number of series
+METHOD_LABELS = ("0", "1", "2", "3")
+
+
+class _Shard:
+    """
+    Values recorded by one thread. Only its thread writes it, so recording needs no lock.
+    """
+    __slots__ = ("values", "__weakref__")
+
+    def __init__(self):
+        # (metric name, label values) -> count, or list of bucket counts followed by sum and count
+        self.values = {}
+
+
+class Registry:
+    """
+    Counters and histograms exposed in the Prometheus text format.
+
+    Every thread records into its own shard, the shards are only summed when the metrics are
+    scraped. When a thread ends, its shard is merged into the values of the dead threads so that
+    counters never go down.
+    """
+
+    def __init__(self, prefix: str):
+        """
+        @param prefix: str                  Prefix of the name of every metric
+        """
+        self.prefix = prefix
+        # name -> (type, help, label names, buckets)
+        self._metrics = {}
+        # name -> (type, help, label names, function returning {label values: value})
+        self._callbacks = {}
+
+        self._local = threading.local()
+        # id of shard -> values of the shards of live threads
+        self._shards = {}
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _values(self):
+        try:
+            return self._local.shard.values
+        except AttributeError:
+            shard = _Shard()
+            self._local.shard = shard
+            with self._lock:
+                self._shards[id(shard)] = shard.values
+            weakref.finalize(shard, self._retire, id(shard), shard.values)
+            return shard.values
+
+    def _retire(self, shard_id: int, values: dict):
+        with self._lock:
+            del self._shards[shard_id]
+            _merge(self._retired, values)
+
+    def counter(self, name: str, help: str, labels: "tuple[str]" = ()):
+        """
+        Declare a counter, incremented with inc.
+        """
+        self._metrics[self.prefix + name] = ("counter", help, labels, None)
+
+    def histogram(self, name: str, help: str, labels: "tuple[str]" = (), buckets: "tuple[float]" = DEFAULT_BUCKETS):
+        """
+        Declare a histogram, fed with observe.
+        """
+        self._metrics[self.prefix + name] = ("histogram", help, labels, tuple(buckets))
+
+    def callback(self, name: str, help: str, labels: "tuple[str]", collect, kind: str = "gauge"):
+        """
+        Declare a metric whose values are read from collect when the metrics are scraped, for values
+        that are already maintained elsewhere.
+
+        @param collect: function            Returns a dict, label values -> value
+        @param kind: str                    "gauge" or "counter"
+        """
+        self._callbacks[self.prefix + name] = (kind, help, labels, collect)
+
+    def inc(self, name: str, *label_values: str, amount: float = 1):
+        values = self._values()
+        key = (self.prefix + name, label_values)
+        values[key] = values.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, *label_values: str):
+        full_name = self.prefix + name
+        buckets = self._metrics[full_name][3]
+        values = self._values()
+        key = (full_name, label_values)
+        histogram = values.get(key)
+        if histogram is None:
+            # One count per bucket and +Inf, then sum and count
+            histogram = [0] * (len(buckets) + 3)
+            values[key] = histogram
+        histogram[bisect_left(buckets, value)] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    def render(self):
+        """
+        @return: str                        All the metrics in the Prometheus text format
+        """
+        with self._lock:
+            totals = {}
+            _merge(totals, self._retired)
+            for values in list(self._shards.values()):
+                _merge(totals, values.copy())
+
+        by_metric = {}
+        for (name, label_values), value in totals.items():
+            by_metric.setdefault(name, []).append((label_values, value))
+
+        lines = []
+        for name, (kind, help, labels, buckets) in self._metrics.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for label_values, value in sorted(by_metric.get(name, [])):
+                if kind == "counter":
+                    lines.append(f"{name}{_labels(labels, label_values)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + (float("inf"),), value):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else _number(bound)
+                    lines.append(f"{name}_bucket{_labels(labels + ('le',), label_values + (le,))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels, label_values)} {_number(value[-2])}")
+                lines.append(f"{name}_count{_labels(labels, label_values)} {value[-1]}")
+
+        for name, (kind, help, labels, collect) in self._callbacks.items():
+            try:
+                collected = collect()
+            except Exception as e:
+                print(e)
+                continue
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for label_values, value in sorted(collected.items()):
+                if value is not None:
+                    lines.append(f"{name}{_labels(labels, label_values)} {_number(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _merge(totals: dict, values: dict):
+    for key, value in values.items():
+        if isinstance(value, list):
+            total = totals.get(key)
+            totals[key] = list(value) if total is None else [a + b for a, b in zip(total, value)]
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+def _labels(names: "tuple[str]", values: "tuple[str]"):
+    if len(names) == 0:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+def _number(value: float):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def method_label(method_id):
+    """
+    @return: str                            Label of a method_id query parameter
+    """
+    if method_id is None:
+        return ""
+    return method_id if method_id in METHOD_LABELS else "other"
+
+
+def endpoint_matcher(endpoints: "list[str]"):
+    """
+    @param endpoints: list[str]             Route paths, parameters written as {name}
+
+    @return: function                       Returns the route path matching a request path, "other" if none does
+    """
+    static = set(endpoint for endpoint in endpoints if "{" not in endpoint)
+    patterns = [
+        (re.compile("^" + re.sub(r"\\\{\w+\\\}", "[^/]+", re.escape(endpoint)) + "$"), endpoint)
+        for endpoint in endpoints if "{" in endpoint
+    ]
+
+    def match(path: str):
+        if path in static:
+            return path
+        for pattern, endpoint in patterns:
+            if pattern.match(path):
+                return endpoint
+        return "other"
+
+    return match
+
+
+def declare_request_metrics(registry: Registry):
+    registry.counter("requests_total", "Requests handled, by endpoint and status code", ("endpoint", "status"))
+    registry.histogram(
+        "request_duration_seconds",
+        "Time until the response headers are sent, by endpoint and routing method",
+        ("endpoint", "method_id")
+    )
+
+def instrument_flask(app, registry: Registry):
+    """
+    Record the count and duration of the requests handled by a Flask app, and serve the metrics
+    on /metrics.
+    """
+    from flask import Response, g, request
+
+    declare_request_metrics(registry)
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        endpoint = request.url_rule.rule if request.url_rule is not None else "other"
+        registry.inc("requests_total", endpoint, str(response.status_code))
+        registry.observe(
+            "request_duration_seconds",
+            perf_counter() - g.metrics_start,
+            endpoint,
+            method_label(request.args.get("method_id"))
+        )
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(registry.render(), content_type=CONTENT_TYPE)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the count and duration of the requests, the async apps counterpart
+    of instrument_flask.
+    """
+
+    def __init__(self, app, registry: Registry, endpoints: "list[str]"):
+        """
+        @param app: ASGI app                Wrapped app
+        @param registry: Registry           Registry receiving the metrics
+        @param endpoints: list[str]         Route paths the requests are reported under, "other" for any other path
+        """
+        self.app = app
+        self.registry = registry
+        self.endpoint = endpoint_matcher(endpoints)
+        declare_request_metrics(registry)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = perf_counter()
+        endpoint = self.endpoint(scope["path"])
+        method_id = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("method_id", [None])[0]
+
+        async def send_and_record(message):
+            if message["type"] == "http.response.start":
+                self.registry.inc("requests_total", endpoint, str(message["status"]))
+                self.registry.observe("request_duration_seconds", perf_counter() - start, endpoint, method_label(method_id))
+            await send(message)
+
+        await self.app(scope, receive, send_and_record)
@@ -0,0 +1,82 @@
+import os
+
+# Port the proxy listens on
+PORT = int(os.getenv('PORT', '5000'))
+USER = os.getenv('USER')
+PASSWORD = os.getenv('PASSWORD')
+DATABASE = os.getenv('DATABASE')
+HOSTS = { "manager": os.getenv('MANAGER_HOST') }
+HOSTS = HOSTS | { f"data_node_{i}": host for i, host in enumerate(os.getenv("DATA_NODES_HOST").split(',')) }
+DATA_NODES = [host_name for host_name in HOSTS.keys() if host_name != "manager"]
+
+POOL_MIN_SIZE = int(os.getenv('POOL_MIN_SIZE', '1'))
+POOL_MAX_SIZE = int(os.getenv('POOL_MAX_SIZE', '10'))
+POOL_IDLE_TIMEOUT = float(os.getenv('POOL_IDLE_TIMEOUT', '300'))
+POOL_CHECKOUT_TIMEOUT = float(os.getenv('POOL_CHECKOUT_TIMEOUT', '5'))
+POOL_HEALTH_CHECK_AFTER = float(os.getenv('POOL_HEALTH_CHECK_AFTER', '1'))
+# Seconds to wait for a new MySQL connection, a node that is down fails fast instead of waiting for the OS
+POOL_CONNECT_TIMEOUT = int(os.getenv('POOL_CONNECT_TIMEOUT', '2'))
+
+MYSQL_PORT = int(os.getenv('MYSQL_PORT', '3306'))
+PROBE_INTERVAL = float(os.getenv('PROBE_INTERVAL', '1'))
+PROBE_TIMEOUT = float(os.getenv('PROBE_TIMEOUT', '1'))
+PROBE_ALPHA = float(os.getenv('PROBE_ALPHA', '0.3'))
+PROBE_TTL = float(os.getenv('PROBE_TTL', '5'))
+
+CACHE_ENABLED = os.getenv('CACHE_ENABLED', '1') == '1'
+CACHE_TTL = float(os.getenv('CACHE_TTL', '30'))
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '1024'))
+CACHE_MAX_ROWS = int(os.getenv('CACHE_MAX_ROWS', '10000'))
+
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', '100'))
+BATCH_MAX_WORKERS = int(os.getenv('BATCH_MAX_WORKERS', '16'))
+
+# Rows fetched at a time when streaming a result
+STREAM_FETCH_SIZE = int(os.getenv('STREAM_FETCH_SIZE', '500'))
+
+# Prepared statements kept per connection for the queries sent with params
+PREPARED_CACHE_SIZE = int(os.getenv('PREPARED_CACHE_SIZE', '64'))
+
+# Least loaded routing, the score of a node is
+# LOAD_IN_FLIGHT_WEIGHT * queries in flight + LOAD_LATENCY_WEIGHT * average query latency in ms
+LOAD_ALPHA = float(os.getenv('LOAD_ALPHA', '0.3'))
+LOAD_IN_FLIGHT_WEIGHT = float(os.getenv('LOAD_IN_FLIGHT_WEIGHT', '1'))
+LOAD_LATENCY_WEIGHT = float(os.getenv('LOAD_LATENCY_WEIGHT', '0.1'))
+LOAD_CHOICES = int(os.getenv('LOAD_CHOICES', '2'))
+LOAD_TTL = float(os.getenv('LOAD_TTL', '5'))
+
+# Share of the requests whose stage timings are written to TRACE_LOG_PATH, empty path to disable
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0.01'))
+TRACE_LOG_PATH = os.getenv('TRACE_LOG_PATH', 'proxy_trace.jsonl') or None
+
+# Transaction sessions, rolled back after SESSION_IDLE_TIMEOUT seconds without statement
+SESSION_IDLE_TIMEOUT = float(os.getenv('SESSION_IDLE_TIMEOUT', '30'))
+SESSION_MAX = int(os.getenv('SESSION_MAX', '50'))
+
+# Circuit breakers, a node is skipped after BREAKER_FAILURE_THRESHOLD consecutive connection failures,
+# and probed again after BREAKER_RESET_TIMEOUT seconds
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))
+BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', '5'))
+
+# Hedged reads, sent with hedge=1 or to every read with HEDGE_READS=1: a read not answered within the
+# HEDGE_PERCENTILE latency of its node, bounded by HEDGE_MIN_DELAY and HEDGE_MAX_DELAY seconds, is sent to a
+# second data node too, the first answer wins
+HEDGE_READS = os.getenv('HEDGE_READS', '0') == '1'
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', '95'))
+HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY', '0.002'))
+HEDGE_MAX_DELAY = float(os.getenv('HEDGE_MAX_DELAY', '0.5'))
+HEDGE_MAX_WORKERS = int(os.getenv('HEDGE_MAX_WORKERS', '64'))
+
+# Maximum number of ranges a /scatter-query read is split into
+SCATTER_MAX_PARTS = int(os.getenv('SCATTER_MAX_PARTS', '16'))
+
+# Responses of COMPRESSION_MIN_SIZE bytes or more are compressed with gzip or zstd when the client accepts it,
+# streamed responses always are
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv('COMPRESSION_ZSTD_LEVEL', '3'))
+
+DIRECT_HIT = 0
+RANDOM_HIT = 1
+CUSTOM_HIT = 2
+LEAST_LOADED_HIT = 3
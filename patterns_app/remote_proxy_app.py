@@ -1,91 +1,816 @@
-import os
-import subprocess
+import math
 import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from contextvars import copy_context
+from itertools import groupby
+from time import monotonic, perf_counter, sleep
 import mysql.connector
-from flask import Flask, request
+from mysql.connector import errorcode
+from flask import Flask, Response, abort, request
+from circuit_breaker import STATE_VALUES, CircuitBreakers
+from compression import compress_flask
+from connection_pool import CONNECTION_ERRORS, QUERY_ERRORS, ConnectionPool, PoolExhaustedError, start_pool_reaper
+from encoding import MSGPACK, MSGPACK_STREAM, NDJSON, accepted, negotiate_flask, pack
+from hedging import Attempt, AttemptCancelled, hedged_read
+from latency_prober import LatencyProber
+from load_tracker import LoadTracker
+from metrics import Registry, instrument_flask, method_label
+from result_cache import ResultCache
+from scatter_gather import ScatterQuery, parse_scatter_query
+from sessions import SessionBusyError, SessionLimitError, SessionManager, SessionNotFoundError
+from sql_parsing import classify_statement, statement_params
+from statement_cache import get_statement_cache, statement_cache_stats
+from tracing import TraceLog, add_stage, current_trace, stage, tag, trace_flask
+from proxy_settings import (
+    PORT, USER, PASSWORD, DATABASE, HOSTS, DATA_NODES,
+    POOL_MIN_SIZE, POOL_MAX_SIZE, POOL_IDLE_TIMEOUT, POOL_CHECKOUT_TIMEOUT, POOL_HEALTH_CHECK_AFTER, POOL_CONNECT_TIMEOUT,
+    MYSQL_PORT, PROBE_INTERVAL, PROBE_TIMEOUT, PROBE_ALPHA, PROBE_TTL,
+    CACHE_ENABLED, CACHE_TTL, CACHE_MAX_ENTRIES, CACHE_MAX_ROWS,
+    BATCH_MAX_SIZE, BATCH_MAX_WORKERS, STREAM_FETCH_SIZE, PREPARED_CACHE_SIZE,
+    LOAD_ALPHA, LOAD_IN_FLIGHT_WEIGHT, LOAD_LATENCY_WEIGHT, LOAD_CHOICES, LOAD_TTL,
+    TRACE_SAMPLE_RATE, TRACE_LOG_PATH, SESSION_IDLE_TIMEOUT, SESSION_MAX,
+    BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT,
+    HEDGE_READS, HEDGE_PERCENTILE, HEDGE_MIN_DELAY, HEDGE_MAX_DELAY, HEDGE_MAX_WORKERS, SCATTER_MAX_PARTS,
+    COMPRESSION_MIN_SIZE, COMPRESSION_GZIP_LEVEL, COMPRESSION_ZSTD_LEVEL,
+    DIRECT_HIT, RANDOM_HIT, CUSTOM_HIT, LEAST_LOADED_HIT
+)
 
 app = Flask(__name__)
+metrics = Registry("proxy_")
+instrument_flask(app, metrics)
+trace_log = TraceLog(TRACE_LOG_PATH)
+trace_flask(app, "proxy", trace_log, TRACE_SAMPLE_RATE)
+negotiate_flask(app)
+compress_flask(app, metrics, COMPRESSION_MIN_SIZE, COMPRESSION_GZIP_LEVEL, COMPRESSION_ZSTD_LEVEL)
 
-USER = os.getenv('USER')
-PASSWORD = os.getenv('PASSWORD')
-DATABASE = os.getenv('DATABASE')
-HOSTS = { "manager": os.getenv('MANAGER_HOST') }
-HOSTS = HOSTS | { f"data_node_{i}": host for i, host in enumerate(os.getenv("DATA_NODES_HOST").split(',')) }
+# One pool per host, connections are kept warm between requests
+POOLS = {
+    host_name: ConnectionPool(
+        host, USER, PASSWORD, DATABASE,
+        min_size=POOL_MIN_SIZE,
+        max_size=POOL_MAX_SIZE,
+        idle_timeout=POOL_IDLE_TIMEOUT,
+        checkout_timeout=POOL_CHECKOUT_TIMEOUT,
+        health_check_after=POOL_HEALTH_CHECK_AFTER,
+        connect_timeout=POOL_CONNECT_TIMEOUT
+    )
+    for host_name, host in HOSTS.items()
+}
+for pool in POOLS.values():
+    pool.fill()
+start_pool_reaper(POOLS, max(POOL_IDLE_TIMEOUT / 2, 1.0))
 
-DIRECT_HIT = 0
-RANDOM_HIT = 1
-CUSTOM_HIT = 2
+def connect_prober(host: str, timeout: float):
+    return mysql.connector.connect(
+        user=USER, password=PASSWORD, host=host, port=MYSQL_PORT, connection_timeout=math.ceil(timeout)
+    )
 
+# Data nodes latency is measured in the background, never on the request path
+latency_prober = LatencyProber(
+    { host_name: HOSTS[host_name] for host_name in DATA_NODES },
+    connect_prober,
+    interval=PROBE_INTERVAL,
+    timeout=PROBE_TIMEOUT,
+    alpha=PROBE_ALPHA,
+    ttl=PROBE_TTL
+)
+latency_prober.start()
 
-def get_server_ping_time(server, count=1, wait_sec=1):
-    """
+# Queries in flight and query latency of every node, measured on the queries this proxy sends
+load_tracker = LoadTracker(
+    list(HOSTS.keys()),
+    alpha=LOAD_ALPHA,
+    in_flight_weight=LOAD_IN_FLIGHT_WEIGHT,
+    latency_weight=LOAD_LATENCY_WEIGHT,
+    choices=LOAD_CHOICES,
+    ttl=LOAD_TTL
+)
+
+# Nodes that can't be reached are skipped until a background probe reaches them again
+circuit_breakers = CircuitBreakers(
+    list(HOSTS.keys()),
+    failure_threshold=BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=BREAKER_RESET_TIMEOUT
+)
 
-    :rtype: dict or None
+def probe_node(host_name: str):
+    """
+    @return: bool                       Whether a new connection to host_name could be opened and pinged
     """
-    cmd = "ping -c {} -W {} {}".format(count, wait_sec, server).split(' ')
     try:
-        output = subprocess.check_output(cmd).decode().strip()
-        lines = output.split("\n")
-        timing = lines[-1].split()[3].split('/')
-        print(timing)
-        return float(timing[1]) # avg
-    except Exception as e:
-        print(e)
-        return None
+        POOLS[host_name].ping()
+        return True
+    except mysql.connector.Error:
+        return False
 
-def get_best_ping_time_node(nodes_names: list[str]):
-    best_ping_time_node_name = nodes_names[0]
-    best_ping_time = 10000.0
+def start_circuit_prober(interval: float):
+    """
+    Start a daemon thread probing the nodes whose circuit is due for a probe.
+    """
+    def probe():
+        while True:
+            sleep(interval)
+            for host_name in circuit_breakers.due_for_probe():
+                circuit_breakers.probed(host_name, probe_node(host_name))
 
-    for i in range(len(nodes_names)):
-        node_name = nodes_names[i]
-        node = HOSTS[node_name]
-        ping_time = get_server_ping_time(node)
-        if ping_time < best_ping_time:
-            best_ping_time_node_name = node_name
-            best_ping_time = ping_time
+    thread = threading.Thread(target=probe, name="circuit-prober", daemon=True)
+    thread.start()
+    return thread
 
-    return best_ping_time_node_name, best_ping_time
+start_circuit_prober(max(BREAKER_RESET_TIMEOUT / 4, 0.5))
+
+# Results of reads, invalidated by the writes going through this proxy
+result_cache = ResultCache(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, max_rows=CACHE_MAX_ROWS) if CACHE_ENABLED else None
+
+# Runs the reads of a batch, and the parts of a scatter query, in parallel
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix="batch")
+
+# Runs the attempts of hedged reads, and the kills of the losing ones
+hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="hedge")
+
+# Transactions spanning several requests, each one pinned to a pooled connection
+session_manager = SessionManager(idle_timeout=SESSION_IDLE_TIMEOUT, max_sessions=SESSION_MAX)
+
+def start_session_reaper(interval: float):
+    """
+    Start a daemon thread periodically rolling back the expired sessions and releasing their connection.
+    """
+    def reap():
+        while True:
+            sleep(interval)
+            for session in session_manager.expired():
+                # The pool rolls the transaction back
+                POOLS[session.host_name].release(session.cnx)
+
+    thread = threading.Thread(target=reap, name="session-reaper", daemon=True)
+    thread.start()
+    return thread
+
+start_session_reaper(max(SESSION_IDLE_TIMEOUT / 4, 1.0))
+
+metrics.counter("node_queries_total", "Statements executed, by node and outcome", ("node", "outcome"))
+metrics.histogram("node_query_duration_seconds", "Statement execution time, connection checkout included, by node", ("node",))
+metrics.counter("routed_reads_total", "Reads routed to a node, by routing method and node", ("method_id", "node"))
+metrics.counter("hedged_reads_total", "Reads sent to a second node, by attempt answering first: primary or hedge", ("winner",))
+metrics.counter("failovers_total", "Reads executed on the manager because their node was unavailable, by node", ("node",))
+metrics.callback(
+    "circuit_state", "Circuit breaker state, by node: 0 closed, 1 half open, 2 open", ("node",),
+    lambda: { (host_name,): STATE_VALUES[circuit["state"]] for host_name, circuit in circuit_breakers.table().items() }
+)
+metrics.callback(
+    "circuit_trips_total", "Times the circuit breaker opened, by node", ("node",),
+    lambda: { (host_name,): circuit["trips"] for host_name, circuit in circuit_breakers.table().items() },
+    kind="counter"
+)
+metrics.callback(
+    "pool_connections", "Open connections, by node and state", ("node", "state"),
+    lambda: {
+        (host_name, state): stats[state]
+        for host_name, stats in ((host_name, pool.stats()) for host_name, pool in POOLS.items())
+        for state in ("idle", "in_use")
+    }
+)
+for counter in ("checkouts", "waits", "timeouts"):
+    metrics.callback(
+        f"pool_{counter}_total", f"Connection pool {counter}, by node", ("node",),
+        lambda counter=counter: { (host_name,): pool.stats()[counter] for host_name, pool in POOLS.items() },
+        kind="counter"
+    )
+metrics.callback(
+    "sessions_open", "Open transaction sessions, by node", ("node",),
+    lambda: { (host_name,): count for host_name, count in session_manager.stats()["by_node"].items() }
+)
+metrics.callback(
+    "node_in_flight", "Statements in flight, by node", ("node",),
+    lambda: { (host_name,): load["in_flight"] for host_name, load in load_tracker.table().items() }
+)
+if result_cache is not None:
+    for counter in ("hits", "misses", "evictions", "invalidations"):
+        metrics.callback(
+            f"cache_{counter}_total", f"Result cache {counter}", (),
+            lambda counter=counter: { (): result_cache.stats()[counter] },
+            kind="counter"
+        )
+    metrics.callback("cache_hit_ratio", "Result cache hit ratio since start", (), lambda: { (): result_cache.stats()["hit_ratio"] })
+    metrics.callback("cache_entries", "Results in the cache", (), lambda: { (): result_cache.stats()["entries"] })
+for counter in ("hits", "misses", "evictions"):
+    metrics.callback(
+        f"prepared_statements_{counter}_total", f"Prepared statement cache {counter}", (),
+        lambda counter=counter: { (): statement_cache_stats()[counter] },
+        kind="counter"
+    )
+
+
+def end_query(host_name: str, started: float, failed: bool, record: bool = True, unreachable: bool = False):
+    """
+    Account for a statement started with load_tracker.begin.
+
+    @param host_name: str               Node the statement was executed on
+    @param started: float               Value returned by load_tracker.begin
+    @param failed: bool                 Whether the statement failed
+    @param record: bool                 Whether its duration is a latency sample
+    @param unreachable: bool            Whether it failed because the node couldn't be reached
+    """
+    load_tracker.end(host_name, started, record)
+    circuit_breakers.record(host_name, unreachable)
+    metrics.inc("node_queries_total", host_name, "error" if failed else "ok")
+    if record:
+        metrics.observe("node_query_duration_seconds", monotonic() - started, host_name)
 
-def query_db(host: str, host_name:str, query: str):
-    cnx = mysql.connector.connect(user=USER, password=PASSWORD, host=host, database=DATABASE)
-    cursor = cnx.cursor()
 
+def run_statement(cnx, query: str, params: list = None):
+    """
+    Execute a statement on a connection. With params, the statement is prepared on the server once
+    per connection and reused by the following executions.
+
+    @param cnx: MySQLConnection         Checked out connection
+    @param query: str                   SQL statement, with %s or ? placeholders when params are given
+    @param params: list                 Values of the placeholders, None to execute query as is
+
+    @return: list                       Rows of the result
+    """
+    if params is not None:
+        with stage("execute"):
+            cursor = get_statement_cache(cnx, PREPARED_CACHE_SIZE).execute(query, params)
+        # The cursor stays open, it holds the prepared statement
+        with stage("fetch"):
+            return cursor.fetchall() if cursor.with_rows else []
+
+    cursor = cnx.cursor()
     try:
-        cursor.execute(query)
-        result = cursor.fetchall()
+        with stage("execute"):
+            cursor.execute(query)
+        with stage("fetch"):
+            return cursor.fetchall() if cursor.with_rows else []
+    finally:
         cursor.close()
-        cnx.close()
+
+def node_unavailable(host_name: str):
+    return { "node": f"{host_name}", "result": [f"Node {host_name} is unavailable, try again later"], "error": True }
+
+def not_executed():
+    return { "node": "manager", "result": ["Not executed, an earlier write of the batch failed"], "error": True }
+
+def fail_over(host_name: str):
+    """
+    Account for a read executed on the manager because host_name is unavailable.
+
+    @return: dict                       Fields to add to the response
+    """
+    tag("failover_from", host_name)
+    metrics.inc("failovers_total", host_name)
+    return { "failover_from": host_name }
+
+def query_db(host_name: str, query: str, params: list = None, failover: bool = False, attempt: Attempt = None):
+    """
+    Execute a statement on a node.
+
+    @param host_name: str               Node to query
+    @param query: str                   SQL statement
+    @param params: list                 Values of the placeholders of query, if any
+    @param failover: bool               Execute the statement on the manager if the node is unavailable
+                                        or can't be reached, for reads
+    @param attempt: Attempt             Hedged attempt the statement is executed for, it can be cancelled
+
+    @return: dict                       Response
+    """
+    failover = failover and host_name != "manager"
+    if not circuit_breakers.allow(host_name):
+        if failover:
+            return query_db("manager", query, params) | fail_over(host_name)
+        return node_unavailable(host_name)
+
+    started = load_tracker.begin(host_name)
+    failed = True
+    unreachable = False
+    try:
+        if attempt is not None and attempt.cancelled:
+            # No connection is checked out for an attempt that already lost
+            raise AttemptCancelled(host_name)
+        checkout_start = perf_counter()
+        # A cancelled attempt didn't use its connection, it goes back to the pool
+        with POOLS[host_name].connection(keep_on=(AttemptCancelled,)) as cnx:
+            add_stage("checkout", checkout_start)
+            try:
+                with attempt.running(cnx.connection_id) if attempt is not None else nullcontext():
+                    result = run_statement(cnx, query, params)
+            except mysql.connector.Error as err:
+                # The statement of the losing attempt was killed, its connection is still usable
+                if attempt is not None and attempt.cancelled and err.errno == errorcode.ER_QUERY_INTERRUPTED:
+                    raise AttemptCancelled(host_name) from err
+                raise
+        failed = False
         return { "node": f"{host_name}", "result": result }
+    except AttemptCancelled as err:
+        return { "node": f"{host_name}", "result": [str(err)], "error": True }
+    except CONNECTION_ERRORS as err:
+        # The query of a cancelled attempt was killed, that says nothing about the node
+        unreachable = attempt is None or not attempt.cancelled
+        response = { "node": f"{host_name}", "result": [f"Failed executing query: {err}"], "error": True }
+    except (mysql.connector.Error, PoolExhaustedError) as err:
+        return { "node": f"{host_name}", "result": [f"Failed executing query: {err}"], "error": True }
+    finally:
+        end_query(host_name, started, failed, record=attempt is None or not attempt.cancelled, unreachable=unreachable)
+
+    # Reads don't change anything, the manager can execute them again
+    if failover and unreachable:
+        return query_db("manager", query, params) | fail_over(host_name)
+    return response
+
+def kill_query(host_name: str, connection_id: int, still_running):
+    """
+    Interrupt the statement running on a connection of host_name, its connection stays open.
+
+    @param still_running: function      Returns a context manager telling whether the statement still runs
+    """
+    try:
+        with POOLS[host_name].connection() as cnx:
+            cursor = cnx.cursor()
+            with still_running() as running:
+                if running:
+                    cursor.execute(f"KILL QUERY {int(connection_id)}")
+            cursor.close()
+    except (mysql.connector.Error, PoolExhaustedError) as err:
+        print(f"Couldn't kill query of connection {connection_id} on {host_name}: {err}")
+
+def hedge_node(host_name: str):
+    """
+    @return: str or None                Least loaded available data node other than host_name, None if there is none
+    """
+    candidates = [candidate for candidate in available_data_nodes() if candidate != host_name]
+    if len(candidates) == 0:
+        return None
+    return load_tracker.choose(candidates)[0]
+
+def hedged_query_db(host_name: str, query: str, params: list = None):
+    """
+    Execute a read on a data node, and on a second one too if the first hasn't answered within the
+    HEDGE_PERCENTILE latency of its recent reads. The slowest is killed. An attempt on a node that
+    is unavailable or can't be reached fails over to the manager, as unhedged reads do.
+
+    @param host_name: str               Data node chosen for the read
+    @param query: str                   SQL statement
+    @param params: list                 Values of the placeholders of query, if any
+
+    @return: dict                       Response, with hedged_to if the read was sent to a second node
+    """
+    percentile = load_tracker.percentile(host_name, HEDGE_PERCENTILE)
+    delay = HEDGE_MAX_DELAY if percentile is None else min(max(percentile / 1000, HEDGE_MIN_DELAY), HEDGE_MAX_DELAY)
+    response, hedge_host_name = hedged_read(
+        hedge_executor,
+        lambda attempt: query_db(attempt.host_name, query, params, failover=True, attempt=attempt),
+        host_name,
+        lambda: hedge_node(host_name),
+        delay,
+        kill_query
+    )
+    if hedge_host_name is None:
+        return response
+
+    metrics.inc("hedged_reads_total", "hedge" if response["node"] == hedge_host_name else "primary")
+    tag("hedged_to", hedge_host_name)
+    return response | { "hedged_to": hedge_host_name }
+
+def stream_query_db(host_name: str, query: str, params: list, extra: dict):
+    """
+    Execute a query with an unbuffered cursor and stream its result as NDJSON. The first line holds
+    the node (and extra), each following line a {"rows": [...]} chunk of at most STREAM_FETCH_SIZE
+    rows, and the last line {"done": true, "row_count": n} or {"error": "..."}.
+    The connection stays checked out until the whole result has been sent.
+
+    @param host_name: str               Node to query
+    @param query: str                   SQL statement
+    @param params: list                 Values of the placeholders of query, if any
+    @param extra: dict                  Fields to add to the first line
+
+    @return: flask.Response             Error response if the query couldn't be executed, NDJSON lines otherwise
+    """
+    if not circuit_breakers.allow(host_name):
+        if host_name == "manager" or not circuit_breakers.allow("manager"):
+            return respond(node_unavailable(host_name) | extra)
+        extra = extra | fail_over(host_name)
+        host_name = "manager"
+
+    pool = POOLS[host_name]
+    # In flight until the whole result is sent, the duration depends on the client so it isn't recorded
+    started = load_tracker.begin(host_name)
+    try:
+        with stage("checkout"):
+            cnx = pool.acquire()
+    except (mysql.connector.Error, PoolExhaustedError) as err:
+        end_query(host_name, started, True, unreachable=isinstance(err, CONNECTION_ERRORS))
+        return respond({ "node": f"{host_name}", "result": [f"Failed executing query: {err}"], "error": True } | extra)
+
+    # Prepared cursors don't buffer, this one is closed with the stream rather than cached
+    cursor = cnx.cursor(buffered=False) if params is None else cnx.cursor(prepared=True)
+    try:
+        with stage("execute"):
+            cursor.execute(query, params)
     except mysql.connector.Error as err:
         cursor.close()
-        cnx.close()
-        return { "node": f"{host_name}", "result": [f"Failed executing query: {err}"] }
-
-def direct_hit(query):
-    return query_db(HOSTS["manager"], "manager", query)
-
-def random_hit(query):
-    data_node_host_name = random.choice(list(HOSTS.keys()).remove("manager"))
-    print(f"Chosen data node: {data_node_host_name}")
-    return query_db(HOSTS[data_node_host_name], data_node_host_name, query)
-
-def custom_hit(query):
-    data_node_host_name, ping_time = get_best_ping_time_node(list(HOSTS.keys()).remove("manager"))
-    print(f"Chosen data node: {data_node_host_name}")
-    response = query_db(HOSTS[data_node_host_name], data_node_host_name, query)
-    response['ping_time'] = ping_time
+        pool.release(cnx)
+        end_query(host_name, started, True, unreachable=isinstance(err, CONNECTION_ERRORS))
+        return respond({ "node": f"{host_name}", "result": [f"Failed executing query: {err}"], "error": True } | extra)
+
+    header = { "node": f"{host_name}" } | extra
+    trace = current_trace()
+    if trace is not None and trace.timings:
+        header |= { "trace_id": trace.trace_id, "timings": trace.stages_ms() }
+
+    if accepted() == MSGPACK:
+        encode, media_type = pack, MSGPACK_STREAM
+    else:
+        encode, media_type = (lambda content: app.json.dumps(content) + "\n"), NDJSON
+
+    def generate():
+        consumed = False
+        failed = True
+        unreachable = False
+        try:
+            yield encode(header)
+            row_count = 0
+            while cursor.with_rows:
+                rows = cursor.fetchmany(STREAM_FETCH_SIZE)
+                if len(rows) == 0:
+                    break
+                row_count += len(rows)
+                yield encode({ "rows": rows })
+            consumed = True
+            failed = False
+            yield encode({ "done": True, "row_count": row_count })
+        except mysql.connector.Error as err:
+            consumed = True
+            unreachable = isinstance(err, CONNECTION_ERRORS)
+            yield encode({ "error": f"Failed executing query: {err}" })
+        finally:
+            # Draining the rest of an abandoned result could take long, the connection is dropped instead
+            try:
+                cursor.close()
+            except mysql.connector.Error:
+                consumed = False
+            pool.release(cnx, discard=not consumed)
+            end_query(host_name, started, failed, record=False, unreachable=unreachable)
+
+    return Response(generate(), content_type=media_type)
+
+def direct_hit():
+    return "manager", {}
+
+def available_data_nodes():
+    """
+    @return: list[str]                  Data nodes whose circuit lets statements through
+    """
+    return [host_name for host_name in DATA_NODES if circuit_breakers.is_available(host_name)]
+
+# When no data node is available, the reads go to the manager
+
+def random_hit():
+    candidates = available_data_nodes()
+    if len(candidates) == 0:
+        return direct_hit()
+    data_node_host_name = random.choice(candidates)
+    return data_node_host_name, {}
+
+def custom_hit():
+    data_node_host_name, ping_time = latency_prober.best_node()
+    if data_node_host_name is None or not circuit_breakers.is_available(data_node_host_name):
+        # No fresh measure, don't wait for one, or the fastest node is unavailable
+        candidates = available_data_nodes()
+        if len(candidates) == 0:
+            return "manager", { "ping_time": None }
+        data_node_host_name, ping_time = random.choice(candidates), None
+    return data_node_host_name, { "ping_time": ping_time }
+
+def least_loaded_hit():
+    available = available_data_nodes()
+    if len(available) == 0:
+        return "manager", { "load": None }
+    # Nodes the prober can't reach aren't considered, unless none can be reached
+    candidates = [host_name for host_name in available if not latency_prober.is_down(host_name)] or available
+    data_node_host_name, load = load_tracker.choose(candidates)
+    return data_node_host_name, { "load": load }
+
+def choose_node(method_id):
+    """
+    Choose the node executing a read query.
+
+    @param method_id: int               DIRECT_HIT, RANDOM_HIT, CUSTOM_HIT or LEAST_LOADED_HIT, DIRECT_HIT otherwise
+
+    @return: str, dict                  Name of the node, fields to add to the response
+    """
+    with stage("route"):
+        if method_id == RANDOM_HIT:
+            host_name, extra = random_hit()
+        elif method_id == CUSTOM_HIT:
+            host_name, extra = custom_hit()
+        elif method_id == LEAST_LOADED_HIT:
+            host_name, extra = least_loaded_hit()
+        else:
+            host_name, extra = direct_hit()
+    tag("node", host_name)
+    metrics.inc("routed_reads_total", method_label(None if method_id is None else str(method_id)), host_name)
+    return host_name, extra
+
+
+def execute_read(query: str, method_id, params: list = None, hedge: bool = False):
+    """
+    Execute a read query on the node chosen by the method method_id, or serve it from the cache.
+
+    @param query: str                   SQL statement
+    @param method_id: int               DIRECT_HIT, RANDOM_HIT, CUSTOM_HIT or LEAST_LOADED_HIT, DIRECT_HIT otherwise
+    @param params: list                 Values of the placeholders of query, if any
+    @param hedge: bool                  Whether a read routed to a data node is hedged
+
+    @return: dict                       Response
+    """
+    ticket = None
+    if result_cache is not None:
+        with stage("cache"):
+            cached, ticket = result_cache.get(query, params)
+        if cached is not None:
+            return cached | { "cached": True }
+
+    host_name, extra = choose_node(method_id)
+    if hedge and host_name != "manager":
+        response = hedged_query_db(host_name, query, params) | extra
+    else:
+        response = query_db(host_name, query, params, failover=True) | extra
+
+    if ticket is not None and not response.get("error"):
+        result_cache.put(ticket, response)
+    return response
+
+def merge_scatter(scatter: ScatterQuery, sub_queries: list, responses: "list[dict]"):
+    """
+    @return: dict                       Response of a scatter query, from the responses of its parts
+    """
+    parts = [
+        { "node": response["node"], "range": list(bounds), "rows": None if response.get("error") else len(response["result"]) }
+        for response, (_, bounds) in zip(responses, sub_queries)
+    ]
+    nodes = sorted(set(part["node"] for part in parts))
+    tag("node", ",".join(nodes))
+    errors = [message for response in responses if response.get("error") for message in response["result"]]
+    if len(errors) > 0:
+        return { "nodes": nodes, "result": errors, "error": True, "parts": parts }
+    try:
+        with stage("merge"):
+            result = scatter.merge([response["result"] for response in responses])
+    except (ValueError, TypeError, IndexError) as err:
+        return { "nodes": nodes, "result": [f"Failed merging results: {err}"], "error": True, "parts": parts }
+    return { "nodes": nodes, "result": result, "parts": parts }
+
+def scatter_query_db(scatter: ScatterQuery):
+    """
+    Execute the parts of a scatter query in parallel, spread over the available data nodes, and
+    merge their results.
+
+    @param scatter: ScatterQuery        Query to execute
+
+    @return: dict                       Response, with the node, range and row count of every part
+    """
+    nodes = available_data_nodes() or ["manager"]
+    offset = random.randrange(len(nodes))
+    sub_queries = scatter.sub_queries()
+    hosts = [nodes[(offset + i) % len(nodes)] for i in range(len(sub_queries))]
+    # Each part runs in a copy of the request context, so it adds its stages to the trace
+    futures = [
+        batch_executor.submit(copy_context().run, query_db, host_name, query, scatter.params, True)
+        for host_name, (query, _) in zip(hosts, sub_queries)
+    ]
+    responses = [future.result() for future in futures]
+    return merge_scatter(scatter, sub_queries, responses)
+
+def execute_write(query: str, params: list = None):
+    """
+    Execute a write query on the manager and invalidate the cached results it affects.
+
+    @param query: str                   SQL statement
+    @param params: list                 Values of the placeholders of query, if any
+
+    @return: dict                       Response
+    """
+    response = query_db("manager", query, params)
+    if result_cache is not None:
+        result_cache.invalidate(query)
+    return response
+
+def execute_write_transaction(queries: "list[str]", params: "list[list]" = None):
+    """
+    Execute write queries in a single transaction on the manager. If one of them fails, the
+    transaction is rolled back and the following ones aren't executed.
+
+    @param queries: list[str]           SQL statements
+    @param params: list[list]           Values of the placeholders of each statement, None for none
+
+    @return: list[dict]                 One response per statement
+    """
+    if params is None:
+        params = [None] * len(queries)
+    if not circuit_breakers.allow("manager"):
+        return [node_unavailable("manager") for _ in queries]
+
+    responses = []
+    started = load_tracker.begin("manager")
+    failed = True
+    unreachable = False
+    try:
+        checkout_start = perf_counter()
+        with POOLS["manager"].connection() as cnx:
+            add_stage("checkout", checkout_start)
+            cnx.start_transaction()
+            for query, query_params in zip(queries, params):
+                try:
+                    result = run_statement(cnx, query, query_params)
+                except mysql.connector.Error as err:
+                    cnx.rollback()
+                    responses.append({ "node": "manager", "result": [f"Failed executing query: {err}"], "error": True })
+                    break
+                responses.append({ "node": "manager", "result": result })
+            else:
+                cnx.commit()
+                failed = False
+    except (mysql.connector.Error, PoolExhaustedError) as err:
+        unreachable = isinstance(err, CONNECTION_ERRORS)
+        responses = [{ "node": "manager", "result": [f"Failed executing transaction: {err}"], "error": True }]
+    finally:
+        end_query("manager", started, failed, unreachable=unreachable)
+
+    if result_cache is not None:
+        for query in queries:
+            result_cache.invalidate(query)
+
+    # Statements after a failure weren't executed
+    failed = len(responses) < len(queries) or responses[-1].get("error", False)
+    if failed:
+        for response in responses:
+            response["error"] = True
+    responses.extend(
+        { "node": "manager", "result": ["Not executed, transaction rolled back"], "error": True }
+        for _ in range(len(queries) - len(responses))
+    )
+    return responses
+
+
+def respond(content: dict):
+    """
+    Serialise a response in the negotiated encoding, adding the trace id and the stage timings if
+    the client asked for them.
+
+    @param content: dict                Response
+
+    @return: flask.Response             JSON or MessagePack response
+    """
+    trace = current_trace()
+    if trace is not None and trace.timings:
+        content = content | { "trace_id": trace.trace_id, "timings": trace.stages_ms() }
+    with stage("serialise"):
+        if accepted() == MSGPACK:
+            return Response(pack(content), content_type=MSGPACK)
+        return app.json.response(content)
+
+
+def check_out_session(token: str):
+    """
+    @return: Session                    Session of token, the request is aborted if it is unknown or busy
+    """
+    try:
+        return session_manager.check_out(token)
+    except SessionNotFoundError as err:
+        abort(404, str(err))
+    except SessionBusyError as err:
+        abort(409, str(err))
+
+def end_session(session, discard: bool = False):
+    session_manager.close(session)
+    POOLS[session.host_name].release(session.cnx, discard=discard)
+
+def begin_session(host_name: str, read_only: bool):
+    """
+    Check a connection out and start a transaction on it, pinned to a new session.
+
+    @param host_name: str               Node of the session
+    @param read_only: bool              Whether the transaction is read only
+
+    @return: dict                       Response, with the session token
+    """
+    if not circuit_breakers.allow(host_name):
+        return node_unavailable(host_name)
+
+    pool = POOLS[host_name]
+    try:
+        with stage("checkout"):
+            cnx = pool.acquire()
+    except (mysql.connector.Error, PoolExhaustedError) as err:
+        circuit_breakers.record(host_name, isinstance(err, CONNECTION_ERRORS))
+        return { "node": f"{host_name}", "result": [f"Failed opening session: {err}"], "error": True }
+
+    try:
+        cnx.start_transaction(readonly=read_only)
+        session = session_manager.open(host_name, cnx)
+    except (mysql.connector.Error, SessionLimitError) as err:
+        circuit_breakers.record(host_name, isinstance(err, CONNECTION_ERRORS))
+        pool.release(cnx)
+        return { "node": f"{host_name}", "result": [f"Failed opening session: {err}"], "error": True }
+    circuit_breakers.record(host_name, False)
+    return { "node": f"{host_name}", "session": session.token }
+
+def execute_in_session(session, query: str, params: list = None):
+    """
+    Execute a statement in the transaction of a checked out session. If the connection breaks, the
+    session is closed.
+
+    @param session: Session             Session checked out with check_out_session
+    @param query: str                   SQL statement
+    @param params: list                 Values of the placeholders of query, if any
+
+    @return: dict                       Response
+    """
+    started = load_tracker.begin(session.host_name)
+    failed = True
+    unreachable = False
+    try:
+        result = run_statement(session.cnx, query, params)
+        failed = False
+        if classify_statement(query) == "write":
+            session.writes.append(query)
+        response = { "node": session.host_name, "result": result }
+    except QUERY_ERRORS as err:
+        response = { "node": session.host_name, "result": [f"Failed executing query: {err}"], "error": True }
+    except mysql.connector.Error as err:
+        unreachable = isinstance(err, CONNECTION_ERRORS)
+        end_session(session, discard=True)
+        return { "node": session.host_name, "result": [f"Failed executing query: {err}"], "error": True, "session_closed": True }
+    finally:
+        end_query(session.host_name, started, failed, unreachable=unreachable)
+
+    session_manager.check_in(session)
     return response
 
+def finish_session(session, commit: bool):
+    """
+    Commit or roll back the transaction of a checked out session and close it.
+
+    @param session: Session             Session checked out with check_out_session
+    @param commit: bool                 Commit if True, roll back otherwise
+
+    @return: dict                       Response
+    """
+    try:
+        if commit:
+            session.cnx.commit()
+        else:
+            session.cnx.rollback()
+    except mysql.connector.Error as err:
+        end_session(session, discard=True)
+        action = "committing" if commit else "rolling back"
+        return { "node": session.host_name, "result": [f"Failed {action} transaction: {err}"], "error": True, "session_closed": True }
+
+    end_session(session)
+    if commit and result_cache is not None:
+        for query in session.writes:
+            result_cache.invalidate(query)
+    return { "node": session.host_name, "result": [] }
+
 
 @app.route('/')
 def health_check():
     return "Healthy proxy!"
 
+@app.route('/pool-stats')
+def pool_stats():
+    return { host_name: pool.stats() for host_name, pool in POOLS.items() }
+
+@app.route('/latency')
+def latency():
+    return latency_prober.table()
+
+@app.route('/load')
+def load():
+    return load_tracker.table()
+
+@app.route('/circuits')
+def circuits():
+    return circuit_breakers.table()
+
+@app.route('/cache-stats')
+def cache_stats():
+    return result_cache.stats() if result_cache is not None else { "enabled": False }
+
+@app.route('/statement-cache-stats')
+def statement_stats():
+    return statement_cache_stats()
+
+@app.route('/session-stats')
+def session_stats():
+    return session_manager.stats()
+
 @app.route('/write-query', methods=['POST'])
 def execute_write_query():
-    query = request.get_json()['query']
-    return direct_hit(query)
+    body = request.get_json()
+    return respond(execute_write(body['query'], statement_params(body)))
 
 @app.route('/read-query', methods=['POST'])
 def execute_read_query():
@@ -93,18 +818,86 @@ def execute_read_query():
     if method_id != None and method_id.isdigit():
         method_id = int(method_id)
 
-    query = request.get_json()['query']
-    
-    match method_id:
-        case 0:
-            return direct_hit(query)
-        case 1:
-            return random_hit(query)
-        case 2:
-            return custom_hit(query)
-        case _:
-            return direct_hit(query)
+    body = request.get_json()
+    query, params = body['query'], statement_params(body)
+
+    # Large results are streamed, they bypass the cache
+    if request.args.get('stream') == '1':
+        host_name, extra = choose_node(method_id)
+        return stream_query_db(host_name, query, params, extra)
+
+    hedge = request.args.get('hedge', '1' if HEDGE_READS else '0') == '1'
+    return respond(execute_read(query, method_id, params, hedge))
+
+@app.route('/scatter-query', methods=['POST'])
+def execute_scatter_query():
+    try:
+        scatter = parse_scatter_query(request.get_json(), SCATTER_MAX_PARTS)
+    except ValueError as err:
+        abort(400, str(err))
+    return respond(scatter_query_db(scatter))
+
+@app.route('/session/begin', methods=['POST'])
+def execute_begin_session():
+    # Transactions go to the manager, read only ones can be routed to a data node
+    read_only = request.args.get('read_only') == '1'
+    host_name = "manager"
+    if read_only:
+        method_id = request.args.get('method_id')
+        if method_id != None and method_id.isdigit():
+            method_id = int(method_id)
+        host_name, _ = choose_node(method_id)
+    return respond(begin_session(host_name, read_only))
+
+@app.route('/session/<token>/query', methods=['POST'])
+def execute_session_query(token):
+    body = request.get_json()
+    session = check_out_session(token)
+    return respond(execute_in_session(session, body['query'], statement_params(body)))
+
+@app.route('/session/<token>/commit', methods=['POST'])
+def execute_commit(token):
+    return respond(finish_session(check_out_session(token), commit=True))
+
+@app.route('/session/<token>/rollback', methods=['POST'])
+def execute_rollback(token):
+    return respond(finish_session(check_out_session(token), commit=False))
+
+@app.route('/batch', methods=['POST'])
+def execute_batch():
+    statements = request.get_json()['statements']
+    if len(statements) > BATCH_MAX_SIZE:
+        abort(400, f"A batch can't contain more than {BATCH_MAX_SIZE} statements")
+
+    results = [None] * len(statements)
+    # Statements run in the order they were sent, each run of consecutive writes in one transaction
+    # and each run of consecutive reads concurrently. A failed write stops the batch
+    for is_write, group in groupby(range(len(statements)), key=lambda i: statements[i].get('type') == 'write'):
+        group = list(group)
+        if is_write:
+            writes_results = execute_write_transaction(
+                [statements[i]['query'] for i in group], [statement_params(statements[i]) for i in group]
+            )
+            for i, result in zip(group, writes_results):
+                results[i] = result
+            if any(result.get("error") for result in writes_results):
+                break
+            continue
+
+        # Each read runs in a copy of the request context, so it adds its stages to the trace
+        futures = [
+            (i, batch_executor.submit(
+                copy_context().run,
+                execute_read, statements[i]['query'], statements[i].get('method_id', DIRECT_HIT), statement_params(statements[i])
+            ))
+            for i in group
+        ]
+        for i, future in futures:
+            results[i] = future.result()
+
+    results = [result if result is not None else not_executed() for result in results]
+    return respond({ "results": results })
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=PORT)
\ No newline at end of file
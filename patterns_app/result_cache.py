@@ -0,0 +1,158 @@
+import json
+import re
+import threading
+from collections import OrderedDict
+from time import monotonic
+from sql_parsing import normalize_query, referenced_tables
+
+# Reads whose result can change without any write
+UNCACHEABLE_RE = re.compile(
+    r"\b(?:RAND|NOW|CURDATE|CURTIME|CURRENT_DATE|CURRENT_TIME|CURRENT_TIMESTAMP|SYSDATE|UNIX_TIMESTAMP|UUID|"
+    r"LAST_INSERT_ID|FOUND_ROWS|CONNECTION_ID|SLEEP|GET_LOCK)\b|\bFOR\s+UPDATE\b|\bLOCK\s+IN\b|@",
+    re.IGNORECASE
+)
+
+
+class ResultCache:
+    """
+    LRU cache of read query results with a time to live.
+
+    Entries are indexed by the tables they read so a write only invalidates the results of the
+    tables it touches. Every table has a version, incremented on invalidation, so that a read
+    started before a write can't store its (possibly stale) result after the write completed.
+    """
+
+    def __init__(self, ttl: float = 30.0, max_entries: int = 1024, max_rows: int = 10000):
+        """
+        @param ttl: float                   Seconds during which a result can be served from the cache
+        @param max_entries: int             Maximum number of cached results
+        @param max_rows: int                Results with more rows than this aren't cached
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+
+        # normalized query (and params) -> (response, tables, expiration time)
+        self._entries = OrderedDict()
+        # table -> normalized queries of the entries reading it
+        self._by_table = {}
+        # table -> version
+        self._versions = {}
+        # Incremented when the whole cache is invalidated
+        self._generation = 0
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    def _remove(self, key: str):
+        _, tables, _ = self._entries.pop(key)
+        for table in tables:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+
+    def get(self, query: str, params: list = None):
+        """
+        Look a read query up.
+
+        @param query: str                   SQL statement
+        @param params: list                 Values of the placeholders of query, if any
+
+        @return: dict or None, tuple or None    Cached response or None, and a ticket to pass to put
+                                                on a miss (None if the query can't be cached)
+        """
+        if UNCACHEABLE_RE.search(query):
+            return None, None
+
+        normalized = normalize_query(query)
+        if not normalized[:6].upper() == "SELECT":
+            return None, None
+        key = normalized if params is None else normalized + " " + json.dumps(params)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[2] > monotonic():
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return entry[0], None
+                self._remove(key)
+                self._expirations += 1
+
+            self._misses += 1
+            tables = referenced_tables(normalized)
+            versions = tuple(self._versions.get(table, 0) for table in tables)
+            return None, (key, tables, versions, self._generation)
+
+    def put(self, ticket: tuple, response: dict):
+        """
+        Store the response of a read query, unless a table it reads was written in the meantime.
+
+        @param ticket: tuple                Ticket returned by get
+        @param response: dict               Response to cache
+        """
+        if ticket is None or len(response["result"]) > self.max_rows:
+            return
+
+        key, tables, versions, generation = ticket
+        with self._lock:
+            if generation != self._generation:
+                return
+            if versions != tuple(self._versions.get(table, 0) for table in tables):
+                return
+
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (response, tables, monotonic() + self.ttl)
+            for table in tables:
+                self._by_table.setdefault(table, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def invalidate(self, query: str):
+        """
+        Drop the cached results of the tables a write query touches. If none can be found in the
+        query, the whole cache is dropped.
+
+        @param query: str                   SQL statement that was executed
+        """
+        tables = referenced_tables(query)
+        with self._lock:
+            if not tables:
+                self._invalidations += len(self._entries)
+                self._entries.clear()
+                self._by_table.clear()
+                self._generation += 1
+                return
+
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+                for key in list(self._by_table.get(table, ())):
+                    self._remove(key)
+                    self._invalidations += 1
+
+    def stats(self):
+        """
+        @return: dict                       Size and counters of the cache
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": self._hits / lookups if lookups > 0 else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "invalidations": self._invalidations
+            }
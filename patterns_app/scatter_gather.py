@@ -0,0 +1,177 @@
+import heapq
+import itertools
+import re
+from sql_parsing import classify_statement, statement_params
+
+# Replaced in the query by the range predicate of each part
+RANGE_MARKER = "{range}"
+COLUMN_RE = re.compile(r"^[A-Za-z_]\w*(\.[A-Za-z_]\w*)?$")
+# Functions combining the values of a result column across the parts, "group" marks a GROUP BY column
+AGGREGATES = ("group", "sum", "count", "min", "max")
+
+
+class ScatterQuery:
+    """
+    Read split on an integer column into ranges executed in parallel. The results of the parts are
+    concatenated, merged on order_by if given, or combined with aggregates if given.
+    """
+
+    def __init__(
+        self,
+        query: str,
+        params: list,
+        column: str,
+        low: int,
+        high: int,
+        parts: int,
+        order_by: "list[tuple[int, bool]]" = None,
+        aggregates: "list[str]" = None,
+        limit: int = None
+    ):
+        """
+        @param query: str                   SELECT statement containing RANGE_MARKER in its WHERE clause
+        @param params: list                 Values of the other placeholders of query, if any
+        @param column: str                  Integer column the ranges are on, usually the primary key
+        @param low: int                     Lowest value of column
+        @param high: int                    Highest value of column
+        @param parts: int                   Number of ranges
+        @param order_by: list[tuple[int, bool]]
+                                            (index of a result column, descending) the parts are sorted on
+        @param aggregates: list[str]        One of AGGREGATES per result column
+        @param limit: int                   Maximum number of rows of the merged result
+        """
+        self.query = query
+        self.params = params
+        self.column = column
+        self.low = low
+        self.high = high
+        self.parts = parts
+        self.order_by = order_by or []
+        self.aggregates = aggregates
+        self.limit = limit
+
+    def ranges(self):
+        """
+        @return: list[tuple[int, int]]      Inclusive bounds of the parts, at most one per value of column
+        """
+        parts = max(min(self.parts, self.high - self.low + 1), 1)
+        size, remainder = divmod(self.high - self.low + 1, parts)
+        ranges = []
+        low = self.low
+        for i in range(parts):
+            high = low + size - 1 + (1 if i < remainder else 0)
+            ranges.append((low, high))
+            low = high + 1
+        return ranges
+
+    def sub_queries(self):
+        """
+        @return: list[tuple[str, tuple[int, int]]]
+                                            Statement of every part and its range
+        """
+        return [
+            (self.query.replace(RANGE_MARKER, f"({self.column} BETWEEN {low} AND {high})"), (low, high))
+            for low, high in self.ranges()
+        ]
+
+    def merge(self, results: "list[list]"):
+        """
+        @param results: list[list]          Rows of every part, in the order of ranges
+
+        @return: list                       Rows of the whole query
+        """
+        if self.aggregates is not None:
+            rows = _sort(_combine(results, self.aggregates), self.order_by)
+        elif len(self.order_by) == 0:
+            rows = itertools.chain.from_iterable(results)
+        elif len(set(descending for _, descending in self.order_by)) == 1:
+            # Every part is sorted the same way, they are merged lazily
+            rows = heapq.merge(*results, key=_row_key(self.order_by), reverse=self.order_by[0][1])
+        else:
+            rows = _sort(itertools.chain.from_iterable(results), self.order_by)
+        return list(itertools.islice(rows, self.limit))
+
+
+def parse_scatter_query(body, max_parts: int):
+    """
+    @param body: dict                       Request body, {"query", "column", "min", "max", "parts"} and optionally
+                                            "params", "order_by" as [[column index, "asc" or "desc"], ...],
+                                            "aggregates" and "limit"
+    @param max_parts: int                   Maximum number of parts
+
+    @return: ScatterQuery                   Query described by body, ValueError if body is invalid
+    """
+    if not isinstance(body, dict):
+        raise ValueError("Expected a JSON object")
+    query = body.get("query")
+    if not isinstance(query, str) or RANGE_MARKER not in query:
+        raise ValueError(f"Expected a query string with a {RANGE_MARKER} marker where the range predicate goes")
+    if classify_statement(query.replace(RANGE_MARKER, "TRUE")) != "read":
+        raise ValueError("Only reads can be scattered")
+    params = statement_params(body)
+    if params is not None and not isinstance(params, list):
+        raise ValueError("params must be a list")
+
+    column = body.get("column")
+    if not isinstance(column, str) or not COLUMN_RE.match(column):
+        raise ValueError("column must be the name of an integer column")
+    low, high, parts = body.get("min"), body.get("max"), body.get("parts", max_parts)
+    if not all(isinstance(value, int) and not isinstance(value, bool) for value in (low, high, parts)):
+        raise ValueError("min, max and parts must be integers")
+    if low > high or not 0 < parts <= max_parts:
+        raise ValueError(f"min must not exceed max, and parts must be between 1 and {max_parts}")
+
+    order_by = []
+    for item in body.get("order_by") or []:
+        if not (isinstance(item, list) and len(item) == 2 and isinstance(item[0], int) and item[1] in ("asc", "desc")):
+            raise ValueError('order_by must be a list of [column index, "asc" or "desc"]')
+        order_by.append((item[0], item[1] == "desc"))
+
+    aggregates = body.get("aggregates")
+    if aggregates is not None and not (isinstance(aggregates, list) and all(aggregate in AGGREGATES for aggregate in aggregates)):
+        raise ValueError(f"aggregates must be a list of {', '.join(AGGREGATES)}, one per result column")
+
+    limit = body.get("limit")
+    if limit is not None and not (isinstance(limit, int) and limit >= 0):
+        raise ValueError("limit must be a non negative integer")
+
+    return ScatterQuery(query, params, column, low, high, parts, order_by, aggregates, limit)
+
+
+def _value_key(value):
+    # MySQL sorts NULL first
+    return (0,) if value is None else (1, value)
+
+def _row_key(order_by: "list[tuple[int, bool]]"):
+    return lambda row: tuple(_value_key(row[index]) for index, _ in order_by)
+
+def _sort(rows, order_by: "list[tuple[int, bool]]"):
+    rows = list(rows)
+    # Stable sorts, from the last key to the first
+    for index, descending in reversed(order_by):
+        rows.sort(key=lambda row: _value_key(row[index]), reverse=descending)
+    return rows
+
+def _combine(results: "list[list]", aggregates: "list[str]"):
+    groups = {}
+    for row in itertools.chain.from_iterable(results):
+        if len(row) != len(aggregates):
+            raise ValueError(f"Expected {len(aggregates)} columns, one per aggregate, got {len(row)}")
+        key = tuple(value for value, aggregate in zip(row, aggregates) if aggregate == "group")
+        current = groups.get(key)
+        if current is None:
+            groups[key] = list(row)
+            continue
+        for i, (value, aggregate) in enumerate(zip(row, aggregates)):
+            # NULL is the aggregate of no value
+            if value is None or aggregate == "group":
+                continue
+            if current[i] is None:
+                current[i] = value
+            elif aggregate in ("sum", "count"):
+                current[i] += value
+            elif aggregate == "min":
+                current[i] = min(current[i], value)
+            else:
+                current[i] = max(current[i], value)
+    return groups.values()
@@ -0,0 +1,145 @@
+import secrets
+import threading
+from time import monotonic
+
+
+class SessionNotFoundError(Exception):
+    """
+    Raised when a session token is unknown, the session was closed or expired.
+    """
+
+
+class SessionBusyError(Exception):
+    """
+    Raised when a statement is sent to a session still executing the previous one.
+    """
+
+
+class SessionLimitError(Exception):
+    """
+    Raised when opening a session while max_sessions are already open.
+    """
+
+
+class Session:
+    """
+    Connection pinned to a client between the beginning and the end of a transaction.
+    """
+
+    def __init__(self, token: str, host_name: str, cnx):
+        """
+        @param token: str                   Identifier given to the client
+        @param host_name: str               Node of the connection
+        @param cnx: connection              Connection checked out for the session
+        """
+        self.token = token
+        self.host_name = host_name
+        self.cnx = cnx
+        self.last_used = monotonic()
+        self.busy = False
+        # Write statements executed, their cached results are invalidated when the transaction commits
+        self.writes = []
+
+
+class SessionManager:
+    """
+    Bookkeeping of the open sessions, independent from the database driver. The app checks a
+    session out for each statement so that a session executes one statement at a time, and closes
+    the sessions returned by expired.
+    """
+
+    def __init__(self, idle_timeout: float = 30.0, max_sessions: int = 100):
+        """
+        @param idle_timeout: float          Seconds without statement after which a session expires
+        @param max_sessions: int            Maximum number of sessions open at the same time
+        """
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+
+        # token -> Session
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+        self._opened = 0
+        self._expired = 0
+
+    def open(self, host_name: str, cnx):
+        """
+        Register a session.
+
+        @param host_name: str               Node of the connection
+        @param cnx: connection              Connection pinned to the session
+
+        @return: Session                    New session
+        """
+        session = Session(secrets.token_urlsafe(16), host_name, cnx)
+        with self._lock:
+            if len(self._sessions) >= self.max_sessions:
+                raise SessionLimitError(f"{self.max_sessions} sessions are already open")
+            self._sessions[session.token] = session
+            self._opened += 1
+        return session
+
+    def check_out(self, token: str):
+        """
+        @param token: str                   Session token
+
+        @return: Session                    Session, to give back with check_in or close
+        """
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None:
+                raise SessionNotFoundError(f"Unknown session {token}, it may have expired")
+            if session.busy:
+                raise SessionBusyError(f"Session {token} is executing another statement")
+            session.busy = True
+            return session
+
+    def check_in(self, session: Session):
+        """
+        Give a session checked out with check_out back, its idle timeout starts again.
+        """
+        with self._lock:
+            session.last_used = monotonic()
+            session.busy = False
+
+    def close(self, session: Session):
+        """
+        Forget a checked out session, the caller releases its connection.
+        """
+        with self._lock:
+            self._sessions.pop(session.token, None)
+
+    def expired(self):
+        """
+        Forget the sessions idle for longer than idle_timeout, the caller rolls back and releases
+        their connection.
+
+        @return: list[Session]              Expired sessions
+        """
+        now = monotonic()
+        with self._lock:
+            expired = [
+                session for session in self._sessions.values()
+                if not session.busy and now - session.last_used > self.idle_timeout
+            ]
+            for session in expired:
+                del self._sessions[session.token]
+            self._expired += len(expired)
+        return expired
+
+    def stats(self):
+        """
+        @return: dict                       Open sessions per node and counters
+        """
+        with self._lock:
+            by_node = {}
+            for session in self._sessions.values():
+                by_node[session.host_name] = by_node.get(session.host_name, 0) + 1
+            return {
+                "open": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "by_node": by_node,
+                "opened": self._opened,
+                "expired": self._expired
+            }
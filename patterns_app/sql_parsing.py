@@ -0,0 +1,148 @@
+import functools
+import re
+
+# String literals, quoted identifiers, words, punctuation
+TOKEN_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`|[\w.$@]+|\S")
+# Whitespace is only collapsed outside of string literals
+WHITESPACE_RE = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")|\s+")
+
+# Keywords followed by a table name
+TABLE_KEYWORDS = { "FROM", "JOIN", "UPDATE", "INTO", "TABLE", "TRUNCATE" }
+# Words allowed between such a keyword and the first table: modifiers, IF [NOT] EXISTS, and TABLE of
+# INTO TABLE and TRUNCATE TABLE
+TABLE_MODIFIERS = { "IF", "NOT", "EXISTS", "LOW_PRIORITY", "HIGH_PRIORITY", "DELAYED", "IGNORE", "QUICK", "TABLE" }
+# Keywords ending a list of tables
+CLAUSE_KEYWORDS = {
+    "WHERE", "GROUP", "HAVING", "ORDER", "LIMIT", "JOIN", "INNER", "LEFT", "RIGHT", "CROSS", "NATURAL",
+    "STRAIGHT_JOIN", "ON", "USING", "SET", "VALUES", "VALUE", "SELECT", "UNION", "FOR", "LOCK", "WINDOW",
+    "PARTITION", "USE", "IGNORE", "FORCE", "AS", "INTO", "OUTER", "DUPLICATE", "KEY", "WITH"
+}
+
+
+def statement_params(statement: dict):
+    """
+    @param statement: dict              Statement of a request body, with its query and optionally its params
+
+    @return: list or None               Values of the placeholders of the query, None if there are none. An
+                                        empty list would make mysql-connector skip a prepared statement that
+                                        has placeholders instead of failing
+    """
+    return statement.get('params') or None
+
+def normalize_query(query: str):
+    """
+    Normalise a query so that queries differing only by formatting share the same text.
+
+    @param query: str                   SQL statement
+
+    @return: str                        Statement with whitespace collapsed and trailing semicolons removed
+    """
+    normalized = WHITESPACE_RE.sub(lambda match: match.group(1) or ' ', query).strip()
+    return normalized.rstrip(';').rstrip()
+
+def tokenize(query: str):
+    """
+    @param query: str                   SQL statement
+
+    @return: list[str]                  Tokens of the statement
+    """
+    return TOKEN_RE.findall(query)
+
+def table_name(token: str):
+    """
+    @return: str                        Table name without database prefix and quotes, in lower case
+    """
+    return token.replace('`', '').split('.')[-1].lower()
+
+def is_identifier(token: str):
+    return token.startswith('`') or (token[0].isalpha() or token[0] == '_') and token.upper() not in CLAUSE_KEYWORDS
+
+def referenced_tables(query: str):
+    """
+    Find the tables a statement reads from or writes to.
+
+    @param query: str                   SQL statement
+
+    @return: set[str]                   Table names, in lower case
+    """
+    tokens = tokenize(query)
+    tables = set()
+    i = 0
+    while i < len(tokens):
+        if tokens[i].upper() not in TABLE_KEYWORDS:
+            i += 1
+            continue
+
+        i += 1
+        while i < len(tokens) and tokens[i].upper() in TABLE_MODIFIERS:
+            i += 1
+
+        # List of tables separated by commas, each one with an optional alias
+        while i < len(tokens) and is_identifier(tokens[i]):
+            tables.add(table_name(tokens[i]))
+            i += 1
+            if i < len(tokens) and tokens[i].upper() == "AS":
+                i += 1
+            if i < len(tokens) and is_identifier(tokens[i]):
+                i += 1
+            if i < len(tokens) and tokens[i] == ',':
+                i += 1
+            else:
+                break
+
+    return tables
+
+
+# Leading whitespace and comments, skipped to find the first keyword of a statement
+LEADING_RE = re.compile(r"(?:\s+|/\*.*?\*/|(?:--\s|#)[^\n]*(?:\n|$))*", re.DOTALL)
+WORD_RE = re.compile(r"\w+")
+# Reads that must see the latest data or take locks, or that write, all of them go to the manager
+LOCKING_RE = re.compile(
+    r"\bFOR\s+(?:UPDATE|SHARE)\b|\bLOCK\s+IN\s+SHARE\s+MODE\b|\bINTO\b|\b(?:GET_LOCK|RELEASE_LOCK|LAST_INSERT_ID)\b|;\s*\S",
+    re.IGNORECASE
+)
+# Statements that never modify data
+READ_KEYWORDS = { "SELECT", "SHOW", "EXPLAIN", "DESCRIBE", "DESC", "TABLE", "VALUES", "HELP" }
+
+
+@functools.lru_cache(maxsize=4096)
+def classify_statement(query: str):
+    """
+    Tell whether a statement can be executed on any node. Anything that isn't recognised as a plain
+    read, DML, DDL, transaction control and locking reads included, is a write so that it goes to the
+    manager. Results are cached on the statement text.
+
+    @param query: str                   SQL statement
+
+    @return: str                        "read" or "write"
+    """
+    start = LEADING_RE.match(query).end()
+    if start < len(query) and query[start] == '(':
+        # Parenthesised SELECT
+        start = LEADING_RE.match(query, start + 1).end()
+    match = WORD_RE.match(query, start)
+    if match is None:
+        return "write"
+
+    keyword = match.group().upper()
+    if keyword == "WITH":
+        keyword = cte_statement_keyword(query[match.end():])
+    if keyword not in READ_KEYWORDS or LOCKING_RE.search(query):
+        return "write"
+    return "read"
+
+def cte_statement_keyword(query: str):
+    """
+    @param query: str                   Statement following the WITH keyword of a common table expression
+
+    @return: str                        First keyword after the table expressions, in upper case
+    """
+    depth = 0
+    for token in tokenize(query):
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif depth == 0 and token.upper() in ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "TABLE", "VALUES"):
+            return token.upper()
+    return ""
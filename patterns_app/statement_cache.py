@@ -0,0 +1,124 @@
+import threading
+import weakref
+from collections import OrderedDict
+
+
+class PreparedStatementCache:
+    """
+    LRU cache of the server side prepared statements of one connection.
+
+    Every statement text gets its own prepared cursor. mysql-connector only prepares a statement again
+    when the operation passed to execute isn't the one it prepared last, compared by identity, so the
+    cached cursor is always given back the exact string object it was prepared with.
+    """
+
+    def __init__(self, cnx, max_size: int = 64):
+        """
+        @param cnx: MySQLConnection         Connection owning the statements
+        @param max_size: int                Maximum number of statements kept prepared
+        """
+        # Weak, the cache must not keep its connection alive
+        self.cnx = weakref.proxy(cnx)
+        self.max_size = max_size
+        # statement text -> prepared cursor
+        self._cursors = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def execute(self, query: str, params: list):
+        """
+        Execute a statement with params, preparing it if it isn't already.
+
+        @param query: str                   SQL statement with %s or ? placeholders
+        @param params: list                 Values of the placeholders
+
+        @return: MySQLCursorPrepared        Cursor holding the result
+        """
+        entry = self._cursors.get(query)
+        if entry is not None:
+            self._cursors.move_to_end(query)
+            self.hits += 1
+        else:
+            self.misses += 1
+            entry = (self.cnx.cursor(prepared=True), query)
+            self._cursors[query] = entry
+            while len(self._cursors) > self.max_size:
+                _, (cursor, _) = self._cursors.popitem(last=False)
+                self.evictions += 1
+                # Deallocates the statement on the server
+                _close(cursor)
+
+        cursor, operation = entry
+        try:
+            cursor.execute(operation, params)
+        except Exception:
+            # The statement may not have been prepared, don't keep it
+            del self._cursors[query]
+            _close(cursor)
+            raise
+        return cursor
+
+    def clear(self):
+        """
+        Close every prepared statement.
+        """
+        for cursor, _ in self._cursors.values():
+            _close(cursor)
+        self._cursors.clear()
+
+
+def _close(cursor):
+    # The connection may already be broken, the statement then died with it
+    try:
+        cursor.close()
+    except Exception:
+        pass
+
+
+# id of a live connection -> its cache
+_caches = {}
+# Counters of the caches of the connections gone, so that the totals never go down
+_retired = { "hits": 0, "misses": 0, "evictions": 0 }
+# Reentrant, a connection can be collected, and its cache retired, while the lock is held
+_caches_lock = threading.RLock()
+
+def _retire(key: int):
+    with _caches_lock:
+        cache = _caches.pop(key)
+        for counter in _retired:
+            _retired[counter] += getattr(cache, counter)
+
+def get_statement_cache(cnx, max_size: int = 64):
+    """
+    Returns the prepared statement cache of a connection, created on first use. The cache goes
+    away with the connection, its counters are kept.
+
+    @param cnx: MySQLConnection             Pooled connection
+    @param max_size: int                    Maximum number of statements kept prepared
+
+    @return: PreparedStatementCache         Cache of cnx
+    """
+    with _caches_lock:
+        cache = _caches.get(id(cnx))
+        if cache is None:
+            cache = PreparedStatementCache(cnx, max_size)
+            _caches[id(cnx)] = cache
+            weakref.finalize(cnx, _retire, id(cnx))
+        return cache
+
+def statement_cache_stats():
+    """
+    @return: dict                           Live connections with a cache and their prepared statements, and
+                                            counters since start, those of connections gone included
+    """
+    with _caches_lock:
+        caches = list(_caches.values())
+        stats = {
+            "connections": len(caches),
+            "statements": sum(len(cache._cursors) for cache in caches)
+        }
+        for counter, retired in _retired.items():
+            stats[counter] = retired + sum(getattr(cache, counter) for cache in caches)
+        return stats
@@ -0,0 +1,255 @@
+import json
+import os
+import queue
+import random
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter, time
+from metrics import endpoint_matcher
+
+# Identifier of the trace, generated by the gatekeeper and propagated to the proxy
+TRACE_HEADER = "X-Trace-Id"
+# "1" when the trace is written to the trace logs, decided once by the first app of the request
+SAMPLED_HEADER = "X-Trace-Sampled"
+# Sent by the client with the value "1" to get the timings of the proxy in the response body
+TIMINGS_HEADER = "X-Trace-Timings"
+
+_current = ContextVar("trace", default=None)
+
+
+class Trace:
+    """
+    Timings of the stages of one request in one app. A stage executed several times, for instance
+    by the statements of a batch, adds up.
+    """
+
+    def __init__(self, trace_id: str, sampled: bool, timings: bool):
+        """
+        @param trace_id: str                Identifier shared by the apps handling the request
+        @param sampled: bool                Whether the trace is written to the trace log
+        @param timings: bool                Whether the client asked for the timings
+        """
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.timings = timings
+        self.start = perf_counter()
+        self.started_at = time()
+        # stage -> seconds
+        self.stages = {}
+        self.tags = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def stages_ms(self):
+        """
+        @return: dict                       Stage -> duration in ms
+        """
+        with self._lock:
+            return { name: round(seconds * 1000, 3) for name, seconds in self.stages.items() }
+
+    def headers(self):
+        """
+        @return: dict                       Headers propagating the trace to the next app
+        """
+        headers = { TRACE_HEADER: self.trace_id, SAMPLED_HEADER: "1" if self.sampled else "0" }
+        if self.timings:
+            headers[TIMINGS_HEADER] = "1"
+        return headers
+
+    def server_timing(self):
+        """
+        @return: str                        Stages and total duration as a Server-Timing header value
+        """
+        total = (perf_counter() - self.start) * 1000
+        stages = self.stages_ms()
+        return ", ".join([f"{name};dur={duration}" for name, duration in stages.items()] + [f"total;dur={total:.3f}"])
+
+    def record(self, app_name: str, endpoint: str, status: int):
+        """
+        @return: dict                       Trace log entry of the request
+        """
+        return {
+            "trace_id": self.trace_id,
+            "app": app_name,
+            "endpoint": endpoint,
+            "status": status,
+            "time": self.started_at,
+            "total_ms": round((perf_counter() - self.start) * 1000, 3),
+            "stages_ms": self.stages_ms(),
+            **self.tags
+        }
+
+
+def new_trace_id():
+    return os.urandom(8).hex()
+
+def start_trace(headers, sample_rate: float):
+    """
+    Start the trace of a request, continuing the trace of the previous app if there is one.
+
+    @param headers: Mapping                 Headers of the request
+    @param sample_rate: float               Probability of writing a new trace to the trace log
+
+    @return: Trace                          Trace of the request, also made current
+    """
+    trace_id = headers.get(TRACE_HEADER)
+    if trace_id is not None and 0 < len(trace_id) <= 64 and all(c.isalnum() or c == "-" for c in trace_id):
+        sampled = headers.get(SAMPLED_HEADER) == "1"
+    else:
+        trace_id = new_trace_id()
+        sampled = random.random() < sample_rate
+    trace = Trace(trace_id, sampled, headers.get(TIMINGS_HEADER) == "1")
+    _current.set(trace)
+    return trace
+
+def current_trace():
+    """
+    @return: Trace or None                  Trace of the request being handled
+    """
+    return _current.get()
+
+@contextmanager
+def stage(name: str):
+    """
+    Context manager adding the time spent in its block to a stage of the current trace.
+    """
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, perf_counter() - start)
+
+def add_stage(name: str, since: float):
+    """
+    Add the time elapsed since a perf_counter value to a stage of the current trace, for stages
+    that don't fit in a block.
+    """
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, perf_counter() - since)
+
+def tag(key: str, value):
+    """
+    Attach a value to the trace log entry of the current trace.
+    """
+    trace = _current.get()
+    if trace is not None:
+        trace.tags[key] = value
+
+
+_start_lock = threading.Lock()
+
+class TraceLog:
+    """
+    JSONL file receiving the sampled traces. Entries are written by a daemon thread so that requests
+    never wait on the disk, they are dropped if the writer falls behind.
+    """
+
+    def __init__(self, path: str, max_pending: int = 10000):
+        """
+        @param path: str                    File the entries are appended to, None to disable the log
+        @param max_pending: int             Maximum number of entries waiting to be written
+        """
+        self.path = path
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+
+    def write(self, entry: dict):
+        if self.path is None:
+            return
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with _start_lock:
+            if self._thread is not None:
+                return
+
+            def run():
+                with open(self.path, 'a') as f:
+                    while True:
+                        f.write(json.dumps(self._queue.get(), default=str, separators=(",", ":")) + "\n")
+                        # Flush once the entries available right now are written
+                        if self._queue.empty():
+                            f.flush()
+
+            self._thread = threading.Thread(target=run, name="trace-log", daemon=True)
+            self._thread.start()
+
+
+def trace_flask(app, app_name: str, trace_log: TraceLog, sample_rate: float):
+    """
+    Trace the requests handled by a Flask app. The trace id and the stages are returned in the
+    X-Trace-Id and Server-Timing response headers, sampled traces are written to trace_log.
+    """
+    from flask import request
+
+    @app.before_request
+    def begin_trace():
+        start_trace(request.headers, sample_rate)
+
+    @app.after_request
+    def end_trace(response):
+        trace = current_trace()
+        if trace is None:
+            return response
+        response.headers[TRACE_HEADER] = trace.trace_id
+        response.headers["Server-Timing"] = trace.server_timing()
+        if trace.sampled:
+            endpoint = request.url_rule.rule if request.url_rule is not None else "other"
+            trace_log.write(trace.record(app_name, endpoint, response.status_code))
+        return response
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware tracing the requests, the async apps counterpart of trace_flask.
+    """
+
+    def __init__(self, app, app_name: str, trace_log: TraceLog, sample_rate: float, endpoints: "list[str]"):
+        """
+        @param app: ASGI app                Wrapped app
+        @param app_name: str                Name of the app in the trace log
+        @param trace_log: TraceLog          Log receiving the sampled traces
+        @param sample_rate: float           Probability of sampling a new trace
+        @param endpoints: list[str]         Route paths the requests are reported under, "other" for any other path
+        """
+        self.app = app
+        self.app_name = app_name
+        self.trace_log = trace_log
+        self.sample_rate = sample_rate
+        self.endpoint = endpoint_matcher(endpoints)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = { name.decode("latin-1").title(): value.decode("latin-1") for name, value in scope["headers"] }
+        trace = start_trace(headers, self.sample_rate)
+        endpoint = self.endpoint(scope["path"])
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (TRACE_HEADER.lower().encode("latin-1"), trace.trace_id.encode("latin-1")),
+                    (b"server-timing", trace.server_timing().encode("latin-1"))
+                ]
+                if trace.sampled:
+                    self.trace_log.write(trace.record(self.app_name, endpoint, message["status"]))
+            await send(message)
+
+        await self.app(scope, receive, send_with_trace)
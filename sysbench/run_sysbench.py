@@ -2,6 +2,7 @@ import json
 import os
 import sys
 import paramiko
+from sysbench_results import compare_runs, print_comparison, store_run
 
 
 def get_absolute_path(relative_path: str):
@@ -100,3 +101,11 @@ for stderr in all_stderr:
 print("Error output:\n")
 for line in stderr_lines:
     print(line)
+
+print("Storing sysbench results")
+store_path = get_absolute_path('sysbench_results.jsonl')
+standalone_run = store_run(store_path, get_absolute_path('standalone_sysbench_result.txt'), 'standalone')
+cluster_run = store_run(store_path, get_absolute_path('cluster_sysbench_result.txt'), 'cluster')
+print("done\n")
+
+print_comparison(standalone_run, cluster_run, *compare_runs(standalone_run, cluster_run))
@@ -0,0 +1,234 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from time import time
+
+# Compared metrics, and whether a higher value is better
+METRICS = [
+    ("tps", True),
+    ("qps", True),
+    ("latency_ms.avg", False),
+    ("latency_ms.p95", False),
+    ("latency_ms.max", False),
+    ("ignored_errors", False),
+    ("reconnects", False)
+]
+
+# "    transactions:     1234   (3.43 per sec.)", the rate is optional
+COUNTER_RE = re.compile(r"^\s*([a-z ]+):\s+([\d.]+)s?(?:\s+\(([\d.]+) per sec\.\))?\s*$")
+PERCENTILE_RE = re.compile(r"^\s*(\d+)th percentile:\s+([\d.]+)\s*$")
+VERSION_RE = re.compile(r"^sysbench (\S+)")
+THREADS_RE = re.compile(r"^Number of threads:\s+(\d+)")
+
+
+def get_absolute_path(relative_path: str):
+    return os.path.join(sys.path[0], relative_path)
+
+def parse_sysbench_output(text: str):
+    """
+    Parse the output of a sysbench OLTP run.
+
+    @param text: str                        Output of sysbench ... run
+
+    @return: dict                           tps, qps, read/write/other/total query counts, latency_ms with
+                                            min, avg, max, sum and the percentile as "p95", errors and
+                                            reconnects, ValueError if text isn't sysbench output
+    """
+    record = { "latency_ms": {} }
+    section = None
+    for line in text.splitlines():
+        line = line.rstrip("\r")
+        if line.strip() == "":
+            continue
+        if not line.startswith(" "):
+            section = line.strip().rstrip(":")
+            match = VERSION_RE.match(line)
+            if match:
+                record["sysbench_version"] = match.group(1)
+            match = THREADS_RE.match(line)
+            if match:
+                record["threads"] = int(match.group(1))
+            continue
+
+        match = PERCENTILE_RE.match(line)
+        if match and section == "Latency (ms)":
+            record["latency_ms"][f"p{match.group(1)}"] = float(match.group(2))
+            continue
+        match = COUNTER_RE.match(line)
+        if match is None:
+            continue
+        name, value, rate = match.group(1).strip(), float(match.group(2)), match.group(3)
+        if section == "Latency (ms)":
+            record["latency_ms"][name] = value
+        elif name in ("read", "write", "other", "total"):
+            record[name if name != "total" else "total_queries"] = int(value)
+        elif name == "transactions":
+            record["transactions"], record["tps"] = int(value), float(rate)
+        elif name == "queries":
+            record["queries"], record["qps"] = int(value), float(rate)
+        elif name in ("ignored errors", "reconnects"):
+            record[name.replace(" ", "_")] = int(value)
+        elif name == "total time":
+            record["total_time_s"] = value
+        elif name == "total number of events":
+            record["events"] = int(value)
+
+    missing = [key for key in ("tps", "qps", "total_queries") if key not in record]
+    if missing or "avg" not in record["latency_ms"]:
+        raise ValueError(f"Not the output of a sysbench run, missing {', '.join(missing) or 'the latency'}")
+    return record
+
+def current_commit():
+    """
+    @return: str or None                    Short hash of the checked out commit, None outside a git repository
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, cwd=sys.path[0]
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def store_run(store_path: str, result_path: str, target: str, commit: str = None):
+    """
+    Parse a sysbench result file and append it to the results store.
+
+    @param store_path: str                  JSONL file of the runs
+    @param result_path: str                 Output of sysbench
+    @param target: str                      Database the run was against, e.g. standalone or cluster
+    @param commit: str                      Commit the run was made on, defaults to the checked out one
+
+    @return: dict                           Stored run
+    """
+    with open(result_path, 'r') as f:
+        record = parse_sysbench_output(f.read())
+    run = {
+        "target": target,
+        "commit": commit or current_commit(),
+        "timestamp": time(),
+        "source": os.path.basename(result_path)
+    } | record
+    with open(store_path, 'a') as f:
+        f.write(json.dumps(run) + "\n")
+    return run
+
+def load_runs(store_path: str):
+    """
+    @return: list[dict]                     Runs of the store, oldest first
+    """
+    if not os.path.exists(store_path):
+        return []
+    with open(store_path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip() != ""]
+
+def find_run(runs: "list[dict]", spec: str):
+    """
+    @param runs: list[dict]                 Runs of the store
+    @param spec: str                        target, or target@commit with a prefix of the commit
+
+    @return: dict                           Latest run matching spec, ValueError if there is none
+    """
+    target, _, commit = spec.partition("@")
+    for run in reversed(runs):
+        if run["target"] == target and (commit == "" or (run.get("commit") or "").startswith(commit)):
+            return run
+    raise ValueError(f"No stored run for {spec}")
+
+def get_metric(run: dict, metric: str):
+    value = run
+    for key in metric.split("."):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+def compare_runs(baseline: dict, candidate: dict, tolerance: float = 5.0):
+    """
+    Compare every metric of METRICS between two runs.
+
+    @param baseline: dict                   Reference run
+    @param candidate: dict                  Run compared to baseline
+    @param tolerance: float                 Change in % under which a metric is considered unchanged
+
+    @return: list[dict], str                Per metric values, change in % and verdict, and the overall verdict,
+                                            "regression" if any metric regressed
+    """
+    rows = []
+    for metric, higher_is_better in METRICS:
+        before, after = get_metric(baseline, metric), get_metric(candidate, metric)
+        if before is None or after is None:
+            continue
+        if before == 0:
+            change = 0.0 if after == 0 else float("inf")
+        else:
+            change = (after - before) / before * 100
+        if abs(change) <= tolerance:
+            verdict = "unchanged"
+        elif (change > 0) == higher_is_better:
+            verdict = "improved"
+        else:
+            verdict = "regressed"
+        rows.append({ "metric": metric, "baseline": before, "candidate": after, "change_pct": change, "verdict": verdict })
+
+    verdicts = set(row["verdict"] for row in rows)
+    if "regressed" in verdicts:
+        overall = "regression"
+    elif "improved" in verdicts:
+        overall = "improvement"
+    else:
+        overall = "no change"
+    return rows, overall
+
+def run_label(run: dict):
+    return f"{run['target']}@{run.get('commit') or '?'}"
+
+def print_comparison(baseline: dict, candidate: dict, rows: "list[dict]", overall: str):
+    """
+    Print the comparison of two runs as a table.
+    """
+    columns = ["metric", run_label(baseline), run_label(candidate), "change", "verdict"]
+    print(("{:<16}" + "{:>20}" * 3 + "  {:<10}").format(*columns))
+    for row in rows:
+        print(("{:<16}{:>20.2f}{:>20.2f}{:>19.1f}%  {:<10}").format(
+            row["metric"], row["baseline"], row["candidate"], row["change_pct"], row["verdict"]
+        ))
+    print(f"Verdict: {overall}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Parse, store and compare sysbench results.")
+    parser.add_argument("--store", default=get_absolute_path('sysbench_results.jsonl'), help="JSONL file of the stored runs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parse_parser = subparsers.add_parser("parse", help="Print a sysbench result file as JSON")
+    parse_parser.add_argument("result", help="Output of sysbench")
+
+    store_parser = subparsers.add_parser("store", help="Append a sysbench result file to the store")
+    store_parser.add_argument("result", help="Output of sysbench")
+    store_parser.add_argument("--target", required=True, help="Database the run was against, e.g. standalone or cluster")
+    store_parser.add_argument("--commit", default=None, help="Commit the run was made on, defaults to the checked out one")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two stored runs, given as target or target@commit")
+    compare_parser.add_argument("baseline", help="Reference run, e.g. standalone or cluster@1a2b3c4")
+    compare_parser.add_argument("candidate", help="Run compared to the baseline")
+    compare_parser.add_argument("--tolerance", type=float, default=5.0, help="Change in %% under which a metric is unchanged")
+    compare_parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 on a regression")
+    args = parser.parse_args()
+
+    if args.command == "parse":
+        with open(args.result, 'r') as f:
+            print(json.dumps(parse_sysbench_output(f.read()), indent=2))
+    elif args.command == "store":
+        run = store_run(args.store, args.result, args.target, args.commit)
+        print(f"Stored {run_label(run)}: {run['tps']:.2f} tps, {run['qps']:.2f} qps")
+    else:
+        runs = load_runs(args.store)
+        try:
+            baseline, candidate = find_run(runs, args.baseline), find_run(runs, args.candidate)
+        except ValueError as e:
+            parser.error(str(e))
+        rows, overall = compare_runs(baseline, candidate, args.tolerance)
+        print_comparison(baseline, candidate, rows, overall)
+        if args.fail_on_regression and overall == "regression":
+            sys.exit(1)
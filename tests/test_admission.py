@@ -0,0 +1,86 @@
+import asyncio
+import pytest
+from admission import AdaptiveLimit, AdmissionRejected, AsyncAdmissionController, ThreadedAdmissionController, parse_endpoint_limits
+
+
+def test_limit_shrinks_once_per_slow_period():
+    limit = AdaptiveLimit(2, 10, target_latency=60)
+    # As if the last decrease was long ago, whatever the uptime of the machine
+    limit._last_decrease = float("-inf")
+
+    limit.update(120, False)
+    limit.update(120, False)
+
+    assert limit.value == pytest.approx(9.0)
+
+def test_limit_grows_by_one_every_limit_fast_responses():
+    limit = AdaptiveLimit(2, 10, target_latency=0.5)
+    limit.value = 4.0
+
+    for _ in range(4):
+        limit.update(0.1, False)
+
+    assert int(limit) == 4 and limit.value == pytest.approx(5.0, abs=0.1)
+
+def test_limit_stays_within_bounds():
+    limit = AdaptiveLimit(3, 4, target_latency=0, decrease=0.1)
+
+    limit.update(1, True)
+    assert int(limit) == 3
+    for _ in range(100):
+        limit.update(0, False)
+    assert int(limit) == 4
+
+def test_client_over_its_limit_is_rejected_with_429():
+    controller = ThreadedAdmissionController(AdaptiveLimit(1, 10, 1), client_limit=1)
+    controller.admit("/read-query", "client1")
+    controller.admit("/read-query", "client2")
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.admit("/read-query", "client1")
+    assert rejected.value.status == 429
+
+def test_request_over_the_limit_waits_then_gets_503():
+    controller = ThreadedAdmissionController(AdaptiveLimit(1, 1, 1), queue_timeout=0.05)
+    controller.admit("/read-query", "client1")
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.admit("/read-query", "client2")
+    assert rejected.value.status == 503
+
+    controller.done("/read-query", "client1", 0.01, False)
+    controller.admit("/read-query", "client2")
+    assert controller.in_flight == 1
+
+def test_full_queue_rejects_right_away():
+    controller = ThreadedAdmissionController(AdaptiveLimit(1, 1, 1), queue_size=0)
+    controller.admit("/batch", "client1")
+
+    with pytest.raises(AdmissionRejected, match="Too many requests waiting"):
+        controller.admit("/batch", "client2")
+
+def test_endpoint_limit_only_holds_back_its_endpoint():
+    controller = ThreadedAdmissionController(AdaptiveLimit(1, 10, 1), { "/batch": 1 }, queue_timeout=0.01)
+    controller.admit("/batch", "client1")
+
+    with pytest.raises(AdmissionRejected):
+        controller.admit("/batch", "client2")
+    controller.admit("/read-query", "client2")
+
+def test_async_waiter_is_admitted_when_a_request_ends():
+    async def run():
+        controller = AsyncAdmissionController(AdaptiveLimit(1, 1, 1), queue_timeout=1)
+        await controller.admit("/read-query", "client1")
+        waiter = asyncio.ensure_future(controller.admit("/read-query", "client2"))
+        await asyncio.sleep(0.01)
+        assert controller.queued == 1
+        await controller.done("/read-query", "client1", 0.01, False)
+        await waiter
+        return controller
+
+    controller = asyncio.run(run())
+    assert (controller.in_flight, controller.queued) == (1, 0)
+
+def test_parse_endpoint_limits():
+    assert parse_endpoint_limits(" /batch=4, /write-query=16,") == { "/batch": 4, "/write-query": 16 }
+    assert parse_endpoint_limits("") == {}
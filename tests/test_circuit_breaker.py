@@ -0,0 +1,83 @@
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreakers
+
+
+def state(breakers: CircuitBreakers, host_name: str = "node1"):
+    return breakers.table()[host_name]["state"]
+
+def fail(breakers: CircuitBreakers, times: int, host_name: str = "node1"):
+    for _ in range(times):
+        assert breakers.allow(host_name)
+        breakers.record(host_name, True)
+
+
+def test_opens_after_consecutive_failures():
+    breakers = CircuitBreakers(["node1", "node2"], failure_threshold=3, reset_timeout=60)
+
+    fail(breakers, 2)
+    assert state(breakers) == CLOSED
+    fail(breakers, 1)
+
+    assert state(breakers) == OPEN
+    assert not breakers.allow("node1")
+    assert not breakers.is_available("node1")
+    assert breakers.is_available("node2")
+    assert breakers.table()["node1"]["trips"] == 1
+
+def test_success_resets_the_failures():
+    breakers = CircuitBreakers(["node1"], failure_threshold=3)
+
+    fail(breakers, 2)
+    breakers.allow("node1")
+    breakers.record("node1", False)
+    fail(breakers, 2)
+
+    assert state(breakers) == CLOSED
+
+def test_statement_errors_dont_count():
+    breakers = CircuitBreakers(["node1"], failure_threshold=1)
+
+    breakers.allow("node1")
+    breakers.record("node1", False)
+
+    assert state(breakers) == CLOSED
+
+def test_probed_open_circuit_lets_a_single_trial_through():
+    breakers = CircuitBreakers(["node1"], failure_threshold=1, reset_timeout=0)
+    fail(breakers, 1)
+    assert breakers.due_for_probe() == ["node1"]
+
+    breakers.probed("node1", True)
+
+    assert state(breakers) == HALF_OPEN
+    assert breakers.allow("node1")
+    assert not breakers.allow("node1")
+    assert not breakers.is_available("node1")
+    breakers.record("node1", False)
+    assert state(breakers) == CLOSED
+
+def test_failed_trial_opens_the_circuit_again():
+    breakers = CircuitBreakers(["node1"], failure_threshold=5, reset_timeout=0)
+    fail(breakers, 5)
+    breakers.probed("node1", True)
+
+    fail(breakers, 1)
+
+    assert state(breakers) == OPEN
+    assert breakers.table()["node1"]["trips"] == 2
+
+def test_failed_probe_keeps_the_circuit_open():
+    breakers = CircuitBreakers(["node1"], failure_threshold=1, reset_timeout=60)
+    fail(breakers, 1)
+    assert breakers.due_for_probe() == []
+
+    breakers.probed("node1", False)
+
+    assert state(breakers) == OPEN
+
+def test_late_outcome_of_an_open_circuit_is_ignored():
+    breakers = CircuitBreakers(["node1"], failure_threshold=1, reset_timeout=60)
+    fail(breakers, 1)
+
+    breakers.record("node1", False)
+
+    assert state(breakers) == OPEN
@@ -0,0 +1,72 @@
+import gzip
+import json
+import pytest
+from compression import GZIP, Compressor, compress_chunks, negotiate_encoding
+from metrics import Registry
+
+
+def registry():
+    metrics = Registry("test_")
+    metrics.counter("compressed_responses_total", "", ("encoding",))
+    metrics.counter("compression_input_bytes_total", "", ("encoding",))
+    metrics.counter("compression_output_bytes_total", "", ("encoding",))
+    metrics.counter("compression_cpu_seconds_total", "", ("encoding",))
+    metrics.histogram("compression_ratio", "", ("encoding",), (1.0, 2.0))
+    return metrics
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    (None, None),
+    ("", None),
+    ("gzip", GZIP),
+    ("br", None),
+    ("gzip;q=0", None),
+    ("*", negotiate_encoding("zstd, gzip")),
+    ("identity, gzip;q=0.5", GZIP)
+])
+def test_negotiate_encoding(accept_encoding, expected):
+    assert negotiate_encoding(accept_encoding) == expected
+
+def test_gzip_chunks_decode_as_they_arrive():
+    compressor = Compressor(GZIP)
+    first = compressor.compress(b'{"rows": [1]}\n')
+    # Every chunk is flushed, the client can decode it before the next one
+    assert gzip.decompress(first + compressor.finish()) == b'{"rows": [1]}\n'
+
+def test_compress_chunks_encodes_str_chunks():
+    lines = [json.dumps({ "node": "manager" }) + "\n", json.dumps({ "rows": [["é"]] }) + "\n", b'{"done": true}\n']
+
+    body = b"".join(compress_chunks(iter(lines), Compressor(GZIP), registry()))
+
+    assert gzip.decompress(body) == "".join(line if isinstance(line, str) else line.decode() for line in lines).encode("utf-8")
+
+def test_compress_chunks_closes_the_body():
+    closed = []
+
+    def body():
+        try:
+            yield "first\n"
+            yield "second\n"
+        finally:
+            closed.append(True)
+
+    chunks = compress_chunks(body(), Compressor(GZIP), registry())
+    next(chunks)
+    chunks.close()
+    assert closed == [True]
+
+def test_flask_streamed_str_response_is_compressed():
+    flask = pytest.importorskip("flask")
+    from compression import compress_flask
+
+    app = flask.Flask(__name__)
+    compress_flask(app, Registry("test_"), 1024)
+
+    @app.route("/stream")
+    def stream():
+        return flask.Response((json.dumps({ "rows": [i] }) + "\n" for i in range(3)), content_type="application/x-ndjson")
+
+    response = app.test_client().get("/stream", headers={ "Accept-Encoding": "gzip" })
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.get_data()) == b"".join(b'{"rows": [%d]}\n' % i for i in range(3))
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+import pytest
+from hedging import AsyncAttempt, Attempt, AttemptCancelled, async_hedged_read, hedged_read
+
+
+def test_cancelled_attempt_doesnt_start():
+    attempt = Attempt("node1")
+    attempt.cancel(lambda *args: pytest.fail("nothing to kill"))
+
+    with pytest.raises(AttemptCancelled):
+        with attempt.running(1):
+            pass
+
+def test_kill_checks_out_without_blocking_the_attempt():
+    attempt = Attempt("node1")
+    checked_out = threading.Event()
+    killed = []
+
+    def kill(host_name, connection_id, still_running):
+        # The pool of the kill is saturated until the attempt ends
+        checked_out.wait(5)
+        with still_running() as running:
+            killed.append(running)
+
+    with attempt.running(7):
+        canceller = threading.Thread(target=attempt.cancel, args=(kill,))
+        canceller.start()
+        sleep(0.05)
+    # The statement ended on its own, its connection went back to the pool without waiting for the kill
+    checked_out.set()
+    canceller.join(5)
+
+    assert killed == [False]
+
+def test_kill_is_sent_while_the_statement_runs():
+    attempt = Attempt("node1")
+    killed = []
+
+    def kill(host_name, connection_id, still_running):
+        with still_running() as running:
+            killed.append((host_name, connection_id, running))
+
+    with attempt.running(7):
+        attempt.cancel(kill)
+
+    assert killed == [("node1", 7, True)]
+
+def test_hedged_read_returns_the_first_success():
+    def run(attempt):
+        if attempt.host_name == "node1":
+            return { "node": "node1", "result": ["down"], "error": True }
+        return { "node": attempt.host_name, "result": [[1]] }
+
+    with ThreadPoolExecutor(4) as executor:
+        response, hedge = hedged_read(executor, run, "node1", lambda: "node2", 1.0, lambda *args: None)
+
+    assert (response["node"], hedge) == ("node2", "node2")
+
+def test_hedged_read_returns_the_primary_error_when_all_fail():
+    def run(attempt):
+        return { "node": attempt.host_name, "result": ["down"], "error": True }
+
+    with ThreadPoolExecutor(4) as executor:
+        response, hedge = hedged_read(executor, run, "node1", lambda: "node2", 1.0, lambda *args: None)
+
+    assert (response["node"], hedge) == ("node1", "node2")
+
+def test_async_kill_runs_while_the_statement_runs():
+    killed = []
+
+    async def kill(host_name, connection_id, still_running):
+        async with still_running() as running:
+            killed.append(running)
+
+    async def read():
+        attempt = AsyncAttempt("node1")
+        async with attempt.running(7):
+            attempt.cancel(kill)
+            await asyncio.sleep(0.01)
+        return attempt
+
+    asyncio.run(read())
+    assert killed == [True]
+
+def test_async_hedged_read_cancels_the_slow_attempt():
+    killed = []
+
+    async def run(attempt):
+        async with attempt.running(1 if attempt.host_name == "node1" else 2):
+            await asyncio.sleep(0.5 if attempt.host_name == "node1" else 0)
+        return { "node": attempt.host_name, "result": [[1]] }
+
+    async def kill(host_name, connection_id, still_running):
+        async with still_running() as running:
+            killed.append((host_name, running))
+
+    response, hedge = asyncio.run(async_hedged_read(run, "node1", lambda: "node2", 0.01, kill))
+
+    assert (response["node"], hedge) == ("node2", "node2")
+    assert killed == [("node1", True)]
@@ -0,0 +1,94 @@
+import os
+import threading
+import pytest
+
+moto = pytest.importorskip("moto")
+
+INFRA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "infra")
+
+
+@pytest.fixture
+def setup_infra(monkeypatch):
+    for name, value in (
+        ("AWS_ACCESS_KEY_ID", "testing"), ("AWS_SECRET_ACCESS_KEY", "testing"),
+        ("AWS_SESSION_TOKEN", "testing"), ("AWS_DEFAULT_REGION", "us-east-1")
+    ):
+        monkeypatch.setenv(name, value)
+    # get_absolute_path resolves the scripts from the first entry of sys.path
+    monkeypatch.syspath_prepend(INFRA)
+    import infra_utils
+    import setup_infra
+
+    with moto.mock_ec2():
+        # Clients and resources made by an earlier test would target another mock
+        monkeypatch.setattr(infra_utils, "_ec2_client", None)
+        monkeypatch.setattr(infra_utils, "_thread_resources", threading.local())
+        # The jumpbox and the readiness checks are reached over SSH
+        monkeypatch.setattr(setup_infra, "get_jumpbox_ssh_public_key", lambda dns: "ssh-rsa jumpbox-key")
+        monkeypatch.setattr(setup_infra, "wait_for_instances_ready", lambda jumpbox_dns, hostnames, deadline: None)
+        yield setup_infra
+
+
+def test_create_instances_follows_dependencies(setup_infra, monkeypatch):
+    from infra_utils import InfraInfo, get_ec2_client
+
+    created = []
+    user_data = {}
+    create_ubuntu_instances = setup_infra.create_ubuntu_instances
+
+    def record(*args):
+        name, data = args[7]["Name"], args[8]
+        created.append(name)
+        user_data[name] = data
+        return create_ubuntu_instances(*args)
+
+    monkeypatch.setattr(setup_infra, "create_ubuntu_instances", record)
+
+    infra_info, hostnames = setup_infra.create_instances(InfraInfo(tags={}), max_workers=4)
+
+    assert sorted(created) == sorted(["Jumpbox", "Tinyproxy", "Standalone", "Gatekeeper", "Proxy", "Manager", "Data Node"])
+    assert created[0] == "Jumpbox"
+    assert created[1] == "Tinyproxy"
+    assert created.index("Gatekeeper") < created.index("Proxy")
+    assert created.index("Proxy") < created.index("Manager")
+    assert created.index("Proxy") < created.index("Data Node")
+
+    # Every instance behind the tinyproxy gets its address and the jumpbox key
+    for name in ("Standalone", "Gatekeeper", "Proxy", "Manager", "Data Node"):
+        assert f"http_proxy=http://{hostnames['tinyproxy']['host']}:" in user_data[name]
+        assert "ssh-rsa jumpbox-key" in user_data[name]
+
+    # The proxy only accepts the gatekeeper, the manager and data nodes only the proxy
+    def ingress_ranges(group_name: str, port: int):
+        group = get_ec2_client().describe_security_groups(
+            Filters=[{"Name": "group-name", "Values": [group_name]}]
+        )["SecurityGroups"][0]
+        return [
+            ip_range["CidrIp"]
+            for permission in group["IpPermissions"] if permission.get("FromPort") == port
+            for ip_range in permission["IpRanges"]
+        ]
+
+    assert ingress_ranges("sec_group_proxy", setup_infra.FLASK_PORT) == [hostnames["gatekeeper"]["host"] + "/32"]
+    assert ingress_ranges("sec_group_manager", setup_infra.MYSQL_PORT) == [hostnames["proxy"]["host"] + "/32"]
+    assert ingress_ranges("sec_group_data_node", setup_infra.MYSQL_PORT) == [hostnames["proxy"]["host"] + "/32"]
+    assert ingress_ranges("sec_group_jumpbox", setup_infra.SSH_PORT) == ["0.0.0.0/0"]
+
+    assert infra_info.tags == {"Purpose": "LOG8415E-Project"}
+    assert len(hostnames["data_nodes"]) == 3
+    reservations = get_ec2_client().describe_instances(
+        Filters=[{"Name": "tag:Purpose", "Values": ["LOG8415E-Project"]}]
+    )["Reservations"]
+    assert sum(len(reservation["Instances"]) for reservation in reservations) == 9
+
+
+def test_creation_failure_stops_dependent_tasks(setup_infra, monkeypatch):
+    from infra_utils import InfraInfo
+
+    def fail(*args):
+        raise RuntimeError("no capacity")
+
+    monkeypatch.setattr(setup_infra, "create_gatekeeper", fail)
+
+    with pytest.raises(Exception, match="gatekeeper"):
+        setup_infra.create_instances(InfraInfo(tags={}), max_workers=4)
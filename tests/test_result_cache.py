@@ -0,0 +1,82 @@
+import pytest
+from result_cache import ResultCache
+
+
+def cached(cache: ResultCache, query: str, params: list = None):
+    response, ticket = cache.get(query, params)
+    if response is None:
+        cache.put(ticket, { "node": "manager", "result": [[query]] })
+    return cache.get(query, params)[0] is not None
+
+
+@pytest.mark.parametrize("write", [
+    "UPDATE actor SET first_name = 'A'",
+    "UPDATE LOW_PRIORITY actor SET first_name = 'A'",
+    "DELETE QUICK FROM actor",
+    "DROP TABLE IF EXISTS actor",
+    "TRUNCATE TABLE actor"
+])
+def test_write_invalidates_its_tables_only(write):
+    cache = ResultCache()
+    assert cached(cache, "SELECT * FROM actor")
+    assert cached(cache, "SELECT * FROM film")
+
+    cache.invalidate(write)
+
+    assert cache.get("SELECT * FROM actor")[0] is None
+    assert cache.get("SELECT * FROM film")[0] is not None
+
+def test_write_without_tables_invalidates_everything():
+    cache = ResultCache()
+    assert cached(cache, "SELECT * FROM actor")
+
+    cache.invalidate("CALL refresh_everything()")
+
+    assert cache.get("SELECT * FROM actor")[0] is None
+    assert cache.stats()["invalidations"] == 1
+
+def test_read_started_before_a_write_isnt_stored():
+    cache = ResultCache()
+    _, ticket = cache.get("SELECT * FROM actor")
+
+    cache.invalidate("UPDATE actor SET first_name = 'A'")
+    cache.put(ticket, { "node": "manager", "result": [["stale"]] })
+
+    assert cache.get("SELECT * FROM actor")[0] is None
+
+def test_params_are_part_of_the_key():
+    cache = ResultCache()
+    assert cached(cache, "SELECT * FROM actor WHERE actor_id = %s", [1])
+
+    assert cache.get("SELECT * FROM actor WHERE actor_id = %s", [2])[0] is None
+    assert cache.get("SELECT  *  FROM actor WHERE actor_id = %s", [1])[0] is not None
+
+@pytest.mark.parametrize("query", ["SELECT NOW()", "SELECT * FROM actor FOR UPDATE", "SHOW TABLES", "SELECT @count"])
+def test_uncacheable_reads(query):
+    assert ResultCache().get(query) == (None, None)
+
+def test_expired_entries_are_dropped():
+    cache = ResultCache(ttl=0)
+    cached(cache, "SELECT * FROM actor")
+
+    assert cache.get("SELECT * FROM actor")[0] is None
+    assert cache.stats()["expirations"] >= 1
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResultCache(max_entries=2)
+    cached(cache, "SELECT * FROM actor")
+    cached(cache, "SELECT * FROM film")
+    cache.get("SELECT * FROM actor")
+    cached(cache, "SELECT * FROM rental")
+
+    assert cache.get("SELECT * FROM film")[0] is None
+    assert cache.get("SELECT * FROM actor")[0] is not None
+    assert cache.stats()["evictions"] == 1
+
+def test_large_results_arent_cached():
+    cache = ResultCache(max_rows=1)
+    _, ticket = cache.get("SELECT * FROM actor")
+
+    cache.put(ticket, { "node": "manager", "result": [[1], [2]] })
+
+    assert cache.get("SELECT * FROM actor")[0] is None
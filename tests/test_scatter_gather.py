@@ -0,0 +1,57 @@
+import pytest
+from scatter_gather import ScatterQuery, parse_scatter_query
+
+
+def body(**fields):
+    return { "query": "SELECT id FROM film WHERE {range}", "column": "film_id", "min": 1, "max": 10, "parts": 3 } | fields
+
+
+def test_ranges_cover_every_value_once():
+    query = parse_scatter_query(body(), 8)
+
+    assert query.ranges() == [(1, 4), (5, 7), (8, 10)]
+    assert query.sub_queries()[0] == ("SELECT id FROM film WHERE (film_id BETWEEN 1 AND 4)", (1, 4))
+
+def test_no_more_parts_than_values():
+    assert ScatterQuery("SELECT 1 WHERE {range}", None, "id", 5, 6, 4).ranges() == [(5, 5), (6, 6)]
+
+def test_merge_concatenates_in_range_order():
+    query = ScatterQuery("", None, "id", 1, 4, 2)
+
+    assert query.merge([[[1], [2]], [[3]]]) == [[1], [2], [3]]
+
+def test_merge_on_order_by_with_nulls_first():
+    query = ScatterQuery("", None, "id", 1, 4, 2, order_by=[(1, False)], limit=4)
+
+    merged = query.merge([[[1, None], [2, "b"], [3, "d"]], [[4, "a"], [5, "c"]]])
+
+    assert merged == [[1, None], [4, "a"], [2, "b"], [5, "c"]]
+
+def test_merge_on_mixed_directions():
+    query = ScatterQuery("", None, "id", 1, 4, 2, order_by=[(0, False), (1, True)])
+
+    assert query.merge([[[1, 1], [2, 5]], [[1, 3], [2, 4]]]) == [[1, 3], [1, 1], [2, 5], [2, 4]]
+
+def test_merge_combines_aggregates_per_group():
+    query = ScatterQuery("", None, "id", 1, 4, 2, order_by=[(0, False)], aggregates=["group", "count", "sum", "min", "max"])
+
+    merged = query.merge([
+        [["a", 2, 10, 1, 5], ["b", 1, None, None, None]],
+        [["a", 3, 5, 0, 9], ["b", 1, 4, 2, 2]]
+    ])
+
+    assert merged == [["a", 5, 15, 0, 9], ["b", 2, 4, 2, 2]]
+
+@pytest.mark.parametrize("fields, message", [
+    ({ "query": "SELECT id FROM film" }, "marker"),
+    ({ "query": "DELETE FROM film WHERE {range}" }, "Only reads"),
+    ({ "column": "id; DROP TABLE film" }, "column"),
+    ({ "min": 10, "max": 1 }, "min must not exceed max"),
+    ({ "parts": 9 }, "between 1 and 8"),
+    ({ "order_by": [[0, "up"]] }, "order_by"),
+    ({ "aggregates": ["avg"] }, "aggregates"),
+    ({ "limit": -1 }, "limit")
+])
+def test_parse_rejects_invalid_bodies(fields, message):
+    with pytest.raises(ValueError, match=message):
+        parse_scatter_query(body(**fields), 8)
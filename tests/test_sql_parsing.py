@@ -0,0 +1,55 @@
+import pytest
+from sql_parsing import classify_statement, normalize_query, referenced_tables, statement_params
+
+
+@pytest.mark.parametrize("query, tables", [
+    ("SELECT * FROM actor", {"actor"}),
+    ("SELECT a.first_name FROM sakila.actor a JOIN `film_actor` AS fa ON fa.actor_id = a.actor_id", {"actor", "film_actor"}),
+    ("SELECT * FROM actor, film WHERE actor_id = 1", {"actor", "film"}),
+    ("INSERT INTO actor (first_name) VALUES ('A')", {"actor"}),
+    ("UPDATE actor SET first_name = 'A'", {"actor"}),
+    ("UPDATE LOW_PRIORITY actor SET first_name = 'A'", {"actor"}),
+    ("UPDATE LOW_PRIORITY IGNORE actor SET first_name = 'A'", {"actor"}),
+    ("INSERT LOW_PRIORITY IGNORE INTO actor VALUES (1)", {"actor"}),
+    ("INSERT DELAYED INTO actor VALUES (1)", {"actor"}),
+    ("DELETE LOW_PRIORITY QUICK IGNORE FROM actor WHERE actor_id = 1", {"actor"}),
+    ("DROP TABLE IF EXISTS actor", {"actor"}),
+    ("DROP TEMPORARY TABLE IF EXISTS actor, film", {"actor", "film"}),
+    ("CREATE TABLE IF NOT EXISTS actor (actor_id INT)", {"actor"}),
+    ("TRUNCATE actor", {"actor"}),
+    ("TRUNCATE TABLE actor", {"actor"}),
+    ("LOAD DATA INFILE '/tmp/actor.csv' INTO TABLE actor", {"actor"}),
+    ("SELECT 1", set())
+])
+def test_referenced_tables(query, tables):
+    assert referenced_tables(query) == tables
+
+@pytest.mark.parametrize("query, kind", [
+    ("SELECT * FROM actor", "read"),
+    ("  /* comment */ select 1", "read"),
+    ("-- comment\nSHOW TABLES", "read"),
+    ("(SELECT 1) UNION (SELECT 2)", "read"),
+    ("WITH recent AS (SELECT * FROM rental) SELECT * FROM recent", "read"),
+    ("WITH recent AS (SELECT * FROM rental) DELETE FROM rental", "write"),
+    ("SELECT * FROM actor FOR UPDATE", "write"),
+    ("SELECT * FROM actor LOCK IN SHARE MODE", "write"),
+    ("SELECT * INTO @count FROM actor", "write"),
+    ("SELECT LAST_INSERT_ID()", "write"),
+    ("SELECT 1; DELETE FROM actor", "write"),
+    ("UPDATE actor SET first_name = 'A'", "write"),
+    ("BEGIN", "write"),
+    ("", "write")
+])
+def test_classify_statement(query, kind):
+    assert classify_statement(query) == kind
+
+def test_normalize_query_keeps_string_literals():
+    assert normalize_query("SELECT  *\n FROM actor WHERE name = 'a  b' ;") == "SELECT * FROM actor WHERE name = 'a  b'"
+
+@pytest.mark.parametrize("statement, params", [
+    ({ "query": "SELECT 1" }, None),
+    ({ "query": "SELECT 1", "params": [] }, None),
+    ({ "query": "SELECT ?", "params": [1] }, [1])
+])
+def test_statement_params(statement, params):
+    assert statement_params(statement) == params
@@ -0,0 +1,49 @@
+import gc
+from statement_cache import get_statement_cache, statement_cache_stats
+
+
+class Cursor:
+    def __init__(self):
+        self.prepared = None
+        self.closed = False
+
+    def execute(self, operation, params):
+        self.prepared = operation
+
+    def close(self):
+        self.closed = True
+
+
+class Connection:
+    def cursor(self, prepared: bool = False):
+        return Cursor()
+
+
+def test_statements_are_prepared_once_and_evicted_lru():
+    cnx = Connection()
+    cache = get_statement_cache(cnx, max_size=2)
+
+    first = cache.execute("SELECT ?", [1])
+    assert cache.execute("SELECT ?", [2]) is first
+    cache.execute("SELECT ?, ?", [1, 2])
+    cache.execute("SELECT 1", None)
+
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 3, 1)
+    assert first.closed
+
+def test_counters_survive_their_connection():
+    before = statement_cache_stats()
+    cnx = Connection()
+    cache = get_statement_cache(cnx)
+    assert get_statement_cache(cnx) is cache
+    cache.execute("SELECT ?", [1])
+    cache.execute("SELECT ?", [1])
+    cache.execute("SELECT 1", None)
+
+    del cache, cnx
+    gc.collect()
+    after = statement_cache_stats()
+
+    assert after["connections"] <= before["connections"]
+    assert after["hits"] - before["hits"] == 1
+    assert after["misses"] - before["misses"] == 2
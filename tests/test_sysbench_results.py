@@ -0,0 +1,102 @@
+import math
+import os
+import pytest
+from sysbench_results import compare_runs, parse_sysbench_output
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+def read_sample(name: str):
+    # Bytes as captured, so that the CRLF line endings reach the parser
+    with open(os.path.join(DATA, name), 'rb') as f:
+        return f.read().decode("utf-8")
+
+
+@pytest.mark.parametrize("name", ["sysbench_oltp_read_write.txt", "sysbench_oltp_read_write_crlf.txt"])
+def test_parse_oltp_read_write(name):
+    record = parse_sysbench_output(read_sample(name))
+
+    assert record["sysbench_version"] == "1.0.20"
+    assert record["threads"] == 6
+    assert record["tps"] == 125.00
+    assert record["qps"] == 2500.05
+    assert (record["read"], record["write"], record["other"], record["total_queries"]) == (630028, 180006, 90006, 900040)
+    assert record["transactions"] == 45002
+    assert record["queries"] == 900040
+    assert record["ignored_errors"] == 2
+    assert record["reconnects"] == 0
+    assert record["total_time_s"] == 360.0088
+    assert record["events"] == 45002
+    assert record["latency_ms"] == { "min": 8.74, "avg": 47.99, "max": 412.36, "p95": 73.13, "sum": 2159634.91 }
+
+def test_crlf_sample_has_crlf_line_endings():
+    assert "\r\n" in read_sample("sysbench_oltp_read_write_crlf.txt")
+
+@pytest.mark.parametrize("text", ["", "FATAL: unable to connect to MySQL server on host 'localhost'\n", "<html>502 Bad Gateway</html>"])
+def test_parse_rejects_other_output(text):
+    with pytest.raises(ValueError):
+        parse_sysbench_output(text)
+
+
+def run(tps: float, p95: float, errors: int = 0):
+    return {
+        "target": "cluster", "commit": "abc1234", "tps": tps, "qps": tps * 20,
+        "latency_ms": { "avg": 40.0, "p95": p95, "max": 300.0 }, "ignored_errors": errors, "reconnects": 0
+    }
+
+def verdicts(rows):
+    return { row["metric"]: row["verdict"] for row in rows }
+
+def test_compare_same_runs_is_no_change():
+    rows, overall = compare_runs(run(100, 70), run(100, 70))
+    assert set(verdicts(rows).values()) == { "unchanged" }
+    assert overall == "no change"
+
+def test_compare_changes_within_tolerance_are_unchanged():
+    rows, overall = compare_runs(run(100, 70), run(104, 72), tolerance=5)
+    assert verdicts(rows)["tps"] == "unchanged"
+    assert verdicts(rows)["latency_ms.p95"] == "unchanged"
+    assert overall == "no change"
+
+def test_compare_direction_of_metrics():
+    rows, overall = compare_runs(run(100, 70), run(150, 50))
+    assert verdicts(rows)["tps"] == "improved"
+    assert verdicts(rows)["qps"] == "improved"
+    # Lower latencies are better
+    assert verdicts(rows)["latency_ms.p95"] == "improved"
+    assert overall == "improvement"
+
+    rows, overall = compare_runs(run(100, 70), run(80, 90))
+    assert verdicts(rows)["tps"] == "regressed"
+    assert verdicts(rows)["latency_ms.p95"] == "regressed"
+    assert overall == "regression"
+
+def test_compare_single_regression_wins():
+    rows, overall = compare_runs(run(100, 70), run(150, 90))
+    assert verdicts(rows)["tps"] == "improved"
+    assert overall == "regression"
+
+def test_compare_from_zero():
+    rows, overall = compare_runs(run(100, 70, errors=0), run(100, 70, errors=3))
+    row = next(row for row in rows if row["metric"] == "ignored_errors")
+    assert math.isinf(row["change_pct"])
+    assert row["verdict"] == "regressed"
+    assert overall == "regression"
+
+    rows, _ = compare_runs(run(100, 70, errors=3), run(100, 70, errors=0))
+    assert verdicts(rows)["ignored_errors"] == "improved"
+
+    rows, _ = compare_runs(run(100, 70, errors=0), run(100, 70, errors=0))
+    assert verdicts(rows)["ignored_errors"] == "unchanged"
+
+def test_compare_skips_missing_metrics():
+    baseline = run(100, 70)
+    del baseline["reconnects"]
+    rows, _ = compare_runs(baseline, run(100, 70))
+    assert "reconnects" not in verdicts(rows)
+
+def test_parsed_samples_compare():
+    record = parse_sysbench_output(read_sample("sysbench_oltp_read_write.txt"))
+    rows, overall = compare_runs(record, parse_sysbench_output(read_sample("sysbench_oltp_read_write_crlf.txt")))
+    assert overall == "no change"
+    assert len(rows) == 7